@@ -1,16 +1,68 @@
+import functools
 import math
+import os
+import sys
 from accelergy.plug_in_interface.estimator import Estimator, actionDynamicEnergy
 from utils.bit_functions import *
 from utils.bit_functions import *
 from misc import *
+from utils.batch import BatchEstimator, attribute_columns
 from typing import List
 
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "include")
+)
+from hist_resampling import resample_hist
+
 
 def value2bits(value: int, resolution: int) -> List[int]:
     """Converts a value to a list of bits."""
     return [int(i) for i in bin(value)[2:].zfill(resolution)]
 
 
+@functools.lru_cache(maxsize=None)
+def ladder_code_energy_table(resolution: int) -> np.ndarray:
+    """
+    Returns, for every input code of an X2X ladder, the conversion energy
+    divided by voltage^2 * unit_x. See
+    DigitalAnalogConverterX2XLadder.solve_for_voltage_at_each_node for the
+    ladder equations.
+
+    The node voltages are linear in the input bits: with M the ladder matrix
+    and b the bits (LSB first), the node voltages are voltage * M^-1 b. The
+    current drawn by the set bits is then voltage * (popcount(b) - b^T M^-1 b),
+    so all codes are solved at once with one inverse of M. The table is
+    shared by all DACs with the same resolution and is read-only.
+    """
+    if resolution == 1:
+        matrix = np.array([[4.0]])
+    else:
+        matrix = (
+            np.diag([4.0] + [5.0] * (resolution - 2) + [3.0])
+            - np.diag([2.0] * (resolution - 1), 1)
+            - np.diag([2.0] * (resolution - 1), -1)
+        )
+    codes = np.arange(2**resolution)
+    bits_lsb_first = ((codes[:, None] >> np.arange(resolution)) & 1).astype(float)
+    quadratic = np.einsum(
+        "ij,jk,ik->i", bits_lsb_first, np.linalg.inv(matrix), bits_lsb_first
+    )
+    table = bits_lsb_first.sum(axis=1) - quadratic
+    table.setflags(write=False)
+    return table
+
+
+def resample_hist_to_resolution(hist: List[float], resolution: int) -> np.ndarray:
+    """
+    Resizes hist into the full distribution of values that a DAC with the given
+    resolution can produce. The 0 probability is mapped exactly, both for
+    magnitude (zero in the first bin) and signed (zero in the middle bin)
+    histograms.
+    """
+    n_bins = 2**resolution
+    return resample_hist(hist, n_bins, ((0, 0), (len(hist) // 2, n_bins // 2)))
+
+
 # Models of R-2R ladder and C-2C ladder DACs as described in the paper: A Charge
 # Domain SRAM Compute-in-Memory Macro With C-2C Ladder-Based 8b MAC Unit in
 # 22-nm FinFET Process for Edge Inference
@@ -21,7 +73,7 @@ def value2bits(value: int, resolution: int) -> List[int]:
 # 10.1109/JSSC.2022.3232601
 
 
-class DigitalAnalogConverterX2XLadder(Estimator):
+class DigitalAnalogConverterX2XLadder(Estimator, BatchEstimator):
     """X2X Ladder DAC Accelergy plug-in."""
 
     name = "dac_x2x_ladder"
@@ -139,6 +191,12 @@ class DigitalAnalogConverterX2XLadder(Estimator):
         # Un-reverse the bits
         return lhs[::-1]
 
+    def code_energies(self) -> np.ndarray:
+        """Returns the energy in Joules to convert each input code."""
+        return ladder_code_energy_table(self.resolution) * (
+            self.voltage**2 * self.unit_x
+        )
+
     def input_value_to_analog_energy(self, input_value: int) -> float:
         """Returns the energy in Joules to convert the input value to an analog voltage"""
         input_value_bits = value2bits(input_value, self.resolution)
@@ -155,7 +213,7 @@ class DigitalAnalogConverterX2XLadder(Estimator):
         """Returns the energy in Joules to convert the input value to an analog voltage"""
         # Ignore unused parameters
         _ = latency, load_cap
-        return self.input_value_to_analog_energy(input_value)
+        return float(self.code_energies()[input_value])
 
     @actionDynamicEnergy
     def convert(
@@ -165,40 +223,10 @@ class DigitalAnalogConverterX2XLadder(Estimator):
         ignore_controller_energy: bool = False,
     ):
         """Returns the average energy in Joules to convert the input value to an analog voltage"""
-        energy = 0
-        prob = 0
-
-        # This code resizes the histogram into the full distribution of values
-        # that this DAC can produce. It also makes sure to map the 0
-        # probability exactly.
-        newhist = [0] * 2**self.resolution
-        idx0 = len(self.hist) // 2
-        new_idx0 = len(newhist) // 2
-        width_scale = len(self.hist) / len(newhist)
-        prunedhist = [i for i in self.hist]
-        for exact_maps in [(0, 0), (idx0, new_idx0)]:
-            newhist[exact_maps[1]] = prunedhist[exact_maps[0]] / min(width_scale, 1)
-            prunedhist[exact_maps[0]] = 0
-
-        for i in range(len(newhist)):
-            if i == new_idx0 or i == 0:
-                continue
-            loc = i / len(newhist) * (len(prunedhist) - 1)
-            if width_scale > 1:
-                start = math.floor(loc)
-                end = min(math.ceil(start + width_scale), len(prunedhist) - 1)
-                for j in range(start, end):
-                    newhist[i] += prunedhist[j]
-            else:
-                porp = loc - math.floor(loc)
-                newhist[i] += prunedhist[math.floor(loc)] * (1 - porp)
-                newhist[i] += prunedhist[math.ceil(loc)] * porp
+        newhist = resample_hist_to_resolution(self.hist, self.resolution)
 
         # Calculate the energy
-        for i, p in enumerate(newhist):
-            energy += self.convert_value(i, latency, load_cap) * p
-
-        energy /= sum(newhist)
+        energy = float(np.dot(self.code_energies(), newhist)) / newhist.sum()
         if ignore_controller_energy:
             return energy
         return energy + self.get_controller_energy()
@@ -221,6 +249,53 @@ class DigitalAnalogConverterX2XLadder(Estimator):
             "X2X DAC should not be instantiated directly. Use a subclass."
         )
 
+    @classmethod
+    def _unit_x_batch(cls, columns):
+        return None
+
+    @classmethod
+    def _convert_batch(cls, columns) -> np.ndarray:
+        """
+        Returns convert() energy without the controller energy for each design
+        point. Design points that share a resolution and histogram share one
+        resampled histogram and one ladder code-energy table.
+        """
+        unit_x = cls._unit_x_batch(columns)
+        voltage = columns["voltage"].astype(np.float64)
+        resolution = columns["resolution"]
+        hist = columns.get("hist", np.full(len(resolution), None, dtype=object))
+        per_volt2_unit_x = np.empty(len(resolution))
+        groups = {}
+        for i, (r, h) in enumerate(zip(resolution, hist)):
+            key = (int(r), None if h is None else tuple(h))
+            groups.setdefault(key, []).append(i)
+        for (r, h), rows in groups.items():
+            newhist = resample_hist_to_resolution(h, r)
+            per_volt2_unit_x[rows] = float(
+                np.dot(ladder_code_energy_table(r), newhist)
+            ) / newhist.sum()
+        return per_volt2_unit_x * voltage**2 * unit_x
+
+    @classmethod
+    def _controller_energy_batch(cls, columns) -> np.ndarray:
+        voltage = columns["voltage"].astype(np.float64)
+        technology = columns["technology"].astype(np.float64)
+        scale = columns.get("controller_energy_scale", 1)
+        scale = np.asarray(scale, dtype=np.float64)
+        resolution = columns["resolution"].astype(np.float64)
+        return (voltage * technology) ** 2 * resolution * 8e-17 * scale
+
+    @classmethod
+    def _energy_batch(cls, action, columns, **kwargs):
+        if action == "leak":
+            return np.zeros(len(columns["resolution"]))
+        if action != "convert" or cls._unit_x_batch(columns) is None:
+            return None
+        energy = cls._convert_batch(columns)
+        if kwargs.get("ignore_controller_energy", False):
+            return energy
+        return energy + cls._controller_energy_batch(columns)
+
 
 class DigitalAnalogConverter_C2C(DigitalAnalogConverterX2XLadder):
     """C-2C Ladder DAC."""
@@ -248,12 +323,33 @@ class DigitalAnalogConverter_C2C(DigitalAnalogConverterX2XLadder):
         self.output_capacitance += unit_capacitance * 2
         self.name = f"{resolution}_bit_C2C_ladder_DAC"
         self.cap = Capacitor(
-            self.voltage, capacitance=unit_capacitance, stacked=capacitors_are_stacked
+            capacitance=unit_capacitance,
+            technology=technology,
+            voltage=self.voltage,
+            stacked=capacitors_are_stacked,
         )
 
     def get_area(self):
         return self.cap.get_area() * self.resolution
 
+    @classmethod
+    def _unit_x_batch(cls, columns):
+        return columns["unit_capacitance"].astype(np.float64)
+
+    @classmethod
+    def _area_batch(cls, columns):
+        cap_columns = attribute_columns(
+            Capacitor,
+            dict(
+                capacitance=columns["unit_capacitance"],
+                technology=columns["technology"],
+                voltage=columns["voltage"],
+                stacked=columns["capacitors_are_stacked"],
+            ),
+        )
+        resolution = columns["resolution"].astype(np.float64)
+        return Capacitor._area_batch(cap_columns) * resolution
+
 
 class DigitalAnalogConverter_R2R(DigitalAnalogConverterX2XLadder):
     """R-2R ladder DAC."""
@@ -309,6 +405,32 @@ class DigitalAnalogConverter_R2R(DigitalAnalogConverterX2XLadder):
         # 1.4e-14 ohms/um^2 chip area
         return self.m2_chip_area_per_ohm * self.resolution * self.unit_resistance
 
+    @classmethod
+    def _unit_x_batch(cls, columns):
+        return 1 / columns["unit_resistance"].astype(np.float64) / 2
+
+    @classmethod
+    def _area_batch(cls, columns):
+        technology = columns["technology"].astype(np.float64)
+        m2_chip_area_per_ohm = (
+            0.7e-14 * (technology / 22) ** 2 * columns["area_scale"].astype(float)
+        )
+        resolution = columns["resolution"].astype(np.float64)
+        unit_resistance = columns["unit_resistance"].astype(np.float64)
+        return m2_chip_area_per_ohm * resolution * unit_resistance
+
+    @classmethod
+    def _energy_batch(cls, action, columns, **kwargs):
+        """
+        Batch convert() over design points. The per-point settling-time
+        warning is not issued; use get_latency() to check design points.
+        """
+        if action != "convert":
+            return super()._energy_batch(action, columns, **kwargs)
+        latency = kwargs["action_latency_cycles"] * kwargs["cycle_seconds"]
+        power = cls._convert_batch(columns)
+        return power * latency + cls._controller_energy_batch(columns)
+
 
 # Generate a 5kohm unit resistance R-2R ladder with 8b resolution
 # Print, for each input value, the energy to convert to an analog voltage
@@ -2,9 +2,10 @@ from numbers import Number
 from typing import Optional, List
 from accelergy.plug_in_interface.estimator import Estimator, actionDynamicEnergy
 from utils.bit_functions import *
+from utils.batch import BatchEstimator, or_default
 
 
-class Capacitor(Estimator):
+class Capacitor(Estimator, BatchEstimator):
     name = "capacitor"
     percent_accuracy_0_to_100 = 80
 
@@ -43,6 +44,13 @@ class Capacitor(Estimator):
         supply_voltage = self.voltage if supply_voltage is None else supply_voltage
         return self.capacitance * target_voltage * supply_voltage
 
+    def _level_energies(self, n_levels: int, supply_voltage: float) -> np.ndarray:
+        """raise_voltage_to for each of n_levels evenly-spaced voltages."""
+        if n_levels < 2:
+            raise ValueError(f"Need at least two voltage levels, got {n_levels}")
+        levels = np.arange(n_levels) / (n_levels - 1) * self.voltage
+        return self.capacitance * levels * supply_voltage
+
     @actionDynamicEnergy
     def switch(
         self,
@@ -50,22 +58,39 @@ class Capacitor(Estimator):
         zero_between_values: bool = True,
         supply_voltage: float = None,
     ) -> float:
+        return float(
+            self.switch_batch(
+                [value_probabilities], zero_between_values, supply_voltage
+            )[0]
+        )
+
+    def switch_batch(
+        self,
+        value_probabilities: List[List[Number]],
+        zero_between_values: bool = True,
+        supply_voltage: float = None,
+    ) -> np.ndarray:
+        """
+        Returns the expected energy of switch() for each row of
+        value_probabilities. Each row is a distribution over evenly-spaced
+        voltage levels from 0 to the supply voltage.
+
+        The capacitor is charged from value v0 to value v1 >= v0 (or from 0 if
+        zero_between_values), and discharging costs nothing. Energy is linear
+        in voltage, so the expected energy over all pairs v0 <= v1 is
+        sum_v1 p(v1) * sum_{v0 <= v1} (e(v1) - e(v0)) * p(v0), where the inner
+        sum is e(v1) * P(v0 <= v1) - E[e(v0); v0 <= v1]. Both terms are
+        cumulative sums, so the cost is linear in the number of levels.
+        """
         supply_voltage = self.voltage if supply_voltage is None else supply_voltage
-        expected_energy = 0
-        value_probabilities = rescale_sum_to_1(value_probabilities)
-        for v0, p0 in enumerate(value_probabilities):
-            for v1, p1 in enumerate(value_probabilities):
-                v0 = 0 if zero_between_values else v0
-                if v1 < v0:
-                    continue
-                e0 = self.raise_voltage_to(
-                    v0 / (len(value_probabilities) - 1) * self.voltage, supply_voltage
-                )
-                e1 = self.raise_voltage_to(
-                    v1 / (len(value_probabilities) - 1) * self.voltage, supply_voltage
-                )
-                expected_energy += (e1 - e0) * p0 * p1
-        return expected_energy
+        probs = np.atleast_2d(np.asarray(value_probabilities, dtype=np.float64))
+        probs = probs / probs.sum(axis=1, keepdims=True)
+        energies = self._level_energies(probs.shape[1], supply_voltage)
+        if zero_between_values:
+            return probs @ (energies - energies[0])
+        below = np.cumsum(probs, axis=1)
+        energy_below = np.cumsum(probs * energies, axis=1)
+        return np.sum(probs * (energies * below - energy_below), axis=1)
 
     def get_charging_charge(
         self, value_probabilities: List[Number], charge_probability: float
@@ -79,12 +104,65 @@ class Capacitor(Estimator):
     def charge(
         self, value_probabilities: List[Number], charge_probability: Number = 0.0
     ) -> float:
-        expected_energy = 0
-        for v, p in enumerate(value_probabilities):
-            v = v / (len(value_probabilities) - 1) * self.voltage
-            prob = p * charge_probability
-            expected_energy += self.raise_voltage_to(v) * prob
-        return expected_energy
+        return float(self.charge_batch([value_probabilities], charge_probability)[0])
+
+    def charge_batch(
+        self,
+        value_probabilities: List[List[Number]],
+        charge_probability: Number = 0.0,
+    ) -> np.ndarray:
+        """Returns the expected energy of charge() for each row of
+        value_probabilities. Rows are not normalized, as in charge()."""
+        probs = np.atleast_2d(np.asarray(value_probabilities, dtype=np.float64))
+        energies = self._level_energies(probs.shape[1], self.voltage)
+        return probs @ energies * charge_probability
+
+    @classmethod
+    def _capacitance_batch(cls, columns):
+        return columns["capacitance"].astype(np.float64)
+
+    @classmethod
+    def _area_batch(cls, columns):
+        technology = columns["technology"].astype(np.float64)
+        cap_f_per_m2 = or_default(
+            columns["cap_f_per_m2"], 2.3e-3 * (22 / technology) ** 2
+        )
+        border_area_m2 = or_default(
+            columns["border_area_m2"], 1e-12 * (technology / 22) ** 2
+        )
+        area = cls._capacitance_batch(columns) / cap_f_per_m2 + border_area_m2
+        return np.where(columns["stacked"].astype(bool), 0, area)
+
+    @classmethod
+    def _energy_batch(cls, action, columns, **kwargs):
+        capacitance = cls._capacitance_batch(columns)
+        voltage = columns["voltage"].astype(np.float64)
+        if action in ("write", "update", "leak"):
+            return np.zeros_like(capacitance)
+        if action == "read":
+            energy_scale = columns["energy_scale"].astype(np.float64)
+            return capacitance * voltage * voltage * energy_scale
+        if action == "raise_voltage_to":
+            supply = kwargs.get("supply_voltage", None)
+            supply = voltage if supply is None else supply
+            return capacitance * kwargs["target_voltage"] * supply
+        if action in ("switch", "charge"):
+            # Both are linear in capacitance, voltage, and supply voltage, so
+            # evaluate them once for a unit capacitor and scale.
+            unit = Capacitor(1, 22, voltage=1)
+            if action == "charge":
+                return unit.charge_batch(
+                    [kwargs["value_probabilities"]],
+                    kwargs.get("charge_probability", 0.0),
+                )[0] * capacitance * voltage * voltage
+            supply = kwargs.get("supply_voltage", None)
+            supply = voltage if supply is None else supply
+            return unit.switch_batch(
+                [kwargs["value_probabilities"]],
+                kwargs.get("zero_between_values", True),
+                1,
+            )[0] * capacitance * voltage * supply
+        return None
 
     def get_area(self) -> float:
         if self.stacked:  # Assume stacked on top of other components
@@ -119,7 +197,7 @@ class Wire(Capacitor):
         voltage: Number = 0.7,
         **kwargs,
     ):
-        super().__init__(length * capacitance_per_m, voltage, **kwargs)
+        super().__init__(length * capacitance_per_m, voltage=voltage, **kwargs)
         self.length = length
         self.capacitance_per_m = capacitance_per_m
         self.voltage = voltage
@@ -143,8 +221,17 @@ class Wire(Capacitor):
     def get_area(self):
         return 0
 
+    @classmethod
+    def _capacitance_batch(cls, columns):
+        length = columns["length"].astype(np.float64)
+        return length * columns["capacitance_per_m"].astype(np.float64)
 
-class PassGate(Estimator):
+    @classmethod
+    def _area_batch(cls, columns):
+        return np.zeros(len(columns["length"]))
+
+
+class PassGate(Estimator, BatchEstimator):
     """A basic D-Flip-Flop modeled using NeuroSim."""
 
     name = "pass_gate"
@@ -164,3 +251,14 @@ class PassGate(Estimator):
 
     def leak(self, global_cycle_seconds: float):
         return 0
+
+    @classmethod
+    def _area_batch(cls, columns):
+        tech_node_m = columns["technology"].astype(np.float64) * 1e-9
+        return 2 * columns["transistor_area_f2"].astype(np.float64) * tech_node_m**2
+
+    @classmethod
+    def _energy_batch(cls, action, columns, **kwargs):
+        if action in ("get_energy", "leak"):
+            return np.zeros(len(columns["technology"]))
+        return None
@@ -0,0 +1,127 @@
+import inspect
+from typing import Any, Dict, List, Union
+
+import numpy as np
+
+# Either a list of attribute dictionaries, one per design point, or a dictionary
+# of attribute columns. Columns may be scalars, which are shared by all points.
+# In the column form, every list is a column, so list-valued attributes such as
+# histograms are given once per design point.
+AttributeSets = Union[List[Dict[str, Any]], Dict[str, Any]]
+
+
+def _init_parameters(cls) -> Dict[str, inspect.Parameter]:
+    """
+    Returns the constructor arguments of cls. If the constructor takes
+    **kwargs, the arguments of its parents' constructors are included, since
+    they may be passed through.
+    """
+    params = {}
+    for c in cls.__mro__:
+        if "__init__" not in c.__dict__ or c is object:
+            continue
+        passes_kwargs = False
+        for name, p in inspect.signature(c.__init__).parameters.items():
+            if p.kind == p.VAR_KEYWORD:
+                passes_kwargs = True
+            elif name != "self" and p.kind != p.VAR_POSITIONAL:
+                params.setdefault(name, p)
+        if not passes_kwargs:
+            break
+    return params
+
+
+def attribute_rows(cls, attribute_sets: AttributeSets) -> List[Dict[str, Any]]:
+    """Returns one dictionary of constructor arguments per design point.
+    Attributes that cls does not take are dropped."""
+    params = _init_parameters(cls)
+    if not isinstance(attribute_sets, dict):
+        return [{k: v for k, v in a.items() if k in params} for a in attribute_sets]
+    lengths = {
+        len(v) for v in attribute_sets.values() if isinstance(v, (list, np.ndarray))
+    }
+    if len(lengths) > 1:
+        raise ValueError(f"Attribute columns have different lengths: {lengths}")
+    n = lengths.pop() if lengths else 1
+    return [
+        {
+            k: v[i] if isinstance(v, (list, np.ndarray)) else v
+            for k, v in attribute_sets.items()
+            if k in params
+        }
+        for i in range(n)
+    ]
+
+
+def attribute_columns(cls, attribute_sets: AttributeSets) -> Dict[str, np.ndarray]:
+    """
+    Returns {attribute: array with one value per design point} for the
+    arguments of cls's constructor. Missing attributes take the constructor's
+    default. Columns holding None or non-scalars (e.g., histograms) are object
+    arrays with one element per design point. Required arguments that
+    are missing are left out; the constructor reports them if it is called.
+    """
+    rows = attribute_rows(cls, attribute_sets)
+    columns = {}
+    for name, p in _init_parameters(cls).items():
+        if p.default is p.empty and not all(name in r for r in rows):
+            continue
+        values = [r.get(name, p.default) for r in rows]
+        if any(v is None or not np.isscalar(v) for v in values):
+            columns[name] = np.empty(len(values), dtype=object)
+            for i, v in enumerate(values):
+                columns[name][i] = v
+        else:
+            columns[name] = np.array(values)
+    return columns
+
+
+def or_default(column: np.ndarray, default: np.ndarray) -> np.ndarray:
+    """Elementwise (column or default), as in constructors that treat None and
+    0 as unset."""
+    default = np.broadcast_to(np.asarray(default, dtype=np.float64), column.shape)
+    return np.array(
+        [c if c else d for c, d in zip(column, default)], dtype=np.float64
+    )
+
+
+class BatchEstimator:
+    """
+    Evaluates a plug-in for many attribute sets at once, e.g., for sweeps over
+    voltage, technology, or resolution. Attribute sets are a list of attribute
+    dictionaries or a dictionary of columns (see AttributeSets).
+
+    By default, each design point constructs an estimator. Plug-ins override
+    _area_batch and _energy_batch with closed-form array versions for the
+    areas and actions they can vectorize, and return None to fall back.
+    """
+
+    @classmethod
+    def area_batch(cls, attribute_sets: AttributeSets) -> np.ndarray:
+        """Returns the area of each design point."""
+        result = cls._area_batch(attribute_columns(cls, attribute_sets))
+        if result is None:
+            rows = attribute_rows(cls, attribute_sets)
+            result = [cls(**r).get_area() for r in rows]
+        return np.asarray(result, dtype=np.float64)
+
+    @classmethod
+    def energy_batch(
+        cls, action: str, attribute_sets: AttributeSets, **action_arguments
+    ) -> np.ndarray:
+        """Returns the energy of an action at each design point."""
+        result = cls._energy_batch(
+            action, attribute_columns(cls, attribute_sets), **action_arguments
+        )
+        if result is None:
+            rows = attribute_rows(cls, attribute_sets)
+            result = [getattr(cls(**r), action)(**action_arguments) for r in rows]
+        return np.asarray(result, dtype=np.float64)
+
+    @classmethod
+    def _area_batch(cls, columns: Dict[str, np.ndarray]):
+        return None
+
+    @classmethod
+    def _energy_batch(cls, action: str, columns: Dict[str, np.ndarray], **kwargs):
+        return None
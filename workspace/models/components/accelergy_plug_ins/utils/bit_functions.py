@@ -1,13 +1,14 @@
 import math
 from typing import List
 
+import numpy as np
+
 
 def rescale_sum_to_1(array: List[float], do_not_change_index: int = -1) -> List[float]:
     """Rescales all list elements such that the sum is 1."""
     sum_array = sum([a for i, a in enumerate(array) if i != do_not_change_index])
     target_sum = 1 - array[do_not_change_index] if do_not_change_index >= 0 else 1
     scaleby = target_sum / sum_array
-    print([a * scaleby if i != do_not_change_index else a for i, a in enumerate(array)])
     return [a * scaleby if i != do_not_change_index else a for i, a in enumerate(array)]
 
 
@@ -40,11 +41,14 @@ def bit_distribution_2_hist(
 def hist_2_bit_distribution(hist: List[float]) -> List[float]:
     """Converts a value distribution to a bit distribution."""
     sum_hist = sum(hist)
-    hist = [i / sum_hist for i in hist]
-
-    bit_distribution = [0] * math.ceil(math.log(len(hist), 2))
-    for value in range(len(hist)):
-        for i, bit in enumerate(value2bits(value, len(bit_distribution))):
-            bit_distribution[i] += hist[value] * bit
-
+    hist = np.asarray(hist, dtype=np.float64) / sum_hist
+
+    # Bit plane i (MSB first) selects the values with bit i set. Summing them
+    # in value order with cumsum matches accumulating one value at a time.
+    n_bits = math.ceil(math.log(len(hist), 2))
+    values = np.arange(len(hist))
+    bit_distribution = []
+    for shift in range(n_bits - 1, -1, -1):
+        selected = hist[(values >> shift) & 1 == 1]
+        bit_distribution.append(float(np.cumsum(selected)[-1]) if selected.size else 0)
     return bit_distribution
@@ -0,0 +1,114 @@
+# Resamples value histograms to a different number of bins. Shared by the
+# encodings in slicing_encoding.py, which expect 2^N-1 bins, and the Accelergy
+# plug-ins, which expect one bin per code of the component.
+#
+# Bin i of an n-bin histogram covers [i / n, (i + 1) / n) of the value range.
+# Resampling is conservative: each target bin receives the probability mass
+# of the source range it covers, so the total is unchanged. Pinned bins (by
+# default, the zero of a signed 2^N-1 bin histogram) are mapped exactly.
+
+import functools
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+RESAMPLE_CACHE_SIZE = 1024
+
+# (source bin, target bin) pairs whose probability is moved exactly
+PinnedBins = Tuple[Tuple[int, int], ...]
+
+
+def zero_bin(n_bins: int) -> int:
+    """Returns the bin holding zero in a signed histogram with n_bins bins."""
+    return n_bins // 2
+
+
+def _resample(hist: np.ndarray, n_bins: int, pinned: PinnedBins) -> np.ndarray:
+    n_src = len(hist)
+    if n_src == n_bins and all(s == t for s, t in pinned):
+        return hist
+    hist = hist.copy()
+    result = np.zeros(n_bins)
+    for src, tgt in pinned:
+        result[tgt] += hist[src]
+        hist[src] = 0
+
+    # Cumulative mass at the target bin edges, with the source mass spread
+    # uniformly over each source bin
+    src_edges = np.arange(n_src + 1) / n_src
+    cdf = np.concatenate([[0.0], np.cumsum(hist)])
+    tgt_edges = np.arange(n_bins + 1) / n_bins
+    mass = np.diff(np.interp(tgt_edges, src_edges, cdf))
+
+    # Mass that lands in a pinned target bin goes to the nearest unpinned bin
+    # on the side it came from, or on the other side if there is none
+    pinned_tgt = {tgt for _, tgt in pinned}
+    for tgt in sorted(pinned_tgt):
+        middle = np.interp((tgt + 0.5) / n_bins, src_edges, cdf)
+        halves = (
+            (middle - np.interp(tgt_edges[tgt], src_edges, cdf), -1),
+            (np.interp(tgt_edges[tgt + 1], src_edges, cdf) - middle, 1),
+        )
+        mass[tgt] = 0
+        for half, step in halves:
+            dest = tgt + step
+            while dest in pinned_tgt:
+                dest += step
+            if not 0 <= dest < n_bins:
+                dest = tgt - step
+                while dest in pinned_tgt:
+                    dest -= step
+            if not 0 <= dest < n_bins:
+                dest = tgt  # Every bin is pinned
+            mass[dest] += half
+    return result + mass
+
+
+@functools.lru_cache(maxsize=RESAMPLE_CACHE_SIZE)
+def _resample_cached(hist: tuple, n_bins: int, pinned: PinnedBins) -> np.ndarray:
+    result = _resample(np.array(hist, dtype=np.float64), n_bins, pinned)
+    result.setflags(write=False)
+    return result
+
+
+def resample_hist(
+    hist: Sequence[float], n_bins: int, pinned: Optional[PinnedBins] = None
+) -> np.ndarray:
+    """
+    Returns hist resampled to n_bins bins. pinned lists (source bin, target
+    bin) pairs that are mapped exactly. It defaults to the zero bins of signed
+    histograms. A histogram that already has n_bins bins and only pins bins to
+    themselves is returned unchanged.
+
+    Results are cached per histogram, bin count and pins, so a histogram used
+    by many components is resampled once per resolution. The returned array is
+    read-only; copy it before editing.
+    """
+    if pinned is None:
+        pinned = ((zero_bin(len(hist)), zero_bin(n_bins)),)
+    pinned = tuple(sorted({(int(s), int(t)) for s, t in pinned}))
+    if len(hist) == 0 or n_bins < 1:
+        raise ValueError(f"Can not resample {len(hist)} bins to {n_bins} bins.")
+    for s, t in pinned:
+        if not (0 <= s < len(hist) and 0 <= t < n_bins):
+            raise ValueError(
+                f"Pinned bins {(s, t)} out of range for resampling {len(hist)} "
+                f"bins to {n_bins} bins."
+            )
+    return _resample_cached(tuple(float(h) for h in hist), n_bins, pinned)
+
+
+def resample_hist_to_bits(
+    hist: Sequence[float], n_bits: int, pinned: Optional[PinnedBins] = None
+) -> np.ndarray:
+    """Returns hist resampled to the 2^n_bits-1 bins of a signed n_bits-bit
+    histogram, as the encodings in slicing_encoding.py expect."""
+    return resample_hist(hist, 2**n_bits - 1, pinned)
+
+
+def resample_cache_info():
+    return _resample_cached.cache_info()
+
+
+def clear_resample_cache():
+    _resample_cached.cache_clear()
@@ -3,31 +3,223 @@
 # 2. Convert to signed: x = abs(x) * (2 ** (INPUT_BITS - 1) - 1)
 # 2. x = round(x * (2 ** INPUT_BITS - 1))
 
+import functools
+import os
+import sys
+import threading
+from collections import OrderedDict
 from math import log2
-from typing import List, NamedTuple, Union
+from typing import Dict, Iterator, List, NamedTuple, Union
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from hist_resampling import clear_resample_cache, resample_hist, resample_hist_to_bits
 
 class ProbableBits(NamedTuple):
     bits: list
     probability: float
 
+
+class EncodedHist(list):
+    """
+    An encoded histogram: a list with one ProbableBits per value, also held as
+    arrays. Row i of bits holds the bits (MSB first) that encode the i-th
+    value, which occurs with probability probabilities[i]. Editing the list
+    rebuilds the arrays the next time they are used.
+    """
+
+    def __init__(self, bits: np.ndarray, probabilities: np.ndarray):
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+        bits = np.asarray(bits, dtype=np.int64)
+        if bits.ndim != 2:
+            bits = bits.reshape(len(probabilities), -1)
+        super().__init__(
+            ProbableBits(b, p) for b, p in zip(bits.tolist(), probabilities.tolist())
+        )
+        self._arrays = (bits, probabilities)
+
+    def _get_arrays(self):
+        if getattr(self, "_arrays", None) is None:
+            probabilities = np.array([e.probability for e in self], dtype=np.float64)
+            bits = np.array([e.bits for e in self], dtype=np.int64)
+            bits = bits.reshape(len(self), -1 if len(self) else 0)
+            self._arrays = (bits, probabilities)
+        return self._arrays
+
+    @property
+    def bits(self) -> np.ndarray:
+        return self._get_arrays()[0]
+
+    @property
+    def probabilities(self) -> np.ndarray:
+        return self._get_arrays()[1]
+
+    @property
+    def n_bits(self) -> int:
+        return self.bits.shape[1]
+
+    def copy(self) -> "EncodedHist":
+        """A shallow copy that shares the (unchanged) arrays."""
+        copied = EncodedHist.__new__(EncodedHist)
+        list.extend(copied, self)
+        copied._arrays = getattr(self, "_arrays", None)
+        return copied
+
+    def __repr__(self) -> str:
+        return f"EncodedHist({list.__repr__(self)})"
+
+
+def _edits_list(name: str):
+    method = getattr(list, name)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._arrays = None
+        return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+for _name in (
+    "__setitem__",
+    "__delitem__",
+    "__iadd__",
+    "__imul__",
+    "append",
+    "extend",
+    "insert",
+    "pop",
+    "remove",
+    "clear",
+    "sort",
+    "reverse",
+):
+    setattr(EncodedHist, _name, _edits_list(_name))
+
+
+def as_encoded_hist(encoded_hist: Union[EncodedHist, List[ProbableBits]]):
+    if isinstance(encoded_hist, EncodedHist):
+        return encoded_hist
+    return EncodedHist(
+        [e.bits for e in encoded_hist], [e.probability for e in encoded_hist]
+    )
+
+# ==============================================================================
+# Caching. Variables call the same encodings for the same histograms many
+# times per spec and for every layer with the same histograms, so the results
+# are memoized. Each call returns a copy of the cached EncodedHist that shares
+# its read-only arrays, so callers may edit the result like any list.
+# ==============================================================================
+
+ENCODING_CACHE_SIZE = 1024
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class _LRUCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def __reduce__(self):
+        # Functions from this file may be pickled by value with their results;
+        # don't send the cached entries along.
+        return (_LRUCache, (self.maxsize,))
+
+
+_CACHES: Dict[str, _LRUCache] = {}
+
+
+def _array_key(x) -> tuple:
+    x = np.asarray(x)
+    return (x.dtype.str, x.shape, x.tobytes())
+
+
+def _freeze(encoded: EncodedHist) -> EncodedHist:
+    encoded.bits.setflags(write=False)
+    encoded.probabilities.setflags(write=False)
+    return encoded
+
+
+def _memoize_encoding(encoder):
+    """
+    Memoizes an encoding function on the bytes of the histogram. The wrapped
+    function takes an optional n_bits; if given and nonzero, the histogram is
+    first resampled to the 2^n_bits-1 bins of an n_bits-bit value.
+    """
+    cache = _CACHES.setdefault(encoder.__name__, _LRUCache(ENCODING_CACHE_SIZE))
+
+    @functools.wraps(encoder)
+    def wrapper(weights, n_bits: int = None):
+        if n_bits:
+            weights = resample_hist_to_bits(weights, n_bits)
+        cached = cache.get(_array_key(weights), lambda: _freeze(encoder(weights)))
+        return cached.copy()
+
+    return wrapper
+
+
+def encoding_cache_info() -> Dict[str, CacheInfo]:
+    """Returns the hits, misses, and size of each encoding function's cache."""
+    return {name: c.info() for name, c in _CACHES.items()}
+
+
+def clear_encoding_cache():
+    for c in _CACHES.values():
+        c.clear()
+    clear_resample_cache()
+
 # ==============================================================================
 # Encoding functions
 # ==============================================================================
 
 
-def magnitude_encode_hist(weights) -> List[ProbableBits]:
+@_memoize_encoding
+def magnitude_encode_hist(weights) -> EncodedHist:
     """
     A signed value is encoded as a positive or negative magnitude of that value.
     Signed hardware is requireed.
     """
     nbits = get_num_bits(weights)
-    encoded = []
     halfwidth = len(weights) / 2
-    for i, w in enumerate(weights):
-        normed = norm(i, len(weights), -halfwidth + 0.5, halfwidth + 0.5)
-        encoded.append(ProbableBits(to_bits_unsigned(abs(normed), nbits)[1:], w))
-    return norm_encoded_hist(encoded)
+    normed = norm(
+        _bin_indices(weights), len(weights), -halfwidth + 0.5, halfwidth + 0.5
+    )
+    bits = to_bits_unsigned_array(np.abs(normed), nbits)[:, 1:]
+    return norm_encoded_hist(EncodedHist(bits, weights))
 
+@_memoize_encoding
 def two_part_magnitude_encode_hist(weights):
     """
     Two (devices, timesteps, components, etc.) encode each signed value. If the
@@ -36,12 +228,11 @@ def two_part_magnitude_encode_hist(weights):
     other device encodes 0.
     """
     m = magnitude_encode_hist(weights)
-    m2 = []
-    for e in m:
-        m2.append(ProbableBits(e.bits, e.probability / 2))
-        m2.append(ProbableBits([0] * len(e.bits), e.probability / 2))
-    return m2
+    bits = np.zeros((len(m) * 2, m.n_bits), dtype=np.int64)
+    bits[0::2] = m.bits
+    return EncodedHist(bits, np.repeat(m.probabilities / 2, 2))
 
+@_memoize_encoding
 def offset_encode_hist(weights):
     """
     A signed value is encoded as the the value minus the negative minimum value.
@@ -49,13 +240,12 @@ def offset_encode_hist(weights):
     back after computation.
     """
     nbits = get_num_bits(weights)
-    encoded = []
-    for i, w in enumerate(weights):
-        normed = norm(i, len(weights), 0, len(weights))
-        encoded.append(ProbableBits(to_bits_unsigned(normed, nbits), w))
-    return norm_encoded_hist(encoded)
+    normed = norm(_bin_indices(weights), len(weights), 0, len(weights))
+    bits = to_bits_unsigned_array(normed, nbits)
+    return norm_encoded_hist(EncodedHist(bits, weights))
 
 
+@_memoize_encoding
 def offset_encode_if_signed_hist(weights):
     """
     Offset encode a value only if it is signed. Otherwise, don't apply any bias and just
@@ -66,6 +256,7 @@ def offset_encode_if_signed_hist(weights):
     return magnitude_encode_hist(weights)
 
 
+@_memoize_encoding
 def two_part_magnitude_encode_if_signed_hist(weights):
     """
     Two part magnitude encode a value only if it is signed. Otherwise, use only posiive
@@ -76,34 +267,33 @@ def two_part_magnitude_encode_if_signed_hist(weights):
     return magnitude_encode_hist(weights)
 
 
+@_memoize_encoding
 def xnor_encode_hist(weights):
     """
     XNOR encoding based on Jia JSSCC 2020.
     """
     nbits = get_num_bits(weights)
-    encoded = []
     halfwidth = len(weights) / 2
-    for i, w in enumerate(weights):
-        normed = norm(i, len(weights), -halfwidth + 0.5, halfwidth + 0.5)
-        bits = []
-        for j in list(range(nbits - 1, -1, -1)) + [-1, -1]:
-            bits.append(int(normed > 0))
-            normed -= 2**j * (2 * bits[-1] - 1)
-        assert normed == 0, f"normed={normed} is not 0"
-        encoded.append(ProbableBits(bits, w))
-    return norm_encoded_hist(encoded)
+    normed = norm(
+        _bin_indices(weights), len(weights), -halfwidth + 0.5, halfwidth + 0.5
+    )
+    bits = []
+    for j in list(range(nbits - 1, -1, -1)) + [-1, -1]:
+        bits.append((normed > 0).astype(np.int64))
+        normed = normed - 2.0**j * (2 * bits[-1] - 1)
+    assert np.all(normed == 0), f"normed={normed[normed != 0]} is not 0"
+    return norm_encoded_hist(EncodedHist(np.stack(bits, axis=1), weights))
 
 
+@_memoize_encoding
 def zero_gated_xnor_encode_hist(weights):
     """
     XNOR encoding with zero gating based on Jia JSSCC 2020.
     """
     encoded = xnor_encode_hist(weights)
-    zero_idx = len(encoded) // 2
-    encoded[zero_idx] = ProbableBits(
-        [0] * len(encoded[zero_idx].bits), encoded[zero_idx].probability
-    )
-    return encoded
+    bits = encoded.bits.copy()
+    bits[len(encoded) // 2] = 0
+    return EncodedHist(bits, encoded.probabilities)
 
 # ==============================================================================
 # Helper functions
@@ -118,9 +308,11 @@ def assert_hist_pow2_minus1(hist):
     ), f"Histogram length {len(hist)} is not a power of 2 minus 1."
 
 
-def norm_encoded_hist(encoded_hist: List[ProbableBits]):
-    sum_probs = sum([e.probability for e in encoded_hist])
-    return [ProbableBits(e.bits, e.probability / sum_probs) for e in encoded_hist]
+def norm_encoded_hist(encoded_hist: Union[EncodedHist, List[ProbableBits]]):
+    encoded_hist = as_encoded_hist(encoded_hist)
+    # Python's sum() so the total is the same as summing a list of ProbableBits
+    sum_probs = sum(encoded_hist.probabilities.tolist())
+    return EncodedHist(encoded_hist.bits, encoded_hist.probabilities / sum_probs)
 
 
 def get_num_bits(hist):
@@ -153,17 +345,29 @@ def to_bits_unsigned(x, nbits):
     return [int(i) for i in bin(x)[2 : nbits + 2].zfill(nbits)]
 
 
+def to_bits_unsigned_array(x: np.ndarray, nbits: int) -> np.ndarray:
+    """to_bits_unsigned for an array of values. Returns one row per value."""
+    x = np.round(x).astype(np.int64)  # Rounds half to even like round()
+    in_range = (0 <= x) & (x < 2**nbits)
+    assert np.all(in_range), f"x={x[~in_range]} is not in range [0, 2^{nbits})"
+    return (x[:, None] >> np.arange(nbits - 1, -1, -1)) & 1
+
+
 def norm(x, nbins, rmin, rmax):
     return x / nbins * (rmax - rmin) + rmin
 
 
-def encoded_hist_to_avg_slice(
-    encoded_hist: List[ProbableBits],
+def _bin_indices(hist) -> np.ndarray:
+    return np.arange(len(hist), dtype=np.float64)
+
+
+def _slice_scales(
     total_bits: int,
     bits_per_slice: Union[list, int],
-    partial_slices_use_full_range: bool = False,
-    return_per_slice: bool = False,
+    partial_slices_use_full_range: bool,
 ):
+    """Returns the bits in each slice and, for each bit, the value it adds to
+    its slice when set, normalized to the slice's maximum value."""
     if isinstance(bits_per_slice, int):
         bits_per_slice = [bits_per_slice] * (total_bits // bits_per_slice)
         if sum(bits_per_slice) != total_bits:
@@ -173,21 +377,79 @@ def encoded_hist_to_avg_slice(
         f"Sum of bits per slice {sum(bits_per_slice)} != total_bits " f"{total_bits}"
     )
 
-    bit2slice = []
+    scales = []
     max_val = max(2 ** max(bits_per_slice) - 1, 1)
     for i, b in enumerate(bits_per_slice):
         m = max(2**b - 1, 1) if partial_slices_use_full_range else max_val
-        bit2slice += [(i, max((2 ** (b - j - 1)), 1) / m) for j in range(b)]
+        scales += [max((2 ** (b - j - 1)), 1) / m for j in range(b)]
+    return list(bits_per_slice), np.array(scales)
 
-    avg_slice_values = [0] * len(bits_per_slice)
-    for e in encoded_hist:
-        for i in range(total_bits):
-            slice_idx, scale = bit2slice[i]
-            if i >= len(e.bits):
-                bit_value = sum(e.bits) / len(e.bits)
-            else:
-                bit_value = e.bits[i]
-            avg_slice_values[slice_idx] += bit_value * e.probability * scale
+
+_AVG_SLICE_CACHE = _CACHES.setdefault(
+    "encoded_hist_to_avg_slice", _LRUCache(ENCODING_CACHE_SIZE)
+)
+
+
+def encoded_hist_to_avg_slice(
+    encoded_hist: Union[EncodedHist, List[ProbableBits]],
+    total_bits: int,
+    bits_per_slice: Union[list, int],
+    partial_slices_use_full_range: bool = False,
+    return_per_slice: bool = False,
+):
+    encoded_hist = as_encoded_hist(encoded_hist)
+    args = (
+        total_bits,
+        bits_per_slice if isinstance(bits_per_slice, int) else tuple(bits_per_slice),
+        bool(partial_slices_use_full_range),
+        bool(return_per_slice),
+    )
+    key = (_array_key(encoded_hist.bits), _array_key(encoded_hist.probabilities), args)
+    result = _AVG_SLICE_CACHE.get(
+        key,
+        lambda: _encoded_hist_to_avg_slice(
+            encoded_hist,
+            total_bits,
+            bits_per_slice,
+            partial_slices_use_full_range,
+            return_per_slice,
+        ),
+    )
+    return list(result) if return_per_slice else result
+
+
+def _encoded_hist_to_avg_slice(
+    encoded_hist: EncodedHist,
+    total_bits: int,
+    bits_per_slice: Union[list, int],
+    partial_slices_use_full_range: bool,
+    return_per_slice: bool,
+):
+    bits_per_slice, scales = _slice_scales(
+        total_bits, bits_per_slice, partial_slices_use_full_range
+    )
+
+    # Bits past the end of the encoding take the average bit value
+    n_present = min(total_bits, encoded_hist.n_bits)
+    bit_values = np.empty((len(encoded_hist), total_bits))
+    bit_values[:, :n_present] = encoded_hist.bits[:, :n_present]
+    if n_present < total_bits:
+        if encoded_hist.n_bits == 0 and len(encoded_hist):
+            raise ZeroDivisionError("Can not average the bits of a 0-bit encoding")
+        bit_values[:, n_present:] = (
+            encoded_hist.bits.sum(axis=1) / max(encoded_hist.n_bits, 1)
+        )[:, None]
+    contributions = (
+        bit_values * encoded_hist.probabilities[:, None] * scales[None, :]
+    )
+
+    # cumsum adds sequentially in the order values x bits, so the result is
+    # identical to accumulating one value at a time
+    avg_slice_values, start = [], 0
+    for b in bits_per_slice:
+        c = contributions[:, start : start + b].ravel()
+        avg_slice_values.append(float(np.cumsum(c)[-1]) if c.size else 0)
+        start += b
 
     if return_per_slice:
         return avg_slice_values
@@ -195,8 +457,118 @@ def encoded_hist_to_avg_slice(
     return sum(avg_slice_values) / len(avg_slice_values)
 
 
+# ==============================================================================
+# Bit-plane statistics. Expected bit and slice values follow from the
+# probability of each bit being set, so they can be computed with one pass
+# over each bit plane instead of per-value accumulation. Results equal those of
+# encoded_hist_to_avg_slice up to floating-point summation order.
+# ==============================================================================
+
+
+class SliceStatistics(NamedTuple):
+    bit_probabilities: np.ndarray  # P(bit is 1) for each bit, MSB first
+    slice_values: np.ndarray  # Expected value of each slice, normalized
+    avg_slice_value: float
+
+
+def hist_bit_probabilities(hist, n_bits: int = None) -> np.ndarray:
+    """
+    Returns the probability that each bit (MSB first) of an unsigned value is
+    1, where hist[v] is the relative frequency of value v.
+    """
+    hist = np.asarray(hist, dtype=np.float64)
+    if n_bits is None:
+        n_bits = max(int(len(hist) - 1).bit_length(), 1)
+    values = np.arange(len(hist))
+    shifts = np.arange(n_bits - 1, -1, -1)
+    planes = (values[None, :] >> shifts[:, None]) & 1
+    return planes @ hist / hist.sum()
+
+
+def encoded_bit_probabilities(
+    encoded_hist: Union[EncodedHist, List[ProbableBits]], total_bits: int = None
+) -> np.ndarray:
+    """
+    Returns the probability that each bit (MSB first) of an encoded histogram
+    is 1. Bits past the end of the encoding take the average bit value, as in
+    encoded_hist_to_avg_slice.
+    """
+    encoded_hist = as_encoded_hist(encoded_hist)
+    n_bits = encoded_hist.n_bits
+    total_bits = n_bits if total_bits is None else total_bits
+    p = encoded_hist.probabilities
+    n_present = min(total_bits, n_bits)
+    probs = np.empty(total_bits)
+    probs[:n_present] = p @ encoded_hist.bits[:, :n_present]
+    if n_present < total_bits:
+        probs[n_present:] = p @ encoded_hist.bits.sum(axis=1) / n_bits
+    return probs
+
+
+def slice_statistics(
+    encoded_hist: Union[EncodedHist, List[ProbableBits]],
+    total_bits: int,
+    bits_per_slice: Union[list, int],
+    partial_slices_use_full_range: bool = False,
+) -> SliceStatistics:
+    """
+    Returns per-bit and per-slice expectations of an encoded histogram. The
+    arguments are the same as for encoded_hist_to_avg_slice. slice_values and
+    avg_slice_value match its per-slice and average results.
+    """
+    bits_per_slice, scales = _slice_scales(
+        total_bits, bits_per_slice, partial_slices_use_full_range
+    )
+    bit_probs = encoded_bit_probabilities(encoded_hist, total_bits)
+    bit_values = bit_probs * scales
+    ends = np.cumsum(bits_per_slice)
+    slice_values = np.array(
+        [bit_values[e - b : e].sum() for b, e in zip(bits_per_slice, ends)]
+    )
+    return SliceStatistics(bit_probs, slice_values, float(slice_values.mean()))
+
+
+def _reference_avg_slice(encoded_hist, total_bits, bits_per_slice):
+    """Per-value accumulation, as encoded_hist_to_avg_slice used to be. For the
+    benchmark below."""
+    _, scales = _slice_scales(total_bits, bits_per_slice, False)
+    slice_of_bit = np.repeat(np.arange(total_bits // bits_per_slice), bits_per_slice)
+    avg_slice_values = [0] * (total_bits // bits_per_slice)
+    for e in encoded_hist:
+        for i in range(total_bits):
+            avg_slice_values[slice_of_bit[i]] += e.bits[i] * e.probability * scales[i]
+    return sum(avg_slice_values) / len(avg_slice_values)
+
+
+def benchmark(bit_widths=(8, 12, 16), bits_per_slice: int = 4, repeats: int = 3):
+    """Times the ways of computing the average slice value of an offset-encoded
+    histogram at each bit width."""
+    import time
+
+    def best_time(f):
+        times = []
+        for _ in range(repeats):
+            clear_encoding_cache()
+            start = time.perf_counter()
+            f()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    rng = np.random.default_rng(0)
+    print(f"{'bits':>4} {'per-value loop':>15} {'vectorized':>11} {'bit-plane':>10}")
+    for n_bits in bit_widths:
+        hist = rng.random(2**n_bits - 1).tolist()
+        encoded = offset_encode_hist(hist)
+        b = bits_per_slice
+        reference = best_time(lambda: _reference_avg_slice(encoded, n_bits, b))
+        exact = best_time(lambda: encoded_hist_to_avg_slice(encoded, n_bits, b))
+        bit_plane = best_time(lambda: slice_statistics(encoded, n_bits, b))
+        print(f"{n_bits:>4} {reference:>14.4f}s {exact:>10.4f}s {bit_plane:>9.4f}s")
+
+
 if __name__ == "__main__":
     input_dist = [16 - abs(16 - i) for i in range(31)]
     print(f"input_dist: {input_dist}")
     for e in xnor_encode_hist(input_dist):
         print(e)
+    benchmark()
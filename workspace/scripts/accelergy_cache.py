@@ -0,0 +1,126 @@
+import glob
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from typing import Any, List
+
+import pytimeloop.timeloopfe.v4 as tl
+
+import result_cache
+
+THIS_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+TABLE_DIR = os.path.abspath(
+    os.path.join(THIS_SCRIPT_DIR, "..", "cache", "accelergy")
+)
+
+# Set to False to let Timeloop call Accelergy on every run
+ACCELERGY_CACHE_ENABLED = True
+
+# Files passed to Timeloop. When they are given, Timeloop skips Accelergy.
+_TABLE_REGEX = re.compile(r"(^|\.)(ERT|ART)\.yaml$")
+_NAME_REGEX = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def _strip_constraints(node: Any) -> Any:
+    if isinstance(node, list):
+        return [_strip_constraints(n) for n in node]
+    if not isinstance(node, dict):
+        return node
+    return {k: _strip_constraints(v) for k, v in node.items() if k != "constraints"}
+
+
+def _names_in(node: Any, names: set) -> set:
+    if isinstance(node, dict):
+        for k, v in node.items():
+            _names_in(k, names)
+            _names_in(v, names)
+    elif isinstance(node, (list, tuple)):
+        for n in node:
+            _names_in(n, names)
+    elif isinstance(node, str):
+        names.update(_NAME_REGEX.findall(node))
+    return names
+
+
+def table_hash(spec: tl.Specification, processed: tl.Specification = None) -> str:
+    """
+    Returns a hash of everything the Accelergy energy and area tables depend
+    on: the component attributes after all expressions are parsed (so
+    histogram-derived values such as AVERAGE_INPUT_VALUE enter as numbers),
+    the compound component classes, the variables those classes refer to, and
+    the plug-ins. The problem, mapper settings, and constraints are excluded,
+    so layers and sweeps that leave the attributes unchanged share tables.
+    See result_cache.spec_hash for processed.
+    """
+    if processed is None:
+        processed = result_cache.process_copy(spec)
+    components = processed.get("components", None)
+    used = _names_in(components, set())
+    variables = processed.get("variables", {})
+    payload = [
+        _strip_constraints(processed.architecture),
+        components,
+        {k: v for k, v in variables.items() if k in used},
+        processed.get("globals", None),
+    ]
+    h = hashlib.sha256()
+    h.update(result_cache.canonical_str(payload).encode())
+    h.update(result_cache.source_hash().encode())
+    return h.hexdigest()
+
+
+def _generate(spec: tl.Specification, key: str) -> str:
+    target = os.path.join(TABLE_DIR, key)
+    os.makedirs(TABLE_DIR, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=TABLE_DIR, suffix=".tmp")
+    try:
+        tl.call_accelergy_verbose(
+            specification=spec,
+            output_dir=tmp_dir,
+            log_to=os.path.join(tmp_dir, "accelergy.log"),
+        )
+        if not any(_TABLE_REGEX.search(f) for f in os.listdir(tmp_dir)):
+            raise FileNotFoundError(
+                f"Accelergy did not write ERT/ART files to {tmp_dir}. See "
+                f"{os.path.join(tmp_dir, 'accelergy.log')}."
+            )
+        os.rename(tmp_dir, target)
+    except OSError:
+        # Another process generated the same tables first. Theirs are equal.
+        if not os.path.isdir(target):
+            raise
+    finally:
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir)
+    return target
+
+
+def get_tables(
+    spec: tl.Specification, output_dir: str, processed: tl.Specification = None
+) -> List[str]:
+    """
+    Copies the Accelergy outputs for the spec into output_dir, running
+    Accelergy only if no earlier spec with the same table_hash has. Returns the
+    ERT and ART paths to pass to Timeloop as extra input files. The copied
+    outputs are those of a verbose Accelergy run.
+    """
+    source = os.path.join(TABLE_DIR, table_hash(spec, processed))
+    if not os.path.isdir(source):
+        source = _generate(spec, os.path.basename(source))
+    tables = []
+    for path in glob.glob(os.path.join(source, "*")):
+        name = os.path.basename(path)
+        if name == "accelergy.log" or not os.path.isfile(path):
+            continue
+        shutil.copy(path, os.path.join(output_dir, name))
+        if _TABLE_REGEX.search(name):
+            tables.append(os.path.join(output_dir, name))
+    return sorted(tables)
+
+
+def clear():
+    """Deletes all cached tables."""
+    if os.path.isdir(TABLE_DIR):
+        shutil.rmtree(TABLE_DIR)
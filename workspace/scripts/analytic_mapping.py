@@ -0,0 +1,250 @@
+import itertools
+import math
+from typing import Any, Dict, List, Tuple
+
+import pytimeloop.timeloopfe.v4 as tl
+
+from factorization import largest_divisor_at_most
+
+# Set to True to evaluate max-utilization runs (quick_run) with the mapping
+# from max_utilization_mapping instead of searching
+ANALYTIC_MAPPING_ENABLED = False
+
+# Relative difference allowed between the analytic and searched results in
+# cross_check before they are reported as different
+CROSS_CHECK_RTOL = 1e-3
+
+
+class AnalyticMappingError(ValueError):
+    """The constraints can not be satisfied by max_utilization_mapping."""
+
+
+def _flatten(x: Any) -> List[str]:
+    if x is None:
+        return []
+    if isinstance(x, str):
+        return [x]
+    return [y for z in x for y in _flatten(z)]
+
+
+def _factors(constraint: Any) -> List[Tuple[str, str, int]]:
+    factors = constraint.get("factors", None)
+    return [] if not factors else list(factors.get_split_factors())
+
+
+def _dims_of(spec: tl.Specification, dataspaces: Any) -> set:
+    names = _flatten(dataspaces)
+    if "*" in names:
+        names = [ds.name for ds in spec.problem.shape.data_spaces]
+    return {d for ds in names for d in spec.problem.shape.dataspace2dims(ds)}
+
+
+def _permutation(constraint: Any, dims: List[str], first: List[str]) -> str:
+    """Dimensions with factors > 1 first (innermost), then the constraint's
+    permutation, then the rest."""
+    order = list(first)
+    for d in _flatten(constraint.get("permutation", None)) + dims:
+        if d in dims and d not in order:
+            order.append(d)
+    return "".join(order)
+
+
+def _spatial_split(
+    factors: Dict[str, int], permutation: str, mesh_x: int, mesh_y: int
+) -> Tuple[str, int]:
+    """
+    Returns (permutation, split) placing spatial factors on a mesh_x by mesh_y
+    array. Timeloop maps the dimensions before split along X and the rest
+    along Y. The dimensions with factors > 1 keep the given order if it fits,
+    else the first order that fits is used. Raises AnalyticMappingError if no
+    order fits.
+    """
+    used = [d for d in permutation if factors.get(d, 1) > 1]
+    rest = [d for d in permutation if factors.get(d, 1) == 1]
+    for order in itertools.permutations(used):
+        for split in range(len(order), -1, -1):
+            x = math.prod(factors[d] for d in order[:split])
+            y = math.prod(factors[d] for d in order[split:])
+            if x <= mesh_x and y <= mesh_y:
+                return "".join(order) + "".join(rest), split
+    raise AnalyticMappingError(
+        f"Spatial factors {factors} do not fit a {mesh_x}x{mesh_y} array."
+    )
+
+
+def _datatype_directive(leaf: tl.arch.Leaf, dataspaces: List[str]) -> dict:
+    if isinstance(leaf, tl.arch.Container):
+        keep = []
+    else:
+        c = leaf.constraints.dataspace
+        if c.get("keep_only", None) is not None:
+            keep = _flatten(c.keep_only)
+        elif c.get("bypass_only", None) is not None:
+            bypass = _flatten(c.bypass_only)
+            keep = [d for d in dataspaces if d not in bypass]
+        else:
+            bypass = _flatten(c.get("bypass", None))
+            keep = [d for d in dataspaces if d not in bypass]
+        if "*" in keep:
+            keep = list(dataspaces)
+    return {
+        "target": leaf.name,
+        "type": "datatype",
+        "keep": [d for d in dataspaces if d in keep],
+        "bypass": [d for d in dataspaces if d not in keep],
+    }
+
+
+def max_utilization_mapping(processed: tl.Specification) -> List[dict]:
+    """
+    Returns a mapping for a max-utilization problem without searching. The
+    problem is sized to fill the arrays exactly (see ArrayProcessor.process),
+    so the mapping follows from the constraints:
+
+    - Factors fixed with "=" in the constraints are placed where they are
+      fixed.
+    - From the innermost level out, each spatial fanout is filled with the
+      largest factors that fit, trying the level's maximize_dims first and
+      skipping dimensions it may not iterate over.
+    - Each remaining factor is iterated temporally at the outermost level that
+      may iterate over it.
+    - Each level keeps the dataspaces its dataspace constraints allow.
+
+    processed is a processed and parsed specification, as returned by
+    result_cache.process_copy. Raises AnalyticMappingError if a factor can not
+    be placed. The mapping is not checked for capacity or bandwidth;
+    timeloop-model reports a mapping that does not fit.
+    """
+    prob = processed.problem
+    dims = list(prob.shape.dimensions)
+    dataspaces = [ds.name for ds in prob.shape.data_spaces]
+    remaining = {d: int(prob.instance.get(d, 1)) for d in dims}
+    leaves = list(processed.get_nodes_of_type(tl.arch.Leaf))
+
+    def place(factors: Dict[str, int], d: str, f: int, where: str):
+        if remaining[d] % f:
+            raise AnalyticMappingError(
+                f"Can not place {d}={f} at {where}: {remaining[d]} iterations of "
+                f"{d} remain, which {f} does not divide."
+            )
+        factors[d] = factors.get(d, 1) * f
+        remaining[d] //= f
+
+    temporal = {l.name: {} for l in leaves}
+    spatial = {l.name: {} for l in leaves}
+
+    # Factors fixed by the constraints
+    for l in leaves:
+        for target, factors in [("temporal", temporal), ("spatial", spatial)]:
+            for d, eq, f in _factors(l.constraints[target]):
+                if eq == "=" and f != 1 and d in remaining:
+                    place(factors[l.name], d, int(f), f"{l.name} {target}")
+
+    # Fill spatial fanouts from the inside out
+    for l in reversed(leaves):
+        fanout = l.spatial.get_fanout()
+        c = l.constraints.spatial
+        fixed = {d for d, eq, _ in _factors(c) if eq == "="}
+        limits = {d: int(f) for d, eq, f in _factors(c) if eq == "<="}
+        blocked = _dims_of(processed, c.get("no_iteration_over_dataspaces", None))
+        used = math.prod(spatial[l.name].values())
+        preferred = _flatten(c.get("maximize_dims", None)) or dims
+        for d in preferred:
+            if d not in remaining or d in fixed or d in blocked:
+                continue
+            limit = min(fanout // used, limits.get(d, fanout))
+            f = largest_divisor_at_most(remaining[d], limit)
+            if f > 1:
+                place(spatial[l.name], d, f, f"{l.name} spatial")
+                used *= f
+
+    # Iterate over what is left at the outermost level that allows it
+    for d in dims:
+        if remaining[d] == 1:
+            continue
+        for l in leaves:
+            c = l.constraints.temporal
+            only = c.get("factors_only", None)
+            fixed = {x for x, eq, _ in _factors(c) if eq == "="}
+            if only is not None or d in fixed:
+                continue
+            if d in _dims_of(processed, c.get("no_iteration_over_dataspaces", None)):
+                continue
+            place(temporal[l.name], d, remaining[d], f"{l.name} temporal")
+            break
+        else:
+            raise AnalyticMappingError(
+                f"No level may iterate temporally over {remaining[d]} iterations "
+                f"of {d}."
+            )
+
+    mapping = []
+    for l in leaves:
+        mapping.append(_datatype_directive(l, dataspaces))
+    for l in leaves:
+        t = temporal[l.name]
+        mapping.append(
+            {
+                "target": l.name,
+                "type": "temporal",
+                "factors": " ".join(f"{d}={t.get(d, 1)}" for d in dims),
+                "permutation": _permutation(l.constraints.temporal, dims, list(t)),
+            }
+        )
+        if l.spatial.get_fanout() <= 1:
+            continue
+        s = spatial[l.name]
+        permutation = _permutation(l.constraints.spatial, dims, list(s))
+        split = l.constraints.spatial.get("split", None)
+        if split is None:
+            mesh_y = int(l.spatial.get("meshY", 1))
+            mesh_x = l.spatial.get_fanout() // mesh_y
+            permutation, split = _spatial_split(s, permutation, mesh_x, mesh_y)
+        mapping.append(
+            {
+                "target": l.name,
+                "type": "spatial",
+                "factors": " ".join(f"{d}={s.get(d, 1)}" for d in dims),
+                "permutation": permutation,
+                "split": min(int(split), len(dims)),
+            }
+        )
+    return mapping
+
+
+def _relative_difference(a: float, b: float) -> float:
+    if a == b:
+        return 0.0
+    return abs(a - b) / max(abs(a), abs(b))
+
+
+def compare_results(
+    analytic: Any, searched: Any, rtol: float = CROSS_CHECK_RTOL
+) -> Dict[str, Tuple[float, float]]:
+    """
+    Returns {quantity: (analytic value, searched value)} for the totals and
+    per-component energies and areas of two MacroOutputStats that differ by
+    more than rtol. An empty result means the two agree.
+    """
+    pairs = {
+        k: (getattr(analytic, k), getattr(searched, k))
+        for k in ("energy", "area", "cycles", "computes", "percent_utilization")
+    }
+    for attr in ("per_component_energy", "per_component_area"):
+        a, s = getattr(analytic, attr), getattr(searched, attr)
+        for k in sorted(set(a) | set(s)):
+            pairs[f"{attr}[{k}]"] = (a.get(k, 0), s.get(k, 0))
+    return {
+        k: (a, s)
+        for k, (a, s) in pairs.items()
+        if _relative_difference(float(a), float(s)) > rtol
+    }
+
+
+def format_differences(differences: Dict[str, Tuple[float, float]]) -> str:
+    if not differences:
+        return "Analytic mapping matches the mapper."
+    lines = ["Analytic mapping differs from the mapper:"]
+    for k, (a, s) in differences.items():
+        lines.append(f"  {k}: analytic {a:.4g}, mapper {s:.4g}")
+    return "\n".join(lines)
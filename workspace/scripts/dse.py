@@ -0,0 +1,153 @@
+import copy
+import csv
+import itertools
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+import pytimeloop.timeloopfe.v4 as tl
+
+import accelergy_cache
+import mapping_reuse
+import result_cache
+from result_store import summarize
+from tl_output_parsing import MacroOutputStats, MacroOutputStatsList
+
+# Variable kinds returned by classify_variables
+MAPSPACE = "mapspace"  # Changes the mapspace, so points need their own search
+ENERGY = "energy"  # Changes only Accelergy's energy and area tables
+UNUSED = "unused"  # Changes neither
+
+
+def grid_points(grid: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """Returns the Cartesian product of a {variable: values} grid, with the
+    last variable changing fastest."""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+
+def with_variables(spec: tl.Specification, variables: Dict[str, Any]):
+    """Returns a copy of spec with the variables set. As in utils.run_layer,
+    the other variables are moved after them so they can refer to them."""
+    spec = copy.deepcopy(spec)
+    spec.variables.update(variables)
+    for k in list(spec.variables.keys()):
+        if k not in variables:
+            spec.variables[k] = spec.variables.pop(k)
+    return spec
+
+
+def classify_variables(
+    spec: tl.Specification, grid: Dict[str, List[Any]]
+) -> Dict[str, str]:
+    """
+    Returns {variable: MAPSPACE, ENERGY, or UNUSED} for each variable of the
+    grid. Each variable is varied over its values with the others held at
+    their first value, and a variable is MAPSPACE if any value changes
+    mapping_reuse.mapspace_hash and ENERGY if any value changes only
+    accelergy_cache.table_hash.
+
+    Interactions are not detected: a variable that only changes the mapspace
+    at some values of another variable may be classified as ENERGY. Points
+    evaluated with another point's mapping are re-searched if Timeloop rejects
+    the mapping (see utils.explore_variables).
+    """
+    base_point = {k: v[0] for k, v in grid.items()}
+
+    def hashes(point):
+        s = with_variables(spec, point)
+        processed = result_cache.process_copy(s)
+        return (
+            mapping_reuse.mapspace_hash(s, processed),
+            accelergy_cache.table_hash(s, processed),
+        )
+
+    base = hashes(base_point)
+    kinds = {}
+    for k, values in grid.items():
+        kinds[k] = UNUSED
+        for v in values[1:]:
+            h = hashes({**base_point, k: v})
+            if h[0] != base[0]:
+                kinds[k] = MAPSPACE
+                break
+            if h[1] != base[1]:
+                kinds[k] = ENERGY
+    return kinds
+
+
+def mapspace_groups(
+    points: List[Dict[str, Any]], kinds: Dict[str, str]
+) -> List[List[int]]:
+    """Groups the indices of points that share the values of all MAPSPACE
+    variables, in order of first appearance."""
+    groups = {}
+    for i, p in enumerate(points):
+        key = result_cache.canonical_str(
+            [p[k] for k in sorted(p) if kinds.get(k) == MAPSPACE]
+        )
+        groups.setdefault(key, []).append(i)
+    return list(groups.values())
+
+
+class ExplorationTable:
+    """
+    The results of a design-space exploration, one row per grid point. Each
+    row holds the point's variable values, its mapspace group, whether its
+    mapping was searched, and the summary metrics of its result (see
+    result_store.SUMMARY_ATTRIBUTES).
+
+    Args:
+        points: The variable values of each point.
+        kinds: The classification of each variable (see classify_variables).
+        groups: The indices of the points in each mapspace group.
+        results: The result of each point.
+        searched: Whether the mapper searched for each point's mapping.
+    """
+
+    def __init__(
+        self,
+        points: List[Dict[str, Any]],
+        kinds: Dict[str, str],
+        groups: List[List[int]],
+        results: List[MacroOutputStats],
+        searched: List[bool],
+    ):
+        self.kinds = kinds
+        self.results = MacroOutputStatsList(results)
+        group_of = {i: g for g, members in enumerate(groups) for i in members}
+        self.rows = [
+            {
+                **p,
+                "mapspace_group": group_of[i],
+                "searched": searched[i],
+                **summarize(r),
+            }
+            for i, (p, r) in enumerate(zip(points, results))
+        ]
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self.rows)
+
+    @property
+    def columns(self) -> List[str]:
+        names = {}
+        for r in self.rows:
+            names.update(dict.fromkeys(r))
+        return list(names)
+
+    def column(self, name: str) -> np.ndarray:
+        """Returns one column as an array, with NaN for missing values."""
+        values = [r.get(name, np.nan) for r in self.rows]
+        try:
+            return np.array(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            return np.array(values, dtype=object)
+
+    def to_csv(self, path: str):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns)
+            writer.writeheader()
+            writer.writerows(self.rows)
@@ -0,0 +1,75 @@
+import functools
+from typing import Tuple
+
+import numpy as np
+
+# Integers below this are factored with a smallest-prime-factor table. Mesh
+# sizes and problem dimensions are almost always below it.
+SIEVE_LIMIT = 1 << 16
+
+_SMALLEST_PRIME_FACTOR = None
+
+
+def _smallest_prime_factors() -> np.ndarray:
+    """Returns spf, where spf[n] is the smallest prime factor of n for
+    2 <= n < SIEVE_LIMIT. Built on first use."""
+    global _SMALLEST_PRIME_FACTOR
+    if _SMALLEST_PRIME_FACTOR is None:
+        spf = np.arange(SIEVE_LIMIT, dtype=np.int64)
+        for p in range(2, int(SIEVE_LIMIT**0.5) + 1):
+            if spf[p] == p:
+                multiples = spf[p * p :: p]
+                np.minimum(multiples, p, out=multiples)
+        _SMALLEST_PRIME_FACTOR = spf
+    return _SMALLEST_PRIME_FACTOR
+
+
+@functools.lru_cache(maxsize=None)
+def prime_factors(n: int) -> Tuple[int, ...]:
+    """Returns the prime factors of n in ascending order, with repeats. 0 and
+    1 have none."""
+    n = int(n)
+    factors = []
+    p = 2
+    # Trial division only for what is above the sieve
+    while n >= SIEVE_LIMIT and p * p <= n:
+        while n % p == 0:
+            factors.append(p)
+            n //= p
+        p += 1 if p == 2 else 2
+    if n >= SIEVE_LIMIT:
+        factors.append(n)
+        return tuple(factors)
+    spf = _smallest_prime_factors()
+    while n > 1:
+        p = int(spf[n])
+        factors.append(p)
+        n //= p
+    return tuple(factors)
+
+
+@functools.lru_cache(maxsize=None)
+def divisors(n: int) -> Tuple[int, ...]:
+    """Returns the divisors of n in ascending order."""
+    result = [1]
+    factors = prime_factors(n)
+    i = 0
+    while i < len(factors):
+        p, count = factors[i], factors.count(factors[i])
+        result = [d * p**k for d in result for k in range(count + 1)]
+        i += count
+    return tuple(sorted(result))
+
+
+def n_divisors(n: int) -> int:
+    return len(divisors(n))
+
+
+def largest_divisor_at_most(n: int, limit: int) -> int:
+    """Returns the largest divisor of n that is at most limit, or 1."""
+    best = 1
+    for d in divisors(n):
+        if d > limit:
+            break
+        best = d
+    return best
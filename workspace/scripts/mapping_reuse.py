@@ -0,0 +1,202 @@
+import hashlib
+import os
+import shutil
+import socket
+import tempfile
+import time
+from typing import Any, List, Optional
+
+import pytimeloop.timeloopfe.v4 as tl
+import yaml
+
+import result_cache
+
+THIS_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+MAPPING_DIR = os.path.abspath(
+    os.path.join(THIS_SCRIPT_DIR, "..", "cache", "mappings")
+)
+
+# Set to True to reuse mappings by default in run_mapper
+MAPPING_REUSE_ENABLED = False
+
+# Longest get_or_claim waits for another process's search before giving up
+CLAIM_WAIT_SECONDS = 2 * 60 * 60
+
+# Component attributes that shape the mapspace or the validity of a mapping.
+# All other attributes (voltage, technology, energy scales, ...) only change
+# energy and area, so specs that differ only in those can share a mapping.
+MAPSPACE_ATTRIBUTES = {
+    "depth",
+    "width",
+    "datawidth",
+    "block_size",
+    "n_banks",
+    "cluster_size",
+    "multiple_buffering",
+    "min_utilization",
+    "read_bandwidth",
+    "write_bandwidth",
+    "shared_bandwidth",
+    "metadata_storage_depth",
+    "metadata_storage_width",
+    "metadata_datawidth",
+    "metadata_block_size",
+}
+
+
+def _strip_non_mapspace_attributes(node: Any) -> Any:
+    if isinstance(node, list):
+        return [_strip_non_mapspace_attributes(n) for n in node]
+    if not isinstance(node, dict):
+        return node
+    stripped = {}
+    for k, v in node.items():
+        if k == "attributes" and isinstance(v, dict):
+            v = {a: x for a, x in v.items() if a in MAPSPACE_ATTRIBUTES}
+        stripped[k] = _strip_non_mapspace_attributes(v)
+    return stripped
+
+
+def mapspace_hash(
+    spec: tl.Specification, processed: tl.Specification = None
+) -> str:
+    """
+    Returns a hash of the parts of the fully-processed specification that
+    determine the mapspace: the architecture hierarchy, fanouts, constraints,
+    and mapspace-relevant attributes, the problem, and the mapper settings.
+    Variables only enter the hash through the values they produce in these.
+    See result_cache.spec_hash for processed.
+    """
+    if processed is None:
+        processed = result_cache.process_copy(spec)
+    payload = [
+        _strip_non_mapspace_attributes(processed.architecture),
+        processed.problem,
+        processed.mapper,
+        processed.get("constraints", None),
+        processed.get("mapspace", None),
+        processed.get("sparse_optimizations", None),
+    ]
+    h = hashlib.sha256()
+    h.update(result_cache.canonical_str(payload).encode())
+    h.update(result_cache.source_hash().encode())
+    return h.hexdigest()
+
+
+def _mapping_path(key: str) -> str:
+    return os.path.join(MAPPING_DIR, f"{key}.map.yaml")
+
+
+def _lock_path(key: str) -> str:
+    return os.path.join(MAPPING_DIR, f"{key}.lock")
+
+
+def load(key: str) -> Optional[List[dict]]:
+    """Returns the stored mapping for a mapspace, or None if there is none."""
+    path = _mapping_path(key)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return yaml.safe_load(f)["mapping"]
+
+
+def _claim(lock: str) -> bool:
+    """Atomically creates the lock file holding this process's host and pid.
+    Returns False if another process holds the lock."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(lock), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(f"{socket.gethostname()} {os.getpid()}")
+        os.link(tmp_path, lock)  # Fails if the lock exists
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmp_path)
+
+
+def _dead_holder(lock: str) -> Optional[str]:
+    """Returns the contents of the lock if the process holding it has exited,
+    else None. Holders on other hosts can not be checked and are assumed to be
+    alive."""
+    try:
+        with open(lock) as f:
+            holder = f.read()
+    except FileNotFoundError:  # Released while we were checking
+        return None
+    if len(holder.split()) != 2:  # Not written by _claim
+        return holder
+    host, pid = holder.split()
+    if host != socket.gethostname():
+        return None
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return holder
+    except PermissionError:  # Alive, but owned by another user
+        pass
+    return None
+
+
+def _take_over(lock: str, holder: str):
+    """Removes the lock if it is still held by holder. The lock is moved aside
+    first so a claim made by another waiter in the meantime is put back."""
+    aside = f"{lock}.{socket.gethostname()}.{os.getpid()}.stale"
+    try:
+        os.rename(lock, aside)
+    except FileNotFoundError:
+        return
+    with open(aside) as f:
+        if f.read() != holder:
+            try:
+                os.link(aside, lock)
+            except FileExistsError:
+                pass
+    os.remove(aside)
+
+
+def get_or_claim(
+    key: str,
+    poll_seconds: float = 1,
+    timeout_seconds: Optional[float] = CLAIM_WAIT_SECONDS,
+) -> Optional[List[dict]]:
+    """
+    Returns the stored mapping for a mapspace. If there is none, claims the
+    mapspace and returns None; the caller must then search for a mapping and
+    call store() and/or release(). If another process has claimed the
+    mapspace, waits for its mapping. Claims whose process has exited (e.g.,
+    crashed) are taken over. Raises TimeoutError, without claiming, if the
+    mapping is not stored within timeout_seconds (None waits forever).
+    """
+    os.makedirs(MAPPING_DIR, exist_ok=True)
+    lock = _lock_path(key)
+    deadline = None if timeout_seconds is None else time.time() + timeout_seconds
+    while True:
+        if (mapping := load(key)) is not None:
+            return mapping
+        if _claim(lock):
+            return None
+        if (holder := _dead_holder(lock)) is not None:
+            _take_over(lock, holder)
+            continue
+        if deadline is not None and time.time() >= deadline:
+            raise TimeoutError(f"Timed out waiting for the mapping of {key}")
+        time.sleep(poll_seconds)
+
+
+def store(key: str, mapping_yaml_path: str):
+    """Stores the mapping found for a mapspace and releases the claim on it."""
+    os.makedirs(MAPPING_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=MAPPING_DIR, suffix=".tmp")
+    os.close(fd)
+    shutil.copy(mapping_yaml_path, tmp_path)
+    os.replace(tmp_path, _mapping_path(key))
+    release(key)
+
+
+def release(key: str):
+    """Releases a claim on a mapspace without storing a mapping."""
+    try:
+        os.remove(_lock_path(key))
+    except FileNotFoundError:
+        pass
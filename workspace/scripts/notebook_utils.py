@@ -115,19 +115,6 @@ def get_important_variables_markdown(name: str):
     return "\n".join(result)
 
 
-def clean_old_output_files(max_files=50):
-    out_path = os.path.join(THIS_SCRIPT_DIR, "..", "outputs")
-    files = sorted(
-        list(os.path.join(out_path, f) for f in os.listdir(out_path)),
-        key=lambda x: os.path.getmtime(x),
-    )
-    while len(files) > max_files:
-        shutil.rmtree(
-            files.pop(0),
-            ignore_errors=True,
-        )
-
-
 def run_test(
     macro_name: str,
     test_name: str,
@@ -141,7 +128,7 @@ def run_test(
         doc = "\n".join([line[1:] for line in doc.split("\n")])
         display_markdown(doc)
     t = test_func(*args, **kwargs)
-    clean_old_output_files()
+    output_manager.get_output_manager().collect_stale()
     return t
 
 
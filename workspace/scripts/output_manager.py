@@ -0,0 +1,176 @@
+import collections
+import fnmatch
+import itertools
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+THIS_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUTS_DIR = os.path.abspath(os.path.join(THIS_SCRIPT_DIR, "..", "outputs"))
+
+# Set to True to run Timeloop in a tmpfs scratch directory. Kept artifacts are
+# moved to OUTPUTS_DIR when the run finishes.
+USE_TMPFS_SCRATCH = False
+TMPFS_DIR = "/dev/shm"
+
+# Files kept after a run unless the caller asks for others. Everything else
+# Timeloop writes (XML stats, processed inputs, copied tables) is deleted.
+KEEP_ARTIFACTS = ("*.map.yaml", "*.map.txt", "*.stats.txt")
+
+# Finished runs each process keeps before deleting its oldest ones. Kept
+# artifacts are temporary: copy any that must outlive this.
+MAX_RUNS_PER_PROCESS = 16
+
+# Run directories older than this are deleted by collect_stale()
+MAX_RUN_AGE_SECONDS = 24 * 60 * 60
+
+# Run directory names: <creation time in ns>.<pid>.<counter>
+_RUN_ID = re.compile(r"^(\d+)\.\d+\.\d+$")
+
+
+class OutputManager:
+    """
+    Allocates and cleans up per-run output directories.
+
+    Run directories are named <creation time in ns>.<pid>.<counter>, so they are
+    unique under any amount of parallelism and their age is known without
+    calling stat(). finish() keeps only the requested artifacts and records
+    them under the run's ID. Deletions happen on a background thread so they
+    never delay a run.
+
+    Kept artifacts are temporary. Each process keeps the artifacts of its last
+    max_runs runs, whether or not a result still names them, and
+    collect_stale() deletes runs of any process after MAX_RUN_AGE_SECONDS.
+
+    Args:
+        root: Directory holding the kept artifacts of each run.
+        scratch_root: Directory runs are executed in. Defaults to root, or to
+            a tmpfs directory if USE_TMPFS_SCRATCH is True.
+        max_runs: Number of finished runs to keep before deleting the oldest.
+    """
+
+    def __init__(
+        self,
+        root: str = OUTPUTS_DIR,
+        scratch_root: Optional[str] = None,
+        max_runs: int = MAX_RUNS_PER_PROCESS,
+    ):
+        if scratch_root is None and USE_TMPFS_SCRATCH and os.path.isdir(TMPFS_DIR):
+            scratch_root = os.path.join(TMPFS_DIR, "cimloop_outputs")
+        self.root = root
+        self.scratch_root = scratch_root or root
+        self.max_runs = max_runs
+        self.artifacts: Dict[str, Dict[str, str]] = {}
+        self._finished = collections.deque()
+        self._counter = itertools.count()
+        self._to_delete = queue.Queue()
+        self._deleter = None
+        self._lock = threading.Lock()
+        self._deleter_lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def allocate(self) -> str:
+        """Creates and returns a new, empty run directory."""
+        name = f"{time.time_ns()}.{os.getpid()}.{next(self._counter)}"
+        path = os.path.join(self.scratch_root, name)
+        os.makedirs(path)
+        return path
+
+    def finish(
+        self, run_dir: str, keep: Optional[Iterable[str]] = KEEP_ARTIFACTS
+    ) -> Dict[str, str]:
+        """
+        Deletes the files in run_dir that match none of the glob patterns in
+        keep (keep=None keeps everything) and returns {file name: path} of the
+        kept files. The run's oldest predecessors beyond max_runs are deleted,
+        so the returned paths only stay valid for the next max_runs runs.
+        """
+        run_id = os.path.basename(run_dir)
+        keep = None if keep is None else tuple(keep)
+        dest = os.path.join(self.root, run_id)
+        kept, delete = {}, []
+        for entry in os.scandir(run_dir):
+            if keep is None or any(fnmatch.fnmatch(entry.name, k) for k in keep):
+                kept[entry.name] = os.path.join(dest, entry.name)
+            else:
+                delete.append(entry.path)
+
+        if dest != run_dir and kept:
+            os.makedirs(dest, exist_ok=True)
+            for name, path in kept.items():
+                shutil.move(os.path.join(run_dir, name), path)
+            delete = [run_dir]
+        elif not kept:
+            delete = [run_dir]
+        for path in delete:
+            self._delete(path)
+
+        with self._lock:
+            self.artifacts[run_id] = kept
+            if kept:
+                self._finished.append(dest)
+            while len(self._finished) > self.max_runs:
+                old = self._finished.popleft()
+                self.artifacts.pop(os.path.basename(old), None)
+                self._delete(old)
+        return kept
+
+    def discard(self, run_dir: str):
+        """Deletes a run directory whose outputs are not needed."""
+        self.finish(run_dir, keep=())
+
+    def collect_stale(self, max_age_seconds: float = MAX_RUN_AGE_SECONDS):
+        """
+        Deletes run directories, from any process, older than max_age_seconds.
+        Ages are read from the directory names, so this lists each root once.
+        Entries whose names are not run IDs are left alone.
+        """
+        cutoff = time.time_ns() - max_age_seconds * 1e9
+        for root in {self.root, self.scratch_root}:
+            if not os.path.isdir(root):
+                continue
+            for entry in os.scandir(root):
+                match = _RUN_ID.match(entry.name)
+                if match and int(match.group(1)) < cutoff:
+                    self._delete(entry.path)
+
+    def _delete(self, path: str):
+        self._to_delete.put(path)
+        with self._deleter_lock:
+            if self._deleter is None or not self._deleter.is_alive():
+                self._deleter = threading.Thread(
+                    target=self._delete_loop, daemon=True
+                )
+                self._deleter.start()
+
+    def _delete_loop(self):
+        while True:
+            path = self._to_delete.get()
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._to_delete.task_done()
+
+    def wait(self):
+        """Blocks until all queued deletions are done."""
+        self._to_delete.join()
+
+
+_MANAGER: Optional[OutputManager] = None
+
+
+def get_output_manager() -> OutputManager:
+    """Returns this process's output manager."""
+    global _MANAGER
+    # Forked workers must not share the parent's deletion thread or registry
+    if _MANAGER is None or _MANAGER.pid != os.getpid():
+        _MANAGER = OutputManager()
+    return _MANAGER
@@ -1,5 +1,7 @@
 import pytimeloop.timeloopfe.v4 as tl
 
+from factorization import prime_factors
+
 
 class ArrayContainer(tl.arch.Container):
     @classmethod
@@ -210,11 +212,4 @@ class ArrayProcessor(tl.processors.Processor):
 
 
 def num2list_of_prime_factors(x: int):
-    factors = []
-    while x > 1:
-        for i in range(2, x + 1):
-            if x % i == 0:
-                factors.append(i)
-                x //= i
-                break
-    return factors
+    return list(prime_factors(x))
@@ -0,0 +1,347 @@
+import hashlib
+import json
+import os
+import struct
+import zlib
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from tl_output_parsing import (
+    MacroOutputStats,
+    MacroOutputStatsTable,
+    MappingHandle,
+    _ComponentColumns,
+)
+
+# File layout (little-endian):
+#
+#   File header: FILE_MAGIC, then the format version as a uint32.
+#   Records: a kind byte, three padding bytes, the payload length as a uint32,
+#   then the payload.
+#     VARIABLES: a uint64 hash, then the variables as JSON. Written once per
+#         distinct variables dictionary.
+#     NAMES: a uint64 hash, then a JSON list of component names. Written once
+#         per distinct list of energy or area components.
+#     RESULT: a RESULT_HEADER, the per-component energies and areas as float64s
+#         in the order of their NAMES records, then the zlib-compressed
+#         mapping text.
+#
+# Records are only appended, so a sweep can write results as they finish. A
+# record cut off by a crash ends the file for the reader and is removed by the
+# next append.
+FILE_MAGIC = b"CIMLOOP-RESULTS\n"
+FORMAT_VERSION = 1
+FILE_HEADER = struct.Struct("<16sI")
+RECORD_PREFIX = struct.Struct("<c3xI")
+VARIABLES, NAMES, RESULT = b"V", b"N", b"R"
+
+RESULT_HEADER = np.dtype(
+    [
+        ("variables", "<u8"),
+        ("energy_names", "<u8"),
+        ("area_names", "<u8"),
+        ("percent_utilization", "<f8"),
+        ("computes", "<f8"),
+        ("cycles", "<f8"),
+        ("cycle_seconds", "<f8"),
+        ("run_seconds", "<f8"),  # NaN if not recorded
+        ("n_energy", "<u4"),
+        ("n_area", "<u4"),
+        ("mapping_length", "<u4"),
+        ("has_mapping", "<u4"),
+    ]
+)
+# The same layout, for writing one header at a time
+RESULT_HEADER_STRUCT = struct.Struct("<3Q5d4I")
+assert RESULT_HEADER_STRUCT.size == RESULT_HEADER.itemsize
+
+
+def _json_default(x: Any):
+    if isinstance(x, np.generic):
+        return x.item()
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+    return str(x)
+
+
+def _hash(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def _unique_in_order(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns (unique values in order of first appearance, index of each
+    value in them)."""
+    uniques, first, inverse = np.unique(
+        values, return_index=True, return_inverse=True
+    )
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return uniques[order], rank[inverse.reshape(-1)]
+
+
+def _model_value(v: Any) -> float:
+    """The model's value of a per-component entry, without its reference."""
+    if isinstance(v, dict) and "model" in v:
+        v = v["model"]
+    return float(v)
+
+
+def _compressed_mapping(result: MacroOutputStats) -> Tuple[bytes, bool]:
+    m = result.mapping_handle
+    if m is None:
+        return b"", False
+    if isinstance(m, MappingHandle) and m.compressed is not None:
+        return bytes(m.compressed), True
+    if isinstance(m, MappingHandle) and m.offset is not None:
+        with open(m.path, "rb") as f:
+            f.seek(m.offset)
+            return f.read(m.length), True
+    if isinstance(m, MappingHandle):
+        m = m.load()
+    return zlib.compress(str(m).encode()), True
+
+
+class _ArchiveMappings:
+    """The mapping handles of the results read from an archive, made when
+    they are indexed."""
+
+    def __init__(
+        self, path: str, offsets: np.ndarray, lengths: np.ndarray, present: np.ndarray
+    ):
+        self.path = path
+        self.offsets, self.lengths, self.present = offsets, lengths, present
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, i: int) -> MappingHandle:
+        if not self.present[i]:
+            return None
+        return MappingHandle(
+            path=self.path, offset=int(self.offsets[i]), length=int(self.lengths[i])
+        )
+
+
+class ResultArchive:
+    """
+    A compact binary file of sweep results. Each result stores its scalar
+    metrics, per-component energies and areas, and compressed mapping, and
+    refers to its variables and component names by hash, so they are stored
+    once per file. Compared to ResultStore, which pickles each result, an
+    archive with hundreds of thousands of results is read into a
+    MacroOutputStatsTable in one pass over a memory map.
+
+    Comparison references and attributes other than run_seconds are not
+    stored. Variables are stored as JSON; values JSON can not represent are
+    stored as strings.
+
+    Args:
+        path: The file to store results in. Created if it does not exist.
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        # The hashes of the VARIABLES and NAMES records in the file, its end
+        # after the last complete record, and its identity (device, inode,
+        # size) when they were found
+        self._written_hashes = None
+        self._end = 0
+        self._identity = None
+
+    def _records(self, data: np.ndarray) -> Iterable[Tuple[bytes, int, int]]:
+        """Yields (kind, payload offset, payload length) of complete records."""
+        if len(data) < FILE_HEADER.size:
+            return
+        magic, version = FILE_HEADER.unpack_from(data, 0)
+        if magic != FILE_MAGIC or version != FORMAT_VERSION:
+            raise ValueError(
+                f"{self.path} is not a version {FORMAT_VERSION} result archive."
+            )
+        data = memoryview(data)
+        pos, end = FILE_HEADER.size, len(data)
+        while pos + RECORD_PREFIX.size <= end:
+            kind, length = RECORD_PREFIX.unpack_from(data, pos)
+            pos += RECORD_PREFIX.size
+            if pos + length > end:
+                break  # Being written or cut off by a crash
+            yield kind, pos, length
+            pos += length
+
+    def _map(self) -> np.ndarray:
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            return np.zeros(0, dtype=np.uint8)
+        return np.memmap(self.path, dtype=np.uint8, mode="r")
+
+    def _identity_of_file(self) -> Tuple[int, int, int]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_dev, st.st_ino, st.st_size
+
+    def _scan(self):
+        """Finds the hashes of the VARIABLES and NAMES records in the file and
+        the end of its last complete record."""
+        data = self._map()
+        hashes, end = set(), 0
+        if len(data) >= FILE_HEADER.size:
+            end = FILE_HEADER.size
+        for kind, offset, length in self._records(data):
+            if kind in (VARIABLES, NAMES):
+                hashes.add(struct.unpack_from("<Q", data, offset)[0])
+            end = offset + length
+        self._written_hashes, self._end = hashes, end
+
+    def append(self, results: Iterable[MacroOutputStats]):
+        """
+        Appends results to the archive. If the last record was cut off (e.g.,
+        by a crash), it is removed first. One process may append at a time.
+        """
+        # Rescan if this is the first append or the file was changed since the
+        # last one: replaced, deleted, truncated, or cut off mid-record
+        if self._written_hashes is None or self._identity_of_file() != self._identity:
+            self._scan()
+        new_hashes = set()
+        chunks = []
+
+        def record(kind: bytes, *payload: bytes):
+            chunks.append(RECORD_PREFIX.pack(kind, sum(map(len, payload))))
+            chunks.extend(payload)
+
+        # Results of a sweep share a few variables dictionaries and component
+        # lists, so each is serialized once. Dictionaries are keyed by id and
+        # kept alive so their ids are not reused.
+        known = {}
+
+        def table_entry(kind: bytes, value: Any) -> int:
+            key = (kind, value if isinstance(value, tuple) else id(value))
+            if key in known:
+                return known[key][0]
+            data = json.dumps(value, sort_keys=True, default=_json_default)
+            h = _hash(kind + data.encode())
+            if h not in self._written_hashes and h not in new_hashes:
+                record(kind, struct.pack("<Q", h), data.encode())
+                new_hashes.add(h)
+            known[key] = (h, value)
+            return h
+
+        for r in results:
+            energy = [_model_value(v) for v in r.per_component_energy.values()]
+            area = [_model_value(v) for v in r.per_component_area.values()]
+            mapping, has_mapping = _compressed_mapping(r)
+            header = RESULT_HEADER_STRUCT.pack(
+                table_entry(VARIABLES, r.variables),
+                table_entry(NAMES, tuple(r.per_component_energy)),
+                table_entry(NAMES, tuple(r.per_component_area)),
+                r.percent_utilization,
+                r.computes,
+                r.cycles,
+                r.cycle_seconds,
+                getattr(r, "run_seconds", np.nan),
+                len(energy),
+                len(area),
+                len(mapping),
+                has_mapping,
+            )
+            values = struct.pack(f"<{len(energy) + len(area)}d", *energy, *area)
+            record(RESULT, header, values, mapping)
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.truncate(self._end)  # Drop a partial record left by a crash
+            if self._end == 0:
+                f.write(FILE_HEADER.pack(FILE_MAGIC, FORMAT_VERSION))
+            f.write(b"".join(chunks))
+            f.flush()
+            os.fsync(f.fileno())
+            self._end = os.fstat(f.fileno()).st_size
+        self._written_hashes |= new_hashes
+        self._identity = self._identity_of_file()
+
+    def read(self) -> MacroOutputStatsTable:
+        """Returns the results in the archive in the order they were written.
+        Mappings are read from the file when they are accessed."""
+        data = self._map()
+        tables: Dict[int, Any] = {}
+        offsets = []
+        for kind, offset, length in self._records(data):
+            if kind == RESULT:
+                offsets.append(offset)
+            elif kind in (VARIABLES, NAMES):
+                (h,) = struct.unpack_from("<Q", data, offset)
+                tables[h] = json.loads(bytes(data[offset + 8 : offset + length]))
+        offsets = np.array(offsets, dtype=np.int64)
+
+        # Gather the fixed-size headers with one fancy index
+        size = RESULT_HEADER.itemsize
+        headers = np.ascontiguousarray(
+            data[offsets[:, None] + np.arange(size)]
+        ).view(RESULT_HEADER)[:, 0]
+        energy_offsets = offsets + size
+        area_offsets = energy_offsets + 8 * headers["n_energy"].astype(np.int64)
+        mapping_offsets = area_offsets + 8 * headers["n_area"].astype(np.int64)
+
+        table = MacroOutputStatsTable()
+        table.scalars = {
+            k: headers[k].astype(np.float64)
+            for k in ("percent_utilization", "computes", "cycles", "cycle_seconds")
+        }
+        table.energy = self._components(
+            data, tables, headers["energy_names"], energy_offsets
+        )
+        table.area = self._components(data, tables, headers["area_names"], area_offsets)
+
+        hashes, table.variables_index = _unique_in_order(headers["variables"])
+        table.variable_sets = [tables[int(h)] for h in hashes]
+
+        table.mappings = _ArchiveMappings(
+            self.path,
+            mapping_offsets,
+            headers["mapping_length"],
+            headers["has_mapping"].astype(bool),
+        )
+        run_seconds = headers["run_seconds"]
+        if not np.isnan(run_seconds).all():
+            run_seconds = run_seconds.astype(object)
+            run_seconds[np.isnan(headers["run_seconds"])] = None
+            table.extras["run_seconds"] = run_seconds.tolist()
+        return table
+
+    @staticmethod
+    def _components(
+        data: np.ndarray,
+        tables: Dict[int, Any],
+        name_hashes: np.ndarray,
+        offsets: np.ndarray,
+    ) -> _ComponentColumns:
+        """Gathers per-component values, one fancy index per distinct list of
+        component names."""
+        names: List[str] = []
+        index: Dict[str, int] = {}
+        groups = []
+        hashes, group_of = _unique_in_order(name_hashes)
+        for g, h in enumerate(hashes):
+            group_names = tables[int(h)]
+            for n in group_names:
+                if n not in index:
+                    index[n] = len(names)
+                    names.append(n)
+            groups.append((np.flatnonzero(group_of == g), group_names))
+
+        values = np.zeros((len(offsets), len(names)))
+        present = np.zeros((len(offsets), len(names)), dtype=bool)
+        for rows, group_names in groups:
+            if not group_names:
+                continue
+            n_bytes = 8 * len(group_names)
+            raw = data[offsets[rows][:, None] + np.arange(n_bytes)]
+            cols = [index[n] for n in group_names]
+            values[np.ix_(rows, cols)] = np.ascontiguousarray(raw).view("<f8")
+            present[np.ix_(rows, cols)] = True
+        return _ComponentColumns.from_arrays(names, values, present)
+
+    def __len__(self) -> int:
+        data = self._map()
+        return sum(kind == RESULT for kind, _, _ in self._records(data))
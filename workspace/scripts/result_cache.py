@@ -0,0 +1,135 @@
+import copy
+import fnmatch
+import functools
+import glob
+import hashlib
+import importlib.metadata
+import json
+import os
+import re
+import tempfile
+from typing import Any, Optional
+
+import pytimeloop.timeloopfe.v4 as tl
+import cloudpickle
+
+THIS_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.abspath(os.path.join(THIS_SCRIPT_DIR, "..", "cache", "results"))
+
+# Set to False to always re-run the mapper
+RESULT_CACHE_ENABLED = True
+
+# Files whose contents change the result of a run without showing up in the
+# specification itself: Accelergy plug-ins, expression functions included by
+# the specs, our processors, and the scripts that run Timeloop and build
+# results. Tests and plotting code are left out so editing them keeps the
+# cache.
+_MODELS_DIR = os.path.join(THIS_SCRIPT_DIR, "..", "models")
+_SOURCE_GLOBS = (
+    os.path.join(_MODELS_DIR, "components", "**", "*.py"),
+    os.path.join(_MODELS_DIR, "include", "**", "*.py"),
+    os.path.join(_MODELS_DIR, "arch", "**", "helper_functions.py"),
+    os.path.join(THIS_SCRIPT_DIR, "processors.py"),
+    os.path.join(THIS_SCRIPT_DIR, "utils.py"),
+    os.path.join(THIS_SCRIPT_DIR, "accelergy_cache.py"),
+    os.path.join(THIS_SCRIPT_DIR, "tl_output_parsing.py"),
+)
+_SOURCE_EXCLUDES = ("*_tests.py", "test_*.py", "*plot*.py")
+_VERSIONED_PACKAGES = ("pytimeloop", "timeloopfe", "accelergy")
+
+
+def _canonical_default(x: Any):
+    if callable(x):
+        return f"{getattr(x, '__module__', '')}.{getattr(x, '__qualname__', x)}"
+    if isinstance(x, (set, frozenset)):
+        return sorted(str(i) for i in x)
+    # Default reprs contain memory addresses, which differ between processes
+    return re.sub(r" at 0x[0-9a-fA-F]+", "", repr(x))
+
+
+def canonical_str(x: Any) -> str:
+    return json.dumps(x, default=_canonical_default)
+
+
+@functools.lru_cache(maxsize=1)
+def source_hash() -> str:
+    h = hashlib.sha256()
+    paths = set()
+    for g in _SOURCE_GLOBS:
+        for p in glob.glob(g, recursive=True):
+            name = os.path.basename(p)
+            if not any(fnmatch.fnmatch(name, e) for e in _SOURCE_EXCLUDES):
+                paths.add(os.path.abspath(p))
+    for p in sorted(paths):
+        h.update(p.encode())
+        with open(p, "rb") as f:
+            h.update(f.read())
+    for package in _VERSIONED_PACKAGES:
+        try:
+            h.update(f"{package}=={importlib.metadata.version(package)}".encode())
+        except importlib.metadata.PackageNotFoundError:
+            pass
+    return h.hexdigest()
+
+
+def process_copy(spec: tl.Specification) -> tl.Specification:
+    """Returns a processed copy of the spec with all expressions parsed."""
+    processed = copy.deepcopy(spec)._process()
+    processed.parse_expressions()
+    return processed
+
+
+def spec_hash(
+    spec: tl.Specification, *extra: Any, processed: tl.Specification = None
+) -> str:
+    """
+    Returns a hash of the fully-processed specification (architecture,
+    variables after the ArrayProcessor, problem, mapper, ...) and the source of
+    everything that may change its result. Extra arguments are included in the
+    hash. If the result of process_copy(spec) is already available, pass it as
+    processed to avoid processing the spec again.
+    """
+    processed = process_copy(spec) if processed is None else processed
+    h = hashlib.sha256()
+    h.update(canonical_str(processed).encode())
+    h.update(source_hash().encode())
+    for e in extra:
+        h.update(canonical_str(e).encode())
+    return h.hexdigest()
+
+
+def _cache_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, key[:2], f"{key}.pkl")
+
+
+def load(key: str) -> Optional[Any]:
+    """Returns the cached result for the given key, or None if there is none."""
+    path = _cache_path(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            return cloudpickle.load(f)
+    except Exception:  # Partially-written or stale entry. Treat as a miss.
+        return None
+
+
+def store(key: str, result: Any):
+    """Stores a result. Writes are atomic so parallel workers may share a cache."""
+    path = _cache_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            cloudpickle.dump(result, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def clear():
+    """Deletes all cached results."""
+    for path in glob.glob(os.path.join(CACHE_DIR, "*", "*.pkl")):
+        os.remove(path)
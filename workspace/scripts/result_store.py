@@ -0,0 +1,129 @@
+import base64
+import hashlib
+import json
+import os
+import time
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import cloudpickle
+
+import result_cache
+from tl_output_parsing import MacroOutputStatsList
+
+# Scalar attributes written in plain JSON next to each pickled result so
+# partial sweeps can be inspected with any JSONL reader.
+SUMMARY_ATTRIBUTES = (
+    "energy",
+    "area",
+    "cycles",
+    "computes",
+    "cycle_seconds",
+    "percent_utilization",
+    "tops",
+    "tops_per_w",
+    "tops_per_mm2",
+    "run_seconds",
+)
+
+
+def job_keys(delayed_calls: Iterable[tuple]) -> List[str]:
+    """
+    Returns a key for each delayed call from its function and arguments. Keys
+    are stable across sessions, so a re-run of the same sweep finds the jobs it
+    has already completed. Functions are identified by name, so if two calls
+    in a sweep look identical (e.g., two closures with the same name), their
+    keys are numbered in order of appearance.
+    """
+    keys, seen = [], {}
+    for func, args, kwargs in delayed_calls:
+        h = hashlib.sha256(result_cache.canonical_str([func, args, kwargs]).encode())
+        key = h.hexdigest()
+        seen[key] = seen.get(key, -1) + 1
+        keys.append(f"{key}.{seen[key]}")
+    return keys
+
+
+def summarize(result: Any) -> Dict[str, Any]:
+    """Returns {attribute: value} of the SUMMARY_ATTRIBUTES result has."""
+    summary = {}
+    for a in SUMMARY_ATTRIBUTES:
+        try:
+            summary[a] = float(getattr(result, a))
+        except (AttributeError, TypeError, ValueError):
+            pass
+    return summary
+
+
+class ResultStore:
+    """
+    An append-only file of sweep results with one JSON record per line. Each
+    record holds the job key, the time it was stored, a summary of scalar
+    results (see SUMMARY_ATTRIBUTES), and the full pickled result.
+
+    Records are appended as jobs finish, so a crashed sweep keeps everything it
+    completed, a re-run skips completed jobs, and results can be read from
+    another process while the sweep is still running. A partially-written last
+    line (e.g., from a crash mid-write) is ignored.
+
+    Args:
+        path: The file to store results in. Created if it does not exist.
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+
+    def records(self) -> Iterator[dict]:
+        """Yields the complete records in the store in the order written."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # Being written or cut off by a crash
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def completed_keys(self) -> set:
+        return {r["key"] for r in self.records()}
+
+    def append(self, key: str, result: Any):
+        record = {
+            "key": key,
+            "stored_at": time.time(),
+            "summary": summarize(result),
+            "result": base64.b64encode(
+                zlib.compress(cloudpickle.dumps(result))
+            ).decode(),
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "ab+") as f:
+            # Start a new line if a crash cut off the last record
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            f.write((json.dumps(record) + "\n").encode())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load(self, keys: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """Returns {key: result} for the given keys, or for all records."""
+        keys = None if keys is None else set(keys)
+        results = {}
+        for r in self.records():
+            if keys is None or r["key"] in keys:
+                results[r["key"]] = cloudpickle.loads(
+                    zlib.decompress(base64.b64decode(r["result"]))
+                )
+        return results
+
+    def results(self) -> MacroOutputStatsList:
+        """Returns the results stored so far in the order they were written."""
+        return MacroOutputStatsList(list(self.load().values()))
+
+    def summaries(self) -> List[Dict[str, Any]]:
+        """Returns the summaries stored so far without unpickling results."""
+        return [dict(key=r["key"], **r["summary"]) for r in self.records()]
@@ -0,0 +1,185 @@
+import heapq
+import inspect
+import json
+import math
+import os
+import statistics
+import tempfile
+from typing import Any, List, Optional, Sequence
+
+import result_cache
+from factorization import n_divisors
+from workloads import load_layer_problem
+
+THIS_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+TIMINGS_PATH = os.path.abspath(
+    os.path.join(THIS_SCRIPT_DIR, "..", "cache", "job_timings.json")
+)
+
+
+def _layer_instance(delayed_call: tuple) -> Optional[dict]:
+    func, args, kwargs = delayed_call
+    try:
+        bound = inspect.signature(func).bind(*args, **kwargs).arguments
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(bound.get("layer", None), str):
+        return None
+    try:
+        return load_layer_problem(bound["layer"]).get("instance", {})
+    except Exception:  # Unparseable layers are reported when the job runs
+        return None
+
+
+def job_signature(delayed_call: tuple) -> str:
+    """
+    Returns a key for looking up past timings of a job. A layer is identified
+    by its instance shape, so layers of the same shape share timings.
+    """
+    func, args, kwargs = delayed_call
+    instance = _layer_instance(delayed_call)
+    if instance is not None:
+        bound = dict(inspect.signature(func).bind(*args, **kwargs).arguments)
+        bound["layer"] = instance
+        args, kwargs = (), bound
+    return result_cache.canonical_str([func, args, kwargs])
+
+
+class JobCost:
+    """
+    The estimated cost of one job. macs is the number of MACs in the layer
+    and mapspace_size is the product, over problem dimensions, of the number
+    of ways to tile the dimension. Both are None for jobs that do not run a
+    layer. seconds is the predicted run time, or None if there is not enough
+    timing history to predict it.
+    """
+
+    def __init__(
+        self,
+        macs: Optional[int],
+        mapspace_size: Optional[int],
+        seconds: Optional[float] = None,
+    ):
+        self.macs = macs
+        self.mapspace_size = mapspace_size
+        self.seconds = seconds
+
+    def __repr__(self):
+        return (
+            f"JobCost(macs={self.macs}, mapspace_size={self.mapspace_size}, "
+            f"seconds={self.seconds})"
+        )
+
+
+def estimate_cost(delayed_call: tuple) -> JobCost:
+    instance = _layer_instance(delayed_call)
+    if instance is None:
+        return JobCost(None, None)
+    dims = [v for v in instance.values() if isinstance(v, int) and v > 0]
+    return JobCost(
+        math.prod(dims), math.prod(n_divisors(d) for d in dims) if dims else 1
+    )
+
+
+def lpt_makespan(durations: Sequence[float], n_workers: int) -> float:
+    """Makespan of running jobs in the given order, each on the first free
+    worker."""
+    workers = [0.0] * max(1, min(n_workers, len(durations)))
+    for d in durations:
+        heapq.heappush(workers, heapq.heappop(workers) + d)
+    return max(workers) if durations else 0.0
+
+
+class SweepScheduler:
+    """
+    Orders the jobs of a sweep longest-first so that long jobs do not start
+    last and leave most workers idle at the end of the sweep.
+
+    A job's run time is predicted from the recorded run time of a job with the
+    same signature (see job_signature). Other layers are predicted from their
+    mapspace size, scaled by the median seconds per mapspace entry of the
+    recorded layers, or from their MACs if there is no history. Jobs that do
+    not run a layer are predicted to take the median time.
+
+    Args:
+        n_jobs: Number of workers the sweep runs on.
+        timings_path: JSON file holding past run times.
+    """
+
+    def __init__(self, n_jobs: int, timings_path: str = TIMINGS_PATH):
+        self.n_jobs = n_jobs
+        self.timings_path = timings_path
+        self.timings = {}
+        if os.path.exists(timings_path):
+            try:
+                with open(timings_path) as f:
+                    self.timings = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                pass
+        self.signatures: List[str] = []
+        self.costs: List[JobCost] = []
+        self.predicted_makespan: Optional[float] = None
+
+    def _seconds_per_entry(self) -> Optional[float]:
+        rates = [
+            t["seconds"] / t["mapspace_size"]
+            for t in self.timings.values()
+            if t.get("mapspace_size")
+        ]
+        return statistics.median(rates) if rates else None
+
+    def order(self, delayed_calls: List[tuple]) -> List[int]:
+        """Returns the indices of the jobs in the order they should start."""
+        self.signatures = [job_signature(c) for c in delayed_calls]
+        self.costs = [estimate_cost(c) for c in delayed_calls]
+
+        rate = self._seconds_per_entry()
+        for s, c in zip(self.signatures, self.costs):
+            if s in self.timings:
+                c.seconds = self.timings[s]["seconds"]
+            elif rate is not None and c.mapspace_size is not None:
+                c.seconds = rate * c.mapspace_size
+
+        seconds = [c.seconds for c in self.costs if c.seconds is not None]
+        if seconds:
+            fallback = statistics.median(seconds)
+            keys = [fallback if c.seconds is None else c.seconds for c in self.costs]
+        else:
+            macs = [c.macs for c in self.costs if c.macs is not None]
+            fallback = statistics.median(macs) if macs else 0
+            keys = [fallback if c.macs is None else c.macs for c in self.costs]
+
+        order = sorted(range(len(delayed_calls)), key=lambda i: -keys[i])
+        self.predicted_makespan = None
+        if seconds:
+            self.predicted_makespan = lpt_makespan(
+                [keys[i] for i in order], self.n_jobs
+            )
+        return order
+
+    def record(self, results: List[Any]):
+        """Records the run_seconds of results, in the order of the jobs passed
+        to order(), for future predictions."""
+        for s, c, r in zip(self.signatures, self.costs, results):
+            seconds = getattr(r, "run_seconds", None)
+            if seconds is not None:
+                self.timings[s] = dict(
+                    seconds=seconds, macs=c.macs, mapspace_size=c.mapspace_size
+                )
+        os.makedirs(os.path.dirname(self.timings_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(self.timings_path), suffix=".tmp"
+        )
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.timings, f)
+        os.replace(tmp_path, self.timings_path)
+
+    def report(self, actual_seconds: float) -> str:
+        if self.predicted_makespan is None:
+            predicted = "no timing history yet"
+        else:
+            predicted = f"predicted {self.predicted_makespan:.1f}s"
+        return (
+            f"{len(self.costs)} jobs on {self.n_jobs} workers: {predicted}, "
+            f"actual {actual_seconds:.1f}s"
+        )
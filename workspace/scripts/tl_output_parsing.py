@@ -1,10 +1,68 @@
+import functools
+import json
 import os
-from typing import Any, Iterable, Tuple, List, Union
+import zlib
+from typing import Any, Dict, Iterable, Iterator, Tuple, List, Union
+import numpy as np
 import pytimeloop.timeloopfe.v4 as tl
 from pytimeloop.timeloopfe.v4.output_parsing import MultipliableDict
 import yaml
 
 
+# Metrics of MacroOutputStats that are computed on first access
+DERIVED_METRICS = (
+    "computes_1b",
+    "computes_per_second_1b",
+    "computes_per_joule_1b",
+    "tops",
+    "tops_per_mm2",
+    "tops_per_w",
+    "tops_1b",
+    "tops_per_mm2_1b",
+    "tops_per_w_1b",
+)
+
+
+class MappingHandle:
+    """
+    A mapping that is loaded only when it is read. Mapping text is held
+    zlib-compressed, or read from a file on each access, so results that are
+    only used for energy and cycles hold little memory and pickle small. If
+    offset is given, the file holds the compressed mapping in length bytes at
+    offset (see result_archive).
+    """
+
+    def __init__(
+        self,
+        compressed: bytes = None,
+        path: str = None,
+        offset: int = None,
+        length: int = None,
+    ):
+        self.compressed = compressed
+        self.path = path
+        self.offset = offset
+        self.length = length
+
+    @staticmethod
+    def from_text(text: str) -> "MappingHandle":
+        return MappingHandle(compressed=zlib.compress(text.encode()))
+
+    @staticmethod
+    def from_file(path: str) -> "MappingHandle":
+        return MappingHandle(path=path)
+
+    def load(self) -> str:
+        if self.compressed is not None:
+            return zlib.decompress(self.compressed).decode()
+        if self.offset is not None:
+            with open(self.path, "rb") as f:
+                f.seek(self.offset)
+                return zlib.decompress(f.read(self.length)).decode()
+        with open(self.path) as f:
+            return f.read()
+
+
 class MacroOutputStats(tl.output_parsing.OutputStats):
     def __init__(self, *args, scale_computes: bool = True, **kwargs):
         super().__init__(*args, **kwargs)
@@ -28,19 +86,82 @@ class MacroOutputStats(tl.output_parsing.OutputStats):
                 )
             )
 
-        # Calculate one-bit equivalent stats
-        n_1b = self.input_bits * self.weight_bits
-        self.computes_1b = self.computes * n_1b
-        self.computes_per_second_1b = self.computes_per_second * n_1b
-        self.computes_per_joule_1b = self.computes_per_joule * n_1b
+    def __setstate__(self, state: dict):
+        # Results pickled before mappings were stored as handles
+        if "mapping" in state:
+            state["_mapping"] = state.pop("mapping")
+        self.__dict__.update(state)
+
+    @property
+    def mapping(self) -> str:
+        m = self.__dict__.get("_mapping", None)
+        return m.load() if isinstance(m, MappingHandle) else m
+
+    @mapping.setter
+    def mapping(self, mapping: Union[str, MappingHandle, None]):
+        if isinstance(mapping, str):
+            mapping = MappingHandle.from_text(mapping)
+        self._mapping = mapping
+
+    @property
+    def mapping_handle(self) -> Union[MappingHandle, Any]:
+        """The mapping as stored, without loading it."""
+        return self.__dict__.get("_mapping", None)
+
+    # Derived metrics are computed on first access from the base metrics, not
+    # from each other, so editing one (e.g., scaling tops) does not change the
+    # others. The add_compare_ref methods compute them all before replacing a
+    # value with a {reference, model} dictionary, so they stay model values.
+
+    @property
+    def _n_1b(self):
+        return self.input_bits * self.weight_bits
+
+    def _tops(self):
+        return self.computes / (self.cycles * self.cycle_seconds) / 1e12 * 2
+
+    def _tops_per_mm2(self):
+        return self._tops() / self.area / 1e6
+
+    def _tops_per_w(self):
+        return self.computes / self.energy * 2 / 1e12
+
+    # One-bit equivalent stats
+    @functools.cached_property
+    def computes_1b(self):
+        return self.computes * self._n_1b
+
+    @functools.cached_property
+    def computes_per_second_1b(self):
+        return self.computes_per_second * self._n_1b
+
+    @functools.cached_property
+    def computes_per_joule_1b(self):
+        return self.computes_per_joule * self._n_1b
 
-        self.tops = self.computes / (self.cycles * self.cycle_seconds) / 1e12 * 2
-        self.tops_per_mm2 = self.tops / self.area / 1e6
-        self.tops_per_w = self.computes / self.energy * 2 / 1e12
+    @functools.cached_property
+    def tops(self):
+        return self._tops()
 
-        self.tops_1b = self.tops * n_1b
-        self.tops_per_mm2_1b = self.tops_per_mm2 * n_1b
-        self.tops_per_w_1b = self.tops_per_w * n_1b
+    @functools.cached_property
+    def tops_per_mm2(self):
+        return self._tops_per_mm2()
+
+    @functools.cached_property
+    def tops_per_w(self):
+        return self._tops_per_w()
+
+    @functools.cached_property
+    def tops_1b(self):
+        return self._tops() * self._n_1b
+
+    @functools.cached_property
+    def tops_per_mm2_1b(self):
+        return self._tops_per_mm2() * self._n_1b
+
+    @functools.cached_property
+    def tops_per_w_1b(self):
+        return self._tops_per_w() * self._n_1b
 
     @staticmethod
     def from_output_stats(
@@ -54,7 +175,7 @@ class MacroOutputStats(tl.output_parsing.OutputStats):
             output_stats.per_component_energy,
             output_stats.per_component_area,
             output_stats.variables,
-            output_stats.mapping,
+            getattr(output_stats, "mapping_handle", None) or output_stats.mapping,
             scale_computes=scale_computes,
         )
 
@@ -74,7 +195,12 @@ class MacroOutputStats(tl.output_parsing.OutputStats):
             ]
         )
 
+    def _compute_derived_metrics(self):
+        for k in DERIVED_METRICS:
+            getattr(self, k)
+
     def add_compare_ref(self, name: str, reference_value: Any):
+        self._compute_derived_metrics()
         setattr(
             self,
             name,
@@ -82,11 +208,13 @@ class MacroOutputStats(tl.output_parsing.OutputStats):
         )
 
     def add_compare_ref_area(self, name: str, reference_value: Any):
+        self._compute_derived_metrics()
         self.per_component_area[name] = MultipliableDict(
             reference=reference_value, model=self.per_component_area[name]
         )
 
     def add_compare_ref_energy(self, name: str, reference_value: Any):
+        self._compute_derived_metrics()
         self.per_component_energy[name] = MultipliableDict(
             reference=reference_value, model=self.per_component_energy[name]
         )
@@ -140,18 +268,20 @@ class MacroOutputStatsList(tl.output_parsing.OutputStatsList):
         return [t.get_compare_ref_energy() for t in self]
 
     def aggregate(self):
-        return MacroOutputStats.aggregate(self)
+        return self.to_table().aggregate()
 
     def aggregate_by(self, *keys: str):
-        return MacroOutputStatsList(MacroOutputStats.aggregate_by(self, *keys))
+        """See MacroOutputStatsTable.aggregate_by."""
+        return self.to_table().aggregate_by(*keys).to_list()
 
     def split_by(self, *keys: str):
-        to_agg = {}
-        for t in self:
-            key = tuple(t.access(k) for k in keys)
-            to_agg[key] = to_agg.get(key, []) + [t]
-
-        return [MacroOutputStatsList(v) for v in to_agg.values()]
+        """Splits the results into lists with the same value for every key,
+        in order of first appearance. See MacroOutputStatsTable.group_by."""
+        groups, n_groups = self.to_table().group_by(*keys)
+        split = [MacroOutputStatsList() for _ in range(n_groups)]
+        for t, g in zip(self, groups):
+            split[g].append(t)
+        return split
 
     def clear_zero_energies(self):
         for t in self:
@@ -161,6 +291,390 @@ class MacroOutputStatsList(tl.output_parsing.OutputStatsList):
         for t in self:
             t.clear_zero_areas()
 
+    def to_table(self) -> "MacroOutputStatsTable":
+        return MacroOutputStatsTable.from_results(self)
+
+
+# Attributes set on results after they are created (see utils.run_mapper) that
+# MacroOutputStatsTable keeps as object columns
+EXTRA_ATTRIBUTES = (
+    "run_seconds",
+    "mapping_directives",
+    "run_id",
+    "artifacts",
+    "cross_check",
+)
+
+SCALAR_COLUMNS = ("percent_utilization", "computes", "cycles", "cycle_seconds")
+
+
+def _hashable(value: Any) -> Any:
+    """Returns value, or its repr if it can not be hashed (e.g., a histogram)."""
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+def _factorize(values: np.ndarray) -> np.ndarray:
+    """Returns integer codes that are equal where values are equal."""
+    if values.dtype != object:
+        return np.unique(values, return_inverse=True)[1].reshape(-1)
+    codes = {}
+    return np.array(
+        [codes.setdefault(_hashable(v), len(codes)) for v in values], dtype=np.int64
+    )
+
+
+def _weighted_mean(
+    values: np.ndarray, weights: np.ndarray, groups: np.ndarray, n_groups: int
+) -> np.ndarray:
+    """Per-group mean of values weighted by weights. Groups whose weights sum
+    to zero take the unweighted mean."""
+    total = np.bincount(groups, weights=weights, minlength=n_groups)
+    weighted = np.bincount(groups, weights=values * weights, minlength=n_groups)
+    count = np.bincount(groups, minlength=n_groups)
+    plain = np.bincount(groups, weights=values, minlength=n_groups)
+    return np.where(
+        total != 0,
+        weighted / np.where(total != 0, total, 1),
+        plain / np.maximum(count, 1),
+    )
+
+
+class _ComponentColumns:
+    """Per-component values of many results: one column per component, with a
+    mask of which results have the component."""
+
+    def __init__(self, dicts: List[dict]):
+        self.names = []
+        index = {}
+        for d in dicts:
+            for k in d:
+                if k not in index:
+                    index[k] = len(self.names)
+                    self.names.append(k)
+        self.values = np.zeros((len(dicts), len(self.names)))
+        self.present = np.zeros((len(dicts), len(self.names)), dtype=bool)
+        self.refs: Dict[str, List[Any]] = {}
+        for i, d in enumerate(dicts):
+            for k, v in d.items():
+                j = index[k]
+                if isinstance(v, MultipliableDict) and "model" in v:
+                    self.refs.setdefault(k, [None] * len(dicts))[i] = v["reference"]
+                    v = v["model"]
+                self.values[i, j] = v
+                self.present[i, j] = True
+
+    @staticmethod
+    def from_arrays(
+        names: List[str], values: np.ndarray, present: np.ndarray
+    ) -> "_ComponentColumns":
+        c = _ComponentColumns.__new__(_ComponentColumns)
+        c.names, c.values, c.present, c.refs = list(names), values, present, {}
+        return c
+
+    def combine(self, combined: List[str], new_name: str):
+        cols = [self.names.index(c) for c in combined if c in self.names]
+        total = (self.values[:, cols] * self.present[:, cols]).sum(axis=1)
+        keep = [j for j in range(len(self.names)) if j not in cols]
+        self.names = [self.names[j] for j in keep]
+        self.values, self.present = self.values[:, keep], self.present[:, keep]
+        for c in combined:
+            self.refs.pop(c, None)
+        if new_name in self.names:
+            j = self.names.index(new_name)
+            self.values[:, j] += total
+            self.present[:, j] = True
+            return
+        self.names.append(new_name)
+        self.values = np.column_stack([self.values, total])
+        self.present = np.column_stack([self.present, np.ones(len(total), bool)])
+
+    def clear_zeros(self):
+        self.present &= self.values != 0
+
+    def reduce(
+        self, ufunc: np.ufunc, groups: np.ndarray, n_groups: int
+    ) -> "_ComponentColumns":
+        """Reduces the rows of each group with ufunc (e.g., np.add). Missing
+        components count as zero. Comparison references are dropped."""
+        c = _ComponentColumns.__new__(_ComponentColumns)
+        c.names = list(self.names)
+        c.values = np.zeros((n_groups, len(self.names)))
+        ufunc.at(c.values, groups, self.values * self.present)
+        c.present = np.zeros((n_groups, len(self.names)), dtype=bool)
+        np.logical_or.at(c.present, groups, self.present)
+        c.refs = {}
+        return c
+
+    def take(self, rows: np.ndarray) -> "_ComponentColumns":
+        c = _ComponentColumns.__new__(_ComponentColumns)
+        c.names = list(self.names)
+        c.values, c.present = self.values[rows], self.present[rows]
+        c.refs = {k: [v[i] for i in rows] for k, v in self.refs.items()}
+        return c
+
+    def row(self, i: int) -> MultipliableDict:
+        """Returns the model values of a result. See refs for references."""
+        return MultipliableDict(
+            **{
+                self.names[j]: float(self.values[i, j])
+                for j in np.flatnonzero(self.present[i])
+            }
+        )
+
+
+class MacroOutputStatsTable:
+    """
+    A columnar alternative to MacroOutputStatsList for large sweeps. Scalar
+    metrics are NumPy arrays, per-component energies and areas are 2-D arrays
+    with one column per component, and each distinct variables dictionary is
+    stored once. Indexing or iterating builds MacroOutputStats on demand.
+
+    The list's combine_per_component_*, clear_zero_*, add_compare_ref*,
+    get_compare_ref_*, split_by, aggregate, and aggregate_by are supported.
+    split_by and aggregate_by hash the distinct variable sets once and reduce
+    each column with NumPy, so they stay fast for tens of thousands of
+    results. See aggregate_by for how results are combined.
+    """
+
+    def __init__(self):
+        self.scalars: Dict[str, np.ndarray] = {}
+        self.energy = _ComponentColumns([])
+        self.area = _ComponentColumns([])
+        self.variable_sets: List[dict] = []
+        self.variables_index = np.zeros(0, dtype=np.int64)
+        self.mappings: List[Any] = []
+        self.extras: Dict[str, List[Any]] = {}
+        self.refs: Dict[str, List[Any]] = {}
+
+    @staticmethod
+    def from_results(results: Iterable[MacroOutputStats]) -> "MacroOutputStatsTable":
+        results = list(results)
+        table = MacroOutputStatsTable()
+        table.scalars = {
+            k: np.array([getattr(r, k) for r in results], dtype=np.float64)
+            for k in SCALAR_COLUMNS
+        }
+        table.energy = _ComponentColumns([r.per_component_energy for r in results])
+        table.area = _ComponentColumns([r.per_component_area for r in results])
+
+        by_id, by_content, index = {}, {}, []
+        for r in results:
+            v = r.variables
+            if id(v) not in by_id:
+                key = json.dumps(v, sort_keys=True, default=str)
+                if key not in by_content:
+                    by_content[key] = len(table.variable_sets)
+                    table.variable_sets.append(v)
+                by_id[id(v)] = by_content[key]
+            index.append(by_id[id(v)])
+        table.variables_index = np.array(index, dtype=np.int64)
+
+        table.mappings = [r.mapping_handle for r in results]
+        for a in EXTRA_ATTRIBUTES:
+            if any(hasattr(r, a) for r in results):
+                table.extras[a] = [getattr(r, a, None) for r in results]
+        return table
+
+    def __len__(self) -> int:
+        return len(self.mappings)
+
+    def __getitem__(self, i: int) -> MacroOutputStats:
+        i = range(len(self))[i]
+        result = MacroOutputStats(
+            *(float(self.scalars[k][i]) for k in SCALAR_COLUMNS),
+            self.energy.row(i),
+            self.area.row(i),
+            dict(self.variable_sets[self.variables_index[i]]),
+            self.mappings[i],
+            scale_computes=False,
+        )
+        for k, v in self.extras.items():
+            if v[i] is not None:
+                setattr(result, k, v[i])
+        for k, v in self.area.refs.items():
+            if v[i] is not None and k in result.per_component_area:
+                result.add_compare_ref_area(k, v[i])
+        for k, v in self.energy.refs.items():
+            if v[i] is not None and k in result.per_component_energy:
+                result.add_compare_ref_energy(k, v[i])
+        for k, v in self.refs.items():
+            result.add_compare_ref(k, v[i])
+        return result
+
+    def __iter__(self) -> Iterator[MacroOutputStats]:
+        return (self[i] for i in range(len(self)))
+
+    def to_list(self) -> MacroOutputStatsList:
+        return MacroOutputStatsList(list(self))
+
+    def variable(self, name: str) -> np.ndarray:
+        """Returns a variable's value for each result."""
+        values = [s.get(name, None) for s in self.variable_sets]
+        if all(isinstance(v, (int, float)) for v in values):
+            array = np.array(values)
+        else:  # Strings, None, histograms, ...
+            array = np.empty(len(values), dtype=object)
+            for i, v in enumerate(values):
+                array[i] = v
+        return array[self.variables_index]
+
+    def column(self, name: str) -> np.ndarray:
+        """Returns a scalar metric, "energy" or "area" (totals), a component's
+        energy, or a variable for each result."""
+        if name in self.scalars:
+            return self.scalars[name]
+        if name in ("energy", "area"):
+            c = getattr(self, name)
+            return (c.values * c.present).sum(axis=1)
+        if name in self.energy.names:
+            return self.energy.values[:, self.energy.names.index(name)]
+        return self.variable(name)
+
+    def take(self, rows: Iterable[int]) -> "MacroOutputStatsTable":
+        """Returns a table of the given rows."""
+        rows = np.asarray(list(rows), dtype=np.int64)
+        table = MacroOutputStatsTable()
+        table.scalars = {k: v[rows] for k, v in self.scalars.items()}
+        table.energy, table.area = self.energy.take(rows), self.area.take(rows)
+        table.variable_sets = self.variable_sets
+        table.variables_index = self.variables_index[rows]
+        table.mappings = [self.mappings[i] for i in rows]
+        table.extras = {k: [v[i] for i in rows] for k, v in self.extras.items()}
+        table.refs = {k: [v[i] for i in rows] for k, v in self.refs.items()}
+        return table
+
+    def combine_per_component_energy(self, combined: List[str], new_name: str):
+        self.energy.combine(combined, new_name)
+
+    def combine_per_component_area(self, combined: List[str], new_name: str):
+        self.area.combine(combined, new_name)
+
+    def clear_zero_energies(self):
+        self.energy.clear_zeros()
+
+    def clear_zero_areas(self):
+        self.area.clear_zeros()
+
+    def _reference_list(self, reference_values: Any) -> List[Any]:
+        if not isinstance(reference_values, Iterable):
+            reference_values = [reference_values]
+        reference_values = list(reference_values)
+        assert len(reference_values) == len(self), (
+            f"Length of reference values ({len(reference_values)}) "
+            f"does not match length of test outputs ({len(self)})"
+        )
+        return reference_values
+
+    def add_compare_ref(self, name: str, reference_values: List[Any]):
+        self.refs[name] = self._reference_list(reference_values)
+
+    def add_compare_ref_area(self, name: str, reference_values: List[Any]):
+        self.area.refs[name] = self._reference_list(reference_values)
+
+    def add_compare_ref_energy(self, name: str, reference_values: List[Any]):
+        self.energy.refs[name] = self._reference_list(reference_values)
+
+    def get_compare_ref_area(self):
+        return [r.get_compare_ref_area() for r in self]
+
+    def get_compare_ref_energy(self):
+        return [r.get_compare_ref_energy() for r in self]
+
+    def group_by(self, *keys: str) -> Tuple[np.ndarray, int]:
+        """Returns (group of each result, number of groups). Results are in
+        the same group if they have the same value for every key. Groups are
+        numbered in order of first appearance. Keys are scalar metrics,
+        "energy" or "area", component energies, or variables; results without
+        a variable have None for it. Other keys (e.g., derived metrics such as
+        "tops") raise a KeyError."""
+        # Keys that are variables are compared once per distinct variable set
+        set_codes = np.zeros(len(self.variable_sets), dtype=np.int64)
+        row_codes = np.zeros(len(self), dtype=np.int64)
+        for k in keys:
+            if k in self.scalars or k in ("energy", "area") or k in self.energy.names:
+                codes, combined = _factorize(self.column(k)), row_codes
+            elif not any(k in v for v in self.variable_sets):
+                raise KeyError(
+                    f"Can not group by {k!r}: it is not a scalar metric, a "
+                    f"total, a component energy, or a variable of any result"
+                )
+            else:
+                values = np.empty(len(self.variable_sets), dtype=object)
+                for i, v in enumerate(self.variable_sets):
+                    values[i] = v.get(k, None)
+                codes, combined = _factorize(values), set_codes
+            combined *= codes.max(initial=0) + 1
+            combined += codes
+            combined[:] = _factorize(combined)
+        codes = _factorize(
+            row_codes * len(self.variable_sets) + set_codes[self.variables_index]
+        )
+
+        first = np.full(codes.max(initial=-1) + 1, len(self), dtype=np.int64)
+        np.minimum.at(first, codes, np.arange(len(self)))
+        rank = np.empty(len(first), dtype=np.int64)
+        rank[np.argsort(first, kind="stable")] = np.arange(len(first))
+        return rank[codes], len(first)
+
+    def split_by(self, *keys: str) -> List["MacroOutputStatsTable"]:
+        groups, n_groups = self.group_by(*keys)
+        order = np.argsort(groups, kind="stable")
+        bounds = np.cumsum(np.bincount(groups, minlength=n_groups))[:-1]
+        return [self.take(rows) for rows in np.split(order, bounds)]
+
+    def _aggregate(self, groups: np.ndarray, n_groups: int) -> "MacroOutputStatsTable":
+        table = MacroOutputStatsTable()
+        cycles = self.scalars["cycles"]
+        table.scalars = {
+            "computes": np.bincount(
+                groups, weights=self.scalars["computes"], minlength=n_groups
+            ),
+            "cycles": np.bincount(groups, weights=cycles, minlength=n_groups),
+        }
+        for k in ("percent_utilization", "cycle_seconds"):
+            table.scalars[k] = _weighted_mean(
+                self.scalars[k], cycles, groups, n_groups
+            )
+        table.energy = self.energy.reduce(np.add, groups, n_groups)
+        table.area = self.area.reduce(np.maximum, groups, n_groups)
+
+        # Variables shared by every result in the group. Only the distinct
+        # (group, variable set) pairs are compared.
+        pairs = np.unique(groups * len(self.variable_sets) + self.variables_index)
+        common: List[dict] = [None] * n_groups
+        for g, v in zip(*np.divmod(pairs, len(self.variable_sets))):
+            v = self.variable_sets[v]
+            if common[g] is None:
+                common[g] = dict(v)
+            else:
+                common[g] = {
+                    k: x for k, x in common[g].items() if k in v and v[k] == x
+                }
+        table.variable_sets = common
+        table.variables_index = np.arange(n_groups, dtype=np.int64)
+        table.mappings = [None] * n_groups
+        return table
+
+    def aggregate(self) -> MacroOutputStats:
+        return self._aggregate(np.zeros(len(self), dtype=np.int64), 1)[0]
+
+    def aggregate_by(self, *keys: str) -> "MacroOutputStatsTable":
+        """
+        Returns a table with one aggregate result per group of results with
+        the same value for every key (e.g., one per macro configuration when
+        the results are the layers of a DNN). Within a group, computes,
+        cycles, and per-component energies are summed; utilization and cycle
+        time are cycle-weighted means; per-component areas are the maximum,
+        since the results share hardware; and the variables are those with the
+        same value in every result. Mappings and comparison references are
+        not carried over.
+        """
+        return self._aggregate(*self.group_by(*keys))
+
 
 def parse_timeloop_output(
     spec: tl.Specification,
@@ -176,7 +690,7 @@ def parse_timeloop_output(
     spec.parse_expressions()
     mapping = None
     if os.path.exists(stats_path.replace(".stats.txt", ".map.txt")):
-        mapping = open(stats_path.replace(".stats.txt", ".map.txt")).read()
+        mapping = MappingHandle.from_file(stats_path.replace(".stats.txt", ".map.txt"))
 
     cycle_seconds = spec.variables["GLOBAL_CYCLE_SECONDS"]
 
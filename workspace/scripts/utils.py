@@ -1,6 +1,9 @@
+import copy
+import inspect
+import json
 import shutil
 import time
-from typing import Callable, Union, Iterable, List
+from typing import Callable, Optional, Tuple, Union, Iterable, List
 import os
 import threading
 import joblib
@@ -11,14 +14,26 @@ import sys
 from tqdm import tqdm
 import glob
 import yaml
-import subprocess
-import tempfile
 
 # fmt: off
 THIS_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(THIS_SCRIPT_DIR)
 from processors import ArrayProcessor
-from tl_output_parsing import parse_timeloop_output, MacroOutputStats, MacroOutputStatsList
+import result_cache
+import mapping_reuse
+import accelergy_cache
+import analytic_mapping
+import dse
+from workloads import load_layer_problem, histogram_signature
+from worker_pool import WorkerPool, get_worker_pool
+from result_store import ResultStore, job_keys
+from scheduler import SweepScheduler
+import output_manager
+from tl_output_parsing import (
+    MacroOutputStats,
+    MacroOutputStatsList,
+    MacroOutputStatsTable,
+)
 
 from plots import *
 # fmt: on
@@ -30,19 +45,185 @@ def single_test(result) -> MacroOutputStatsList:
     return MacroOutputStatsList([result])
 
 
-def parallel_test(
-    delayed_calls: List[Callable], n_jobs: int = 32
+def _dedup_default(x):
+    # Callables (e.g., callfunc closures) only match if they are the same object
+    return f"<{id(x)}>" if callable(x) else repr(x)
+
+
+def _layer_dedup_key(delayed_call, histogram_decimals: int = None) -> str:
+    func, args, kwargs = delayed_call
+    if func not in (run_layer, run_layer_with_mapping):
+        return None
+    bound = inspect.signature(func).bind(*args, **kwargs).arguments
+    layer = bound.pop("layer", None)
+    if layer is None:
+        return None
+    problem = load_layer_problem(layer)
+    key = {
+        "func": func.__name__,
+        "args": bound,
+        "instance": problem.get("instance", {}),
+        "histograms": {
+            k: histogram_signature(v, histogram_decimals)
+            for k, v in problem.get("histograms", {}).items()
+        },
+    }
+    return json.dumps(key, sort_keys=True, default=_dedup_default)
+
+
+def dedup_layer_calls(
+    delayed_calls: List[tuple], histogram_decimals: int = None
+) -> Tuple[List[tuple], List[int]]:
+    """
+    Groups delayed run_layer calls that would map identical problems: the same
+    arguments, instance shape, and operand histograms, with only the layer's
+    name, DNN name, and notes differing. If histogram_decimals is given,
+    histograms are grouped by their encoded statistics rounded to that many
+    decimals instead of exactly. Returns the unique calls and, for each
+    original call, the index of the unique call that computes its result.
+    """
+    unique, key2idx, indices = [], {}, []
+    for call in delayed_calls:
+        key = _layer_dedup_key(call, histogram_decimals)
+        if key is None or key not in key2idx:
+            if key is not None:
+                key2idx[key] = len(unique)
+            indices.append(len(unique))
+            unique.append(call)
+        else:
+            indices.append(key2idx[key])
+    return unique, indices
+
+
+def _run_with_store(
+    delayed_calls: List[tuple],
+    n_jobs: int,
+    store: Union[str, ResultStore],
+    order: List[int],
 ) -> MacroOutputStatsList:
+    if not isinstance(store, ResultStore):
+        store = ResultStore(store)
+    keys = job_keys(delayed_calls)
+    done = store.load(keys)
+    pending = [i for i in order if keys[i] not in done]
+    if done:
+        print(f"Loaded {len(keys) - len(pending)} results from {store.path}")
+
+    stream = get_worker_pool(n_jobs).stream(delayed_calls[i] for i in pending)
+    for j, result in tqdm(stream, total=len(pending)):
+        store.append(keys[pending[j]], result)
+        done[keys[pending[j]]] = result
+    return MacroOutputStatsList([done[k] for k in keys])
+
+
+def parallel_test(
+    delayed_calls: List[Callable],
+    n_jobs: int = 32,
+    dedup: bool = True,
+    histogram_decimals: int = None,
+    store: Union[str, ResultStore] = None,
+    schedule: bool = True,
+    verbose: bool = False,
+    as_table: bool = False,
+) -> Union[MacroOutputStatsList, MacroOutputStatsTable]:
+    """
+    Runs delayed calls in parallel on the session's warm worker pool (see
+    worker_pool.WorkerPool). If dedup is True, run_layer calls that map
+    identical problems are run once and the result is copied to each layer. See
+    dedup_layer_calls for histogram_decimals.
+
+    If store is given (a ResultStore or a path for one), each result is
+    appended to the store as soon as its job finishes, and jobs whose results
+    are already in the store are not run again. Re-running a crashed or
+    interrupted sweep with the same store resumes it.
+
+    If schedule is True, jobs start longest-first using the run time
+    predictions of scheduler.SweepScheduler. If verbose is also True, the
+    predicted and actual makespans are printed. Results are returned in the
+    original order, as a MacroOutputStatsTable if as_table is True.
+    """
     if not isinstance(delayed_calls, Iterable):
         delayed_calls = [delayed_calls]
 
     delayed_calls = list(delayed_calls)
-    return MacroOutputStatsList(
-        tqdm(
-            joblib.Parallel(return_as="generator", n_jobs=n_jobs)(delayed_calls),
-            total=len(delayed_calls),
-        )
+    if dedup:
+        unique, indices = dedup_layer_calls(delayed_calls, histogram_decimals)
+    else:
+        unique, indices = delayed_calls, list(range(len(delayed_calls)))
+
+    scheduler = SweepScheduler(n_jobs) if schedule else None
+    order = scheduler.order(unique) if schedule else list(range(len(unique)))
+
+    start = time.perf_counter()
+    if store is None:
+        ordered = get_worker_pool(n_jobs).map([unique[i] for i in order])
+        unique_results = [None] * len(unique)
+        for i, r in zip(order, ordered):
+            unique_results[i] = r
+    else:
+        unique_results = _run_with_store(unique, n_jobs, store, order)
+
+    if scheduler is not None:
+        scheduler.record(unique_results)
+        if verbose:
+            print(scheduler.report(time.perf_counter() - start))
+
+    results, used = [], set()
+    for i in indices:
+        # Duplicates get their own copy so per-result edits stay per-layer
+        r = unique_results[i]
+        results.append(copy.deepcopy(r) if i in used else r)
+        used.add(i)
+    if as_table:
+        return MacroOutputStatsTable.from_results(results)
+    return MacroOutputStatsList(results)
+
+
+def _evaluate_or_search(
+    spec: tl.Specification, mapping: List[dict]
+) -> Tuple[MacroOutputStats, bool]:
+    try:
+        return evaluate_mapping(spec, mapping), False
+    except RuntimeError:  # timeloop-model rejected the mapping for this point
+        return run_mapper(spec), True
+
+
+def explore_variables(
+    spec: tl.Specification,
+    grid: dict,
+    n_jobs: int = 32,
+) -> dse.ExplorationTable:
+    """
+    Evaluates spec at every point of a {variable: values} grid. Variables are
+    classified by whether they change the mapspace (see
+    dse.classify_variables). The mapper runs once per combination of
+    mapspace-changing values, and the other points reuse that mapping with
+    timeloop-model. Energy-only points share Accelergy tables wherever their
+    component attributes match (see accelergy_cache).
+
+    Returns:
+        A dse.ExplorationTable with one row per point, in the order of
+        dse.grid_points.
+    """
+    points = dse.grid_points(grid)
+    kinds = dse.classify_variables(spec, grid)
+    groups = dse.mapspace_groups(points, kinds)
+    specs = [dse.with_variables(spec, p) for p in points]
+    pool = get_worker_pool(n_jobs)
+
+    results, searched = [None] * len(points), [False] * len(points)
+    firsts = [g[0] for g in groups]
+    for i, r in zip(firsts, pool.map(delayed(run_mapper)(specs[i]) for i in firsts)):
+        results[i], searched[i] = r, True
+
+    rest = [(i, g[0]) for g in groups for i in g[1:]]
+    stream = pool.stream(
+        delayed(_evaluate_or_search)(specs[i], results[f].mapping_directives)
+        for i, f in rest
     )
+    for j, (r, s) in tqdm(stream, total=len(rest)):
+        results[rest[j][0]], searched[rest[j][0]] = r, s
+    return dse.ExplorationTable(points, kinds, groups, results, searched)
 
 
 def path_from_model_dir(*args):
@@ -50,16 +231,73 @@ def path_from_model_dir(*args):
 
 
 def get_run_dir():
-    out_dir = os.path.join(
-        THIS_SCRIPT_DIR,
-        "..",
-        "outputs",
-        f"{os.getpid()}.{threading.current_thread().ident}",
-    )
-    if os.path.exists(out_dir):
-        shutil.rmtree(out_dir)
-    os.makedirs(out_dir, exist_ok=True)
-    return out_dir
+    """Returns a new, empty run directory. See output_manager.OutputManager."""
+    return output_manager.get_output_manager().allocate()
+
+
+def _finish_run(result: MacroOutputStats, output_dir: str, keep_all: bool):
+    """Keeps the run's artifacts (all of them if keep_all) and records them in
+    result.run_id and result.artifacts. The artifacts are deleted after later
+    runs; see output_manager.OutputManager."""
+    keep = None if keep_all else output_manager.KEEP_ARTIFACTS
+    result.run_id = os.path.basename(output_dir)
+    result.artifacts = output_manager.get_output_manager().finish(output_dir, keep)
+
+
+def _load_cached(cache_key: str) -> Optional[MacroOutputStats]:
+    """result_cache.load, with run_id and artifacts cleared. The files of the
+    run that produced a cached result have usually been deleted since."""
+    result = result_cache.load(cache_key)
+    if result is not None:
+        result.run_id, result.artifacts = None, {}
+    return result
+
+
+# Parsed specifications without a layer, keyed on the Jinja parse data. Each
+# entry holds the modification times of the files it was parsed from.
+_SPEC_TEMPLATE_CACHE = {}
+
+
+def _spec_template_files(jinja_parse_data: dict) -> List[str]:
+    d = jinja_parse_data
+    globs = [
+        "top.yaml.jinja2",
+        "include/*",
+        "components/*.yaml",
+        "memory_cells/*",
+        f"arch/1_macro/{d['macro']}/*",
+        f"arch/1_macro/{d['iso']}/*",
+    ]
+    for level, key in [("2_tile", "tile"), ("3_chip", "chip"), ("4_system", "system")]:
+        if d.get(key):
+            globs.append(f"arch/{level}/{d[key]}.yaml")
+    return sorted(set(f for g in globs for f in glob.glob(path_from_model_dir(g))))
+
+
+def _get_spec_template(paths: List[str], jinja_parse_data: dict) -> tl.Specification:
+    """
+    Returns a copy of the specification parsed without the layer. Parsed
+    specifications are cached per process and re-parsed if any of the files
+    they were built from change.
+    """
+    template_data = {
+        k: v for k, v in jinja_parse_data.items() if k not in ("layer", "dnn")
+    }
+    key = json.dumps([paths, template_data], sort_keys=True, default=str)
+    mtimes = [
+        (f, os.path.getmtime(f)) for f in _spec_template_files(template_data)
+    ]
+    cached = _SPEC_TEMPLATE_CACHE.get(key)
+    if cached is None or cached[0] != mtimes:
+        spec = tl.Specification.from_yaml_files(
+            *paths, processors=[ArrayProcessor], jinja_parse_data=template_data
+        )
+        cached = _SPEC_TEMPLATE_CACHE[key] = (mtimes, spec)
+    return copy.deepcopy(cached[1])
+
+
+def clear_spec_cache():
+    _SPEC_TEMPLATE_CACHE.clear()
 
 
 def get_spec(
@@ -103,118 +341,161 @@ def get_spec(
     if not extra_print:
         extra_print = f"{os.getpid()}.{threading.current_thread().ident}"
 
-    spec = tl.Specification.from_yaml_files(
-        *paths, processors=[ArrayProcessor], jinja_parse_data=jinja_parse_data
-    )
+    spec = _get_spec_template(paths, jinja_parse_data)
+    if layer is not None:
+        problem = copy.deepcopy(load_layer_problem(layer, dnn))
+        spec["problem"] = spec.problem = tl.problem.Problem(problem)
     if max_utilization:
         spec.variables["MAX_UTILIZATION"] = True
 
     return spec
 
 
-def run_with_mapping(
+def load_mapping(mapping: Union[str, dict, list]) -> List[dict]:
+    """Returns the list of mapping directives from a mapping YAML file path, a
+    loaded mapping YAML (with or without the top-level "mapping" key), or a
+    list of directives."""
+    if isinstance(mapping, str):
+        with open(mapping) as f:
+            mapping = yaml.safe_load(f)
+    if isinstance(mapping, dict):
+        if "mapping" not in mapping:
+            raise ValueError(f"Mapping has no 'mapping' key: {mapping}")
+        mapping = mapping["mapping"]
+    if not isinstance(mapping, list):
+        raise ValueError(
+            f"Expected a list of mapping directives. Got {type(mapping)}. If this "
+            f"is a .map.txt file, use the .map.yaml file Timeloop writes instead."
+        )
+    return [dict(m) for m in mapping]
+
+
+def _accelergy_tables(
+    spec: tl.Specification, output_dir: str, processed: tl.Specification = None
+) -> Optional[List[str]]:
+    """Returns cached ERT/ART files for Timeloop, copied into output_dir, or
+    None if Timeloop should call Accelergy itself."""
+    if not accelergy_cache.ACCELERGY_CACHE_ENABLED:
+        return None
+    return accelergy_cache.get_tables(spec, output_dir, processed)
+
+
+def _call_model(
     spec: tl.Specification,
-    mapping_file: str,
+    mapping: List[dict],
+    output_dir: str,
+    tables: Optional[List[str]] = None,
+) -> tl.output_parsing.OutputStats:
+    spec.mapping = tl.mapping.Mapping(mapping)
+    return tl.call_model(
+        specification=spec,
+        output_dir=output_dir,
+        extra_input_files=tables,
+        log_to=os.path.join(output_dir, "timeloop-model.log"),
+    )
+
+
+def evaluate_mapping(
+    spec: tl.Specification,
+    mapping: Union[str, dict, list],
     accelergy_verbose: bool = False,
-) -> dict:
-    """Run Timeloop with a specific mapping file.
-    
-    This function executes timeloop-mapper directly as a subprocess, which is more
-    reliable than trying to use the Python API for fixed mappings.
-    
+    processed: tl.Specification = None,
+) -> MacroOutputStats:
+    """Evaluate a fixed mapping with timeloop-model. This never searches: if
+    the mapping is invalid for the spec, Timeloop's error is raised.
+
     Args:
         spec: The Timeloop specification
-        mapping_file: Path to the mapping YAML file
+        mapping: The mapping to evaluate. See load_mapping for accepted formats.
         accelergy_verbose: Whether to run accelergy in verbose mode
-        
+        processed: result_cache.process_copy(spec), if already computed
+
     Returns:
-        The evaluation results
+        The evaluation results. The run_seconds attribute holds the wall-clock
+        time of the evaluation and mapping_directives holds the mapping.
+        run_id and artifacts name the files kept from the run. They are
+        temporary; see output_manager.
     """
-    import subprocess
-    import tempfile
-    import shutil
-    
-    # Create output directory
+    mapping = load_mapping(mapping)
     output_dir = get_run_dir()
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Create temporary files for the command-line approach
-    spec_file = os.path.join(output_dir, "spec.yaml")
-    
-    # Save the spec as YAML using tl's own utilities
-    with open(spec_file, 'w') as f:
-        if hasattr(spec, 'to_yaml_str'):
-            f.write(spec.to_yaml_str())
-        else:
-            # Fallback - try to use the internal structure
-            import json
-            spec_dict = spec.spec if hasattr(spec, 'spec') else spec.__dict__
-            json.dump(spec_dict, f, indent=2)
-    
-    # Create a minimal mapper config file
-    mapper_config = os.path.join(output_dir, "mapper.yaml")
-    with open(mapper_config, 'w') as f:
-        f.write("""
-mapper:
-  algorithm: exhaustive
-  search_size: 1
-  timeout: 0
-  victory_condition: 0
-""")
-    
-    # Copy the mapping file to the output directory
-    map_file_in_output = os.path.join(output_dir, "mapping.yaml")
-    shutil.copy(mapping_file, map_file_in_output)
-    
-    # Run timeloop-mapper directly using subprocess
-    cmd = [
-        "timeloop-mapper",
-        spec_file,
-        mapper_config,
-        map_file_in_output,
-        "-o", output_dir
-    ]
-    
-    print(f"Running command: {' '.join(cmd)}")
-    
+    start = time.perf_counter()
+    tables = _accelergy_tables(spec, output_dir, processed)
+    model_result = _call_model(spec, mapping, output_dir, tables)
+    run_seconds = time.perf_counter() - start
+
+    # Cached tables come with the outputs of a verbose Accelergy run
+    if accelergy_verbose and tables is None:
+        tl.call_accelergy_verbose(
+            specification=spec,
+            output_dir=output_dir,
+            log_to=os.path.join(output_dir, "accelergy.log"),
+        )
+
+    result = MacroOutputStats.from_output_stats(model_result)
+    result.run_seconds = run_seconds
+    result.mapping_directives = mapping
+    _finish_run(result, output_dir, accelergy_verbose)
+    return result
+
+
+def run_with_mapping(
+    spec: tl.Specification,
+    mapping_file: str,
+    accelergy_verbose: bool = False,
+) -> MacroOutputStats:
+    """Run Timeloop with a specific mapping file. See evaluate_mapping."""
+    return evaluate_mapping(spec, mapping_file, accelergy_verbose)
+
+
+def run_max_utilization(
+    spec: tl.Specification,
+    accelergy_verbose: bool = False,
+    cross_check: bool = False,
+) -> MacroOutputStats:
+    """Evaluate a max-utilization spec with the mapping from
+    analytic_mapping.max_utilization_mapping instead of searching.
+
+    Args:
+        spec: The Timeloop specification, with MAX_UTILIZATION set
+        accelergy_verbose: Whether to run accelergy in verbose mode
+        cross_check: Whether to also run the mapper and compare. The
+            differences are printed and stored in the cross_check attribute
+            of the result (see analytic_mapping.compare_results).
+
+    If no mapping can be derived or Timeloop rejects it, the mapper is run
+    instead.
+
+    Returns:
+        The evaluation results, as from run_mapper.
+    """
+    processed = result_cache.process_copy(spec)
     try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        print("Command output:")
-        print(result.stdout)
-        
-        # Parse the results from the stats file
-        stats_file = os.path.join(output_dir, "timeloop-mapper.stats.txt")
-        if os.path.exists(stats_file):
-            return MacroOutputStats.from_output_stats(
-                tl.output_parsing.OutputStats.from_file(stats_file)
-            )
-        else:
-            print("Stats file not found after running timeloop-mapper")
-            
-    except subprocess.CalledProcessError as e:
-        print(f"Error running timeloop-mapper: {e}")
-        print("STDOUT:", e.stdout)
-        print("STDERR:", e.stderr)
-    except Exception as e:
-        print(f"Unexpected error: {e}")
-    
-    # If subprocess approach fails, fall back to the normal API approach
-    print("Falling back to normal API approach")
-    mapper = tl.mapper.Mapper()
-    mapper.algorithm = "exhaustive"
-    mapper.search_size = 1
-    mapper.timeout = 0
-    spec.mapper = mapper
-    
-    return run_mapper(spec, accelergy_verbose)
+        mapping = analytic_mapping.max_utilization_mapping(processed)
+        result = run_mapper(spec, accelergy_verbose, mapping_file=mapping)
+    except (analytic_mapping.AnalyticMappingError, RuntimeError) as e:
+        # No mapping could be derived, or timeloop-model rejected it
+        print(f"Analytic mapping failed, running the mapper instead: {e}")
+        return run_mapper(spec, accelergy_verbose)
+
+    if cross_check:
+        searched = run_mapper(spec, use_cache=False, reuse_mapping=False)
+        result.cross_check = analytic_mapping.compare_results(result, searched)
+        print(analytic_mapping.format_differences(result.cross_check))
+    return result
 
 
 def quick_run(
     macro: str,
     variables: dict = None,
     accelergy_verbose: bool = False,
+    reuse_mapping: bool = None,
+    analytic: bool = None,
+    cross_check: bool = False,
     **kwargs,
 ):
+    """Run a macro on a problem sized to fill it. With analytic (default
+    analytic_mapping.ANALYTIC_MAPPING_ENABLED) or cross_check, the mapping is
+    derived instead of searched; see run_max_utilization."""
     spec = get_spec(
         macro=macro,
         system="ws_dummy_buffer_one_macro",
@@ -227,7 +508,13 @@ def quick_run(
         if k not in variables:
             spec.variables[k] = spec.variables.pop(k)
 
-    return run_mapper(spec, accelergy_verbose=accelergy_verbose)
+    if analytic is None:
+        analytic = analytic_mapping.ANALYTIC_MAPPING_ENABLED
+    if analytic or cross_check:
+        return run_max_utilization(spec, accelergy_verbose, cross_check)
+    return run_mapper(
+        spec, accelergy_verbose=accelergy_verbose, reuse_mapping=reuse_mapping
+    )
 
 
 def get_diagram(
@@ -274,6 +561,7 @@ def run_layer(
     tile=None,
     chip=None,
     system="ws_dummy_buffer_many_macro",
+    reuse_mapping: bool = None,
 ):
     spec = get_spec(
         macro=macro, iso=iso, layer=layer, tile=tile, chip=chip, system=system
@@ -291,7 +579,7 @@ def run_layer(
         callfunc(spec)
 
     try:
-        return run_mapper(spec=spec)
+        return run_mapper(spec=spec, reuse_mapping=reuse_mapping)
     except Exception as e:
         print(f"Error processing spec with {macro}, {iso}, {layer}, {variables}")
         raise e
@@ -340,7 +628,7 @@ def run_layer_with_mapping(
         callfunc(spec)
 
     try:
-        return run_with_mapping(spec=spec, mapping_file=mapping_file)
+        return evaluate_mapping(spec=spec, mapping=mapping_file)
     except Exception as e:
         print(f"Error processing spec with {macro}, {iso}, {layer}, {variables}")
         raise e
@@ -348,132 +636,145 @@ def run_layer_with_mapping(
 
 def save_best_mapping(output_stats, output_file):
     """Save the best mapping from a mapper run to a file.
+
+    The file is a mapping YAML that can be passed to evaluate_mapping.
     
     Args:
         output_stats: The output stats from run_mapper
         output_file: The file to save the mapping to
     """
-    # Check if the output_stats object has a mapping attribute
-    has_mapping = hasattr(output_stats, 'mapping')
-    if has_mapping and output_stats.mapping:
-        # We already have a mapping in the object, use it
-        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
-        with open(output_file, 'w') as f:
-            f.write(output_stats.mapping)
-        print(f"Saved best mapping to {output_file}")
-        return True
-    
-    # If we don't have a mapping in the object, try to find it in one of the output directories
-    # Look for map files in outputs directory
-    output_dirs = glob.glob(os.path.join(THIS_SCRIPT_DIR, "..", "outputs", "*"))
-    map_files = []
-    for output_dir in output_dirs:
-        map_files.extend(glob.glob(f"{output_dir}/*.map.txt"))
-    
-    # Try to read from the most recent map file if available
-    if map_files:
-        # Sort by modification time (newest first)
-        map_files.sort(key=lambda x: os.path.getmtime(x), reverse=True)
-        try:
-            with open(map_files[0], 'r') as f:
-                mapping_content = f.read()
-            
-            # Write the mapping to the output file
-            os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
-            with open(output_file, 'w') as f:
-                f.write(mapping_content)
-            print(f"Saved best mapping to {output_file} (loaded from {map_files[0]})")
-            return True
-        except Exception as e:
-            print(f"Error reading or writing mapping file: {e}")
-            return False
-    
-    # If we reach here, we couldn't find mapping data
-    print("Warning: Could not find mapping data in the provided output stats or any output directory")
-    return False
+    mapping = getattr(output_stats, "mapping_directives", None)
+    if not mapping:
+        print("Warning: Could not find mapping data in the provided output stats")
+        return False
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    with open(output_file, "w") as f:
+        yaml.safe_dump({"mapping": mapping}, f, sort_keys=False)
+    print(f"Saved best mapping to {output_file}")
+    return True
+
+
+def _evaluate_mapping_cached(
+    spec: tl.Specification,
+    mapping: List[dict],
+    accelergy_verbose: bool,
+    processed: tl.Specification,
+    use_cache: bool,
+) -> MacroOutputStats:
+    """evaluate_mapping, with the result cached under the spec and mapping."""
+    if use_cache:
+        cache_key = result_cache.spec_hash(spec, mapping, processed=processed)
+        if (cached := _load_cached(cache_key)) is not None:
+            return cached
+    result = evaluate_mapping(spec, mapping, accelergy_verbose, processed)
+    if use_cache:
+        result_cache.store(cache_key, result)
+    return result
 
 
 def run_mapper(
     spec: tl.Specification,
     accelergy_verbose: bool = False,
-    mapping_file: str = None,
-) -> dict:
+    mapping_file: Union[str, dict, list] = None,
+    use_cache: bool = None,
+    reuse_mapping: bool = None,
+) -> MacroOutputStats:
     """Run Timeloop mapper to find an optimal mapping.
     
     Args:
         spec: The Timeloop specification
         accelergy_verbose: Whether to run accelergy in verbose mode
-        mapping_file: Optional path to a mapping file to use instead of searching
+        mapping_file: Optional mapping to evaluate instead of searching. See
+            load_mapping for accepted formats and evaluate_mapping.
+        use_cache: Whether to return a stored result if an identical
+            specification has been run before. Defaults to
+            result_cache.RESULT_CACHE_ENABLED. Verbose Accelergy runs are never
+            cached because their output files are the point of the run.
+        reuse_mapping: Whether to reuse the mapping found for an earlier spec
+            with the same mapspace (see mapping_reuse.mapspace_hash). If one
+            exists, the mapping is evaluated with timeloop-model instead of
+            searching, and the result is cached as an evaluation of that
+            mapping rather than as a search. Defaults to
+            mapping_reuse.MAPPING_REUSE_ENABLED.
+
+    Accelergy's energy and area tables are computed once per set of component
+    attributes and shared between runs (see accelergy_cache).
         
     Returns:
-        The evaluation results
+        The evaluation results. The run_seconds attribute holds the wall-clock
+        time of the Timeloop call and mapping_directives holds the mapping.
+        run_id and artifacts name the files kept from the run. They are
+        temporary; see output_manager. A result from the cache has run_id None
+        and no artifacts.
     """
-    output_dir = get_run_dir()
+    if use_cache is None:
+        use_cache = result_cache.RESULT_CACHE_ENABLED
+    use_cache = use_cache and not accelergy_verbose
+
+    # Process the spec once for all of the caches below
+    processed = result_cache.process_copy(spec)
 
-    run_prefix = f"{output_dir}/timeloop-mapper"
-    
-    # Call the mapper with or without a mapping file
     if mapping_file:
-        # Copy the mapping file to the output directory
-        import shutil
-        mapping_in_output = os.path.join(output_dir, "mapping.yaml")
-        shutil.copy(mapping_file, mapping_in_output)
-        
-        print(f"Using provided mapping from {mapping_file}")
-        # Check if call_mapper supports the flags parameter
-        import inspect
-        call_mapper_params = inspect.signature(tl.call_mapper).parameters
-        
-        if 'flags' in call_mapper_params:
-            # If flags is supported, use it to specify the mapping file
-            mapper_result = tl.call_mapper(
-                specification=spec,
-                output_dir=output_dir,
-                log_to=os.path.join(output_dir, f"{run_prefix}.log"),
-                flags=["--mapping-file", mapping_in_output]
+        return _evaluate_mapping_cached(
+            spec, load_mapping(mapping_file), accelergy_verbose, processed, use_cache
+        )
+
+    if use_cache:
+        cache_key = result_cache.spec_hash(spec, None, processed=processed)
+        if (cached := _load_cached(cache_key)) is not None:
+            return cached
+
+    if reuse_mapping is None:
+        reuse_mapping = mapping_reuse.MAPPING_REUSE_ENABLED
+    reuse_key = None
+    if reuse_mapping:
+        reuse_key = mapping_reuse.mapspace_hash(spec, processed)
+        try:
+            mapping = mapping_reuse.get_or_claim(reuse_key)
+        except TimeoutError:  # Search without sharing rather than keep waiting
+            mapping, reuse_key = None, None
+        if mapping is not None:
+            # The mapping was found for another spec and may be worse than a
+            # search would find, so the result is cached as an evaluation of
+            # that mapping and never under the search's key
+            return _evaluate_mapping_cached(
+                spec, mapping, accelergy_verbose, processed, use_cache
             )
-        else:
-            # If flags is not supported, we need a different approach
-            # Let's try setting the mapping directly on the spec
-            try:
-                # Read the mapping file to see if we can parse it
-                with open(mapping_file, 'r') as f:
-                    mapping_content = f.read()
-                
-                # Try a simple approach - just set a fixed mapper
-                from pytimeloop.timeloopfe.v4.mapper import Mapper
-                spec.mapper = Mapper()
-                spec.mapper.algorithm = "exhaustive"
-                spec.mapper.search_size = 1
-                spec.mapper.timeout = 0
-                
-                # Run the mapper normally, it should use our config
-                mapper_result = tl.call_mapper(
-                    specification=spec,
-                    output_dir=output_dir,
-                    log_to=os.path.join(output_dir, f"{run_prefix}.log"),
-                )
-            except Exception as e:
-                print(f"Error setting mapping: {e}")
-                # Fall back to the normal call
-                mapper_result = tl.call_mapper(
-                    specification=spec,
-                    output_dir=output_dir,
-                    log_to=os.path.join(output_dir, f"{run_prefix}.log"),
-                )
-    else:
-        # Normal mapper call without a mapping file
+
+    # Any failure from here on must release the claim, or other processes
+    # with this mapspace would wait for a mapping that never comes
+    try:
+        output_dir = get_run_dir()
+        run_prefix = f"{output_dir}/timeloop-mapper"
+
+        start = time.perf_counter()
+        tables = _accelergy_tables(spec, output_dir, processed)
         mapper_result = tl.call_mapper(
             specification=spec,
             output_dir=output_dir,
+            extra_input_files=tables,
             log_to=os.path.join(output_dir, f"{run_prefix}.log"),
         )
-        
-    if accelergy_verbose:
+        mapping = load_mapping(f"{run_prefix}.map.yaml")
+        if reuse_key is not None:
+            mapping_reuse.store(reuse_key, f"{run_prefix}.map.yaml")
+    finally:
+        if reuse_key is not None:
+            mapping_reuse.release(reuse_key)
+    run_seconds = time.perf_counter() - start
+
+    if accelergy_verbose and tables is None:
         tl.call_accelergy_verbose(
             specification=spec,
             output_dir=output_dir,
             log_to=os.path.join(output_dir, "accelergy.log"),
         )
 
-    return MacroOutputStats.from_output_stats(mapper_result)
+    result = MacroOutputStats.from_output_stats(mapper_result)
+    result.run_seconds = run_seconds
+    result.mapping_directives = mapping
+    _finish_run(result, output_dir, accelergy_verbose)
+    if use_cache:
+        result_cache.store(cache_key, result)
+    return result
@@ -0,0 +1,94 @@
+import concurrent.futures
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from joblib.externals.loky import get_reusable_executor
+from tqdm import tqdm
+
+import result_cache
+from tl_output_parsing import MacroOutputStatsList
+
+# Seconds a worker may sit idle before it exits. Long enough to keep workers
+# warm between the cells of a notebook.
+IDLE_TIMEOUT_SECONDS = 3600
+
+
+def _initialize_worker(warm_up: Tuple[tuple, ...]):
+    result_cache.source_hash()
+    for func, args, kwargs in warm_up:
+        func(*args, **kwargs)
+
+
+class WorkerPool:
+    """
+    A persistent process pool. Workers are started once and reused across
+    calls, so imports, spec templates (see utils.get_spec), parsed layers, and
+    other per-process caches stay warm between jobs.
+
+    Jobs are delayed calls, i.e., the (function, args, kwargs) tuples created
+    by joblib.delayed.
+
+    Args:
+        n_jobs: Number of worker processes.
+        warm_up: Delayed calls to run in each worker when it starts, e.g.,
+            [delayed(utils.get_spec)(macro="raella_isca_2023")] to parse the
+            spec template before the first job arrives.
+    """
+
+    def __init__(self, n_jobs: int = 32, warm_up: Iterable[tuple] = ()):
+        self.n_jobs = n_jobs
+        self.warm_up = tuple(warm_up)
+
+    @property
+    def executor(self) -> concurrent.futures.Executor:
+        # Loky hands back the running executor if the arguments are unchanged,
+        # and replaces it (e.g., after a worker crash) otherwise.
+        return get_reusable_executor(
+            max_workers=self.n_jobs,
+            timeout=IDLE_TIMEOUT_SECONDS,
+            initializer=_initialize_worker,
+            initargs=(self.warm_up,),
+        )
+
+    def submit(self, delayed_call: tuple) -> concurrent.futures.Future:
+        func, args, kwargs = delayed_call
+        return self.executor.submit(func, *args, **kwargs)
+
+    def stream(self, delayed_calls: Iterable[tuple]) -> Iterator[Tuple[int, object]]:
+        """Yields (index, result) pairs as jobs finish, in completion order."""
+        futures = {self.submit(c): i for i, c in enumerate(delayed_calls)}
+        try:
+            for f in concurrent.futures.as_completed(futures):
+                yield futures[f], f.result()
+        finally:
+            for f in futures:
+                f.cancel()
+
+    def map(
+        self, delayed_calls: Iterable[tuple], progress: bool = True
+    ) -> MacroOutputStatsList:
+        """Runs jobs and returns their results in submission order."""
+        delayed_calls = list(delayed_calls)
+        results: List[Optional[object]] = [None] * len(delayed_calls)
+        stream = self.stream(delayed_calls)
+        if progress:
+            stream = tqdm(stream, total=len(delayed_calls))
+        for i, r in stream:
+            results[i] = r
+        return MacroOutputStatsList(results)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, kill_workers=True)
+
+
+_POOL: Optional[WorkerPool] = None
+
+
+def get_worker_pool(n_jobs: int = 32) -> WorkerPool:
+    """
+    Returns the session's worker pool. Loky keeps one executor per process, so
+    asking for a different number of workers restarts the pool.
+    """
+    global _POOL
+    if _POOL is None or _POOL.n_jobs != n_jobs:
+        _POOL = WorkerPool(n_jobs)
+    return _POOL
@@ -0,0 +1,108 @@
+import functools
+import os
+import sys
+from typing import Any, List, Optional
+
+import jinja2
+import yaml
+
+THIS_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.abspath(os.path.join(THIS_SCRIPT_DIR, "..", "models"))
+sys.path.append(os.path.join(MODELS_DIR, "include"))
+import slicing_encoding
+
+
+def find_layer_path(layer: str, dnn: Optional[str] = None) -> str:
+    """
+    Resolves a layer the same way top.yaml.jinja2 does: the DNN name is
+    prepended if given, then the layer is used as a path if it exists, else it
+    is looked up in the workloads directory.
+    """
+    if dnn is not None:
+        layer = f"{dnn}/{layer}"
+    for candidate in [
+        os.path.join(MODELS_DIR, layer),
+        layer,
+        os.path.join(MODELS_DIR, "workloads", f"{layer}.yaml"),
+    ]:
+        if os.path.isfile(candidate):
+            return os.path.abspath(candidate)
+    raise FileNotFoundError(f"Could not find layer {layer}")
+
+
+def _merge_recursive(base: Any, override: Any) -> Any:
+    if not isinstance(base, dict) or not isinstance(override, dict):
+        return override
+    merged = dict(base)
+    for k, v in override.items():
+        merged[k] = _merge_recursive(merged[k], v) if k in merged else v
+    return merged
+
+
+def _resolve_merge_keys(node: Any) -> Any:
+    """Applies timeloopfe's recursive '<<<' merge key to a loaded YAML tree."""
+    if isinstance(node, list):
+        return [_resolve_merge_keys(n) for n in node]
+    if not isinstance(node, dict):
+        return node
+    node = {k: _resolve_merge_keys(v) for k, v in node.items()}
+    if "<<<" not in node:
+        return node
+    bases = node.pop("<<<")
+    merged = {}
+    for b in bases if isinstance(bases, list) else [bases]:
+        merged = _merge_recursive(merged, b)
+    return _merge_recursive(merged, node)
+
+
+@functools.lru_cache(maxsize=4096)
+def _load_problem(path: str, mtime: float) -> dict:
+    dirname = os.path.dirname(path)
+
+    def include_text(p: str) -> str:
+        with open(os.path.join(dirname, p)) as f:
+            return f.read()
+
+    env = jinja2.Environment(undefined=jinja2.StrictUndefined)
+    env.globals["include_text"] = include_text
+    with open(path) as f:
+        rendered = env.from_string(f.read()).render()
+    return _resolve_merge_keys(yaml.safe_load(rendered))["problem"]
+
+
+def load_layer_problem(layer: str, dnn: Optional[str] = None) -> dict:
+    """
+    Returns the 'problem' block of a layer file as plain Python data without
+    building a full specification. Results are cached until the file changes.
+    The returned dictionary is shared; do not modify it.
+    """
+    path = find_layer_path(layer, dnn)
+    return _load_problem(path, os.path.getmtime(path))
+
+
+def histogram_signature(hist: List[float], decimals: Optional[int] = None) -> list:
+    """
+    Returns a signature of a histogram after encoding. With decimals=None, the
+    signature is the normalized histogram itself. Otherwise, it is the
+    signedness, the probability of zero, and the per-bit probabilities under
+    offset and magnitude encoding, rounded to the given number of decimals.
+    Histograms with equal signatures yield (nearly) the same energy.
+    """
+    total = sum(hist)
+    if decimals is None:
+        return [h / total for h in hist]
+
+    se = slicing_encoding
+    n_bits = se.get_num_bits(hist)
+    bit_probs = [
+        se.encoded_hist_to_avg_slice(encoded, b, 1, return_per_slice=True)
+        for encoded, b in [
+            (se.offset_encode_hist(hist), n_bits),
+            (se.magnitude_encode_hist(hist), n_bits - 1),
+        ]
+    ]
+    return [
+        se.is_hist_signed(hist),
+        round(hist[len(hist) // 2] / total, decimals),
+        [[round(p, decimals) for p in b] for b in bit_probs],
+    ]
@@ -0,0 +1,57 @@
+"""
+Checks how analytic_mapping places spatial factors on arrays.
+"""
+import math
+import os
+import sys
+
+import pytest
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+)
+from analytic_mapping import AnalyticMappingError, _spatial_split
+
+
+def mesh_factors(factors, permutation, split):
+    x = math.prod(factors.get(d, 1) for d in permutation[:split])
+    y = math.prod(factors.get(d, 1) for d in permutation[split:])
+    return x, y
+
+
+def test_row_puts_everything_on_x():
+    factors = {"C": 4, "M": 8}
+    permutation, split = _spatial_split(factors, "CMRS", 32, 1)
+    assert permutation == "CMRS"
+    assert mesh_factors(factors, permutation, split) == (32, 1)
+
+
+def test_column_puts_everything_on_y():
+    factors = {"C": 4, "M": 8}
+    permutation, split = _spatial_split(factors, "CMRS", 1, 32)
+    assert split == 0
+    assert mesh_factors(factors, permutation, split) == (1, 32)
+
+
+def test_2d_array_splits_across_x_and_y():
+    factors = {"C": 8, "M": 4}
+    permutation, split = _spatial_split(factors, "CMRS", 8, 4)
+    assert (permutation, split) == ("CMRS", 1)
+    assert mesh_factors(factors, permutation, split) == (8, 4)
+
+    # The given order puts C on X, which does not fit, so M goes first
+    permutation, split = _spatial_split(factors, "CMRS", 4, 8)
+    assert (permutation, split) == ("MCRS", 1)
+    assert mesh_factors(factors, permutation, split) == (4, 8)
+
+
+def test_2d_array_partial_fill():
+    factors = {"C": 2, "M": 3, "R": 4}
+    permutation, split = _spatial_split(factors, "CMRS", 6, 4)
+    x, y = mesh_factors(factors, permutation, split)
+    assert x <= 6 and y <= 4 and x * y == 24
+
+
+def test_factors_that_do_not_fit_raise():
+    with pytest.raises(AnalyticMappingError):
+        _spatial_split({"C": 12}, "CMRS", 3, 4)
@@ -0,0 +1,66 @@
+"""
+Checks mapspace claims in mapping_reuse and their release by run_mapper.
+"""
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+)
+import mapping_reuse
+import utils
+
+
+@pytest.fixture(autouse=True)
+def mapping_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(mapping_reuse, "MAPPING_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_claim_and_store(tmp_path):
+    assert mapping_reuse.get_or_claim("k") is None
+    with open(mapping_reuse._lock_path("k")) as f:
+        assert f.read() == f"{socket.gethostname()} {os.getpid()}"
+
+    mapping_yaml = tmp_path / "found.map.yaml"
+    mapping_yaml.write_text("mapping: [{target: buffer}]\n")
+    mapping_reuse.store("k", str(mapping_yaml))
+    assert not os.path.exists(mapping_reuse._lock_path("k"))
+    assert mapping_reuse.get_or_claim("k") == [{"target": "buffer"}]
+
+
+def test_dead_holder_is_taken_over():
+    exited = subprocess.Popen(["true"])
+    exited.wait()
+    with open(mapping_reuse._lock_path("k"), "w") as f:
+        f.write(f"{socket.gethostname()} {exited.pid}")
+    assert mapping_reuse.get_or_claim("k") is None
+    with open(mapping_reuse._lock_path("k")) as f:
+        assert f.read() == f"{socket.gethostname()} {os.getpid()}"
+
+
+def test_wait_times_out_without_claiming():
+    holder = "otherhost 1"
+    with open(mapping_reuse._lock_path("k"), "w") as f:
+        f.write(holder)
+    with pytest.raises(TimeoutError):
+        mapping_reuse.get_or_claim("k", poll_seconds=0.01, timeout_seconds=0.05)
+    with open(mapping_reuse._lock_path("k")) as f:
+        assert f.read() == holder
+
+
+def test_run_mapper_releases_claim_on_failure(monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("Accelergy failed")
+
+    monkeypatch.setattr(utils.result_cache, "process_copy", lambda spec: spec)
+    monkeypatch.setattr(mapping_reuse, "mapspace_hash", lambda spec, p: "k")
+    monkeypatch.setattr(utils, "get_run_dir", lambda: "unused")
+    monkeypatch.setattr(utils, "_accelergy_tables", fail)
+    with pytest.raises(RuntimeError):
+        utils.run_mapper(None, use_cache=False, reuse_mapping=True)
+    assert not os.path.exists(mapping_reuse._lock_path("k"))
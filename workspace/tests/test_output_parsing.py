@@ -0,0 +1,167 @@
+"""
+Checks MacroOutputStats, MacroOutputStatsList, and MacroOutputStatsTable.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+)
+from tl_output_parsing import (
+    DERIVED_METRICS,
+    MacroOutputStats,
+    MacroOutputStatsList,
+    MacroOutputStatsTable,
+)
+
+
+def make_result(
+    computes=4096, cycles=100, energy=(2e-12, 3e-12), area=(1e-9, 5e-10), **variables
+):
+    variables = {
+        "INPUT_BITS": 8,
+        "WEIGHT_BITS": 8,
+        "OUTPUT_BITS": 8,
+        "ENCODED_INPUT_BITS": 1,
+        "ENCODED_WEIGHT_BITS": 1,
+        "ENCODED_OUTPUT_BITS": 1,
+        **variables,
+    }
+    return MacroOutputStats(
+        50.0,
+        computes,
+        cycles,
+        1e-9,
+        {"adc": energy[0], "buffer": energy[1]},
+        {"adc": area[0], "buffer": area[1]},
+        variables,
+        "mapping",
+    )
+
+
+def derived_metrics(result):
+    return {k: getattr(result, k) for k in DERIVED_METRICS}
+
+
+@pytest.mark.parametrize(
+    "method,name",
+    [
+        ("add_compare_ref", "computes"),
+        ("add_compare_ref_area", "adc"),
+        ("add_compare_ref_energy", "adc"),
+    ],
+)
+def test_derived_metrics_after_compare_ref(method, name):
+    expected = derived_metrics(make_result())
+    result = make_result()
+    getattr(result, method)(name, 1.0)
+    assert derived_metrics(result) == pytest.approx(expected, rel=1e-12, abs=0)
+
+    table = MacroOutputStatsList([make_result(), make_result()]).to_table()
+    getattr(table, method)(name, [1.0, 2.0])
+    for r in table:
+        assert derived_metrics(r) == pytest.approx(expected, rel=1e-12, abs=0)
+
+
+def sweep():
+    """Two layers for each of three macro sizes."""
+    return MacroOutputStatsList(
+        [
+            make_result(
+                computes=1024 * (layer + 1),
+                cycles=10 * (layer + 1) * n_columns,
+                energy=(1e-12 * n_columns, 2e-12 * (layer + 1)),
+                area=(1e-9 * n_columns, 1e-10 * (layer + 1)),
+                N_COLUMNS=n_columns,
+                LAYER=layer,
+            )
+            for n_columns in (64, 128, 256)
+            for layer in range(2)
+        ]
+    )
+
+
+def assert_same_results(a, b):
+    assert len(a) == len(b)
+    for x, y in zip(a, b):
+        for k in ("computes", "cycles", "percent_utilization", "energy", "area"):
+            assert getattr(x, k) == pytest.approx(getattr(y, k), rel=1e-12, abs=0)
+        assert dict(x.per_component_energy) == pytest.approx(
+            dict(y.per_component_energy), rel=1e-12, abs=0
+        )
+        assert dict(x.per_component_area) == pytest.approx(
+            dict(y.per_component_area), rel=1e-12, abs=0
+        )
+        assert x.variables == y.variables
+
+
+def test_list_aggregate_by_matches_table():
+    results = sweep()
+    aggregated = results.aggregate_by("N_COLUMNS")
+    assert_same_results(aggregated, results.to_table().aggregate_by("N_COLUMNS"))
+
+    assert [r.variables["N_COLUMNS"] for r in aggregated] == [64, 128, 256]
+    first = aggregated[0]
+    assert first.computes == 1024 + 2048
+    assert first.cycles == 64 * 10 + 64 * 20
+    assert first.per_component_energy["buffer"] == pytest.approx(2e-12 + 4e-12)
+    assert first.per_component_area["adc"] == pytest.approx(64e-9)
+    assert first.per_component_area["buffer"] == pytest.approx(2e-10)
+    assert "LAYER" not in first.variables
+
+
+def test_list_split_by_keeps_results():
+    results = sweep()
+    split = results.split_by("LAYER")
+    assert [len(s) for s in split] == [3, 3]
+    assert all(isinstance(s, MacroOutputStatsList) for s in split)
+    assert split[0] == results[0::2] and split[1] == results[1::2]
+    assert [len(s) for s in results.split_by("N_COLUMNS", "LAYER")] == [1] * 6
+
+
+def test_table_round_trip():
+    results = sweep()
+    results[0].run_seconds = 1.5
+    table = results.to_table()
+    assert len(table) == len(results)
+    assert len(table.variable_sets) == len(results)
+    assert_same_results(table.to_list(), results)
+    assert table[0].run_seconds == 1.5
+    assert not hasattr(table[1], "run_seconds")
+    assert table[-1].mapping == "mapping"
+    assert_same_results(table.take([4, 1]), [results[4], results[1]])
+
+
+def test_table_combine_and_compare_refs():
+    results, table = sweep(), sweep().to_table()
+    for r in (results, table):
+        r.combine_per_component_energy(["adc", "buffer"], "total")
+        r.add_compare_ref_area("adc", [1.0] * len(results))
+        r.add_compare_ref("cycles", list(range(len(results))))
+    for t, r in zip(table, results):
+        assert dict(t.per_component_energy) == pytest.approx(
+            dict(r.per_component_energy), rel=1e-12, abs=0
+        )
+        assert t.per_component_area["adc"] == r.per_component_area["adc"]
+        assert t.cycles == r.cycles
+    assert table.get_compare_ref_area() == results.get_compare_ref_area()
+
+
+def test_table_group_by():
+    table = sweep().to_table()
+    groups, n_groups = table.group_by("N_COLUMNS")
+    assert n_groups == 3 and list(groups) == [0, 0, 1, 1, 2, 2]
+    groups, n_groups = table.group_by("LAYER", "cycles")
+    assert n_groups == 6
+
+    results = sweep()
+    results[2].variables["ONLY_SOMETIMES"] = 1
+    groups, n_groups = results.to_table().group_by("ONLY_SOMETIMES")
+    assert n_groups == 2 and list(groups) == [0, 0, 1, 0, 0, 0]
+
+    with pytest.raises(KeyError):
+        table.group_by("tops")
+    with pytest.raises(KeyError):
+        sweep().split_by("NOT_A_VARIABLE")
@@ -0,0 +1,226 @@
+"""
+Checks that the batch estimators in accelergy_plug_ins match the per-instance
+estimators they replace.
+"""
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+PLUG_IN_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "models",
+    "components",
+    "accelergy_plug_ins",
+)
+
+# The plug-ins import their own utils package, which scripts/utils.py shadows
+_scripts_utils = sys.modules.pop("utils", None)
+sys.path.insert(0, PLUG_IN_DIR)
+from misc import Capacitor, Wire, PassGate
+from X2X_ladder import DigitalAnalogConverter_C2C, DigitalAnalogConverter_R2R
+
+sys.path.remove(PLUG_IN_DIR)
+sys.modules.pop("utils", None)
+if _scripts_utils is not None:
+    sys.modules["utils"] = _scripts_utils
+
+
+def assert_close(batch, per_instance):
+    np.testing.assert_allclose(
+        np.asarray(batch, dtype=float),
+        np.asarray(per_instance, dtype=float),
+        rtol=1e-12,
+        atol=0,
+    )
+
+
+rng = random.Random(0)
+PROBABILITIES = [rng.random() for _ in range(9)]
+HISTS = [[rng.random() for _ in range(n)] for n in (16, 64, 255, 256)]
+
+CAPACITOR_ROWS = [
+    dict(
+        capacitance=rng.random() * 1e-14,
+        technology=rng.choice([7, 22, 65]),
+        voltage=rng.random(),
+        stacked=rng.random() < 0.3,
+        cap_f_per_m2=rng.choice([None, 0, 1e-3]),
+        energy_scale=rng.random(),
+    )
+    for _ in range(50)
+]
+WIRE_ROWS = [
+    dict(length=rng.random() * 1e-4, technology=22, voltage=rng.random())
+    for _ in range(20)
+]
+C2C_ROWS = [
+    dict(
+        resolution=rng.choice([4, 6, 8]),
+        voltage=rng.random(),
+        unit_capacitance=1e-15 * rng.random(),
+        technology=rng.choice([7, 22]),
+        hist=rng.choice(HISTS),
+        capacitors_are_stacked=rng.random() < 0.5,
+    )
+    for _ in range(40)
+]
+R2R_ROWS = [
+    dict(
+        resolution=r["resolution"],
+        voltage=r["voltage"],
+        unit_resistance=5000 * rng.random() + 1,
+        technology=r["technology"],
+        hist=r["hist"],
+        area_scale=2,
+    )
+    for r in C2C_ROWS
+]
+
+CAPACITOR_ACTIONS = [
+    ("read", {}),
+    ("write", {}),
+    ("leak", dict(global_cycle_seconds=1)),
+    ("raise_voltage_to", dict(target_voltage=0.3)),
+    ("switch", dict(value_probabilities=PROBABILITIES)),
+    (
+        "switch",
+        dict(
+            value_probabilities=PROBABILITIES,
+            zero_between_values=False,
+            supply_voltage=0.9,
+        ),
+    ),
+    ("charge", dict(value_probabilities=PROBABILITIES, charge_probability=0.4)),
+]
+
+
+def test_capacitor_area():
+    assert_close(
+        Capacitor.area_batch(CAPACITOR_ROWS),
+        [Capacitor(**r).get_area() for r in CAPACITOR_ROWS],
+    )
+
+
+@pytest.mark.parametrize("action,kwargs", CAPACITOR_ACTIONS)
+def test_capacitor_energy(action, kwargs):
+    assert_close(
+        Capacitor.energy_batch(action, CAPACITOR_ROWS, **kwargs),
+        [getattr(Capacitor(**r), action)(**kwargs) for r in CAPACITOR_ROWS],
+    )
+
+
+def test_wire_area():
+    assert_close(
+        Wire.area_batch(WIRE_ROWS), [Wire(**r).get_area() for r in WIRE_ROWS]
+    )
+
+
+@pytest.mark.parametrize(
+    "action,kwargs", [("read", {}), ("switch", dict(value_probabilities=PROBABILITIES))]
+)
+def test_wire_energy(action, kwargs):
+    assert_close(
+        Wire.energy_batch(action, WIRE_ROWS, **kwargs),
+        [getattr(Wire(**r), action)(**kwargs) for r in WIRE_ROWS],
+    )
+
+
+def test_wire_passes_voltage_to_capacitor():
+    capacitance = 1e-4 * 2e-10
+    wire = Wire(length=1e-4, technology=22, voltage=0.3)
+    assert wire.voltage == 0.3
+    assert_close(wire.capacitance, capacitance)
+    assert_close(
+        wire.read(), Capacitor(capacitance, technology=22, voltage=0.3).read()
+    )
+    assert wire.read() < Capacitor(capacitance, technology=22, voltage=0.7).read()
+
+
+def test_pass_gate_area():
+    technologies = [7, 22, 45]
+    assert_close(
+        PassGate.area_batch(dict(technology=technologies)),
+        [PassGate(t).get_area() for t in technologies],
+    )
+
+
+def test_c2c_area():
+    assert_close(
+        DigitalAnalogConverter_C2C.area_batch(C2C_ROWS),
+        [DigitalAnalogConverter_C2C(**r).get_area() for r in C2C_ROWS],
+    )
+
+
+def test_c2c_energy():
+    assert_close(
+        DigitalAnalogConverter_C2C.energy_batch("convert", C2C_ROWS),
+        [DigitalAnalogConverter_C2C(**r).convert() for r in C2C_ROWS],
+    )
+
+
+def test_c2c_energy_columns():
+    hist = HISTS[-1]
+    voltages = np.linspace(0.5, 1, 100)
+    columns = dict(
+        resolution=8,
+        voltage=voltages,
+        unit_capacitance=1e-15,
+        technology=22,
+        hist=[hist] * len(voltages),
+    )
+    energy = DigitalAnalogConverter_C2C.energy_batch("convert", columns)
+    assert_close(
+        energy[[0, -1]],
+        [DigitalAnalogConverter_C2C(8, v, 1e-15, 22, hist).convert() for v in (0.5, 1)],
+    )
+
+
+def test_c2c_passes_unit_capacitance_to_capacitor():
+    dac = DigitalAnalogConverter_C2C(
+        resolution=8, voltage=0.4, unit_capacitance=3e-15, technology=22, hist=HISTS[0]
+    )
+    assert dac.cap.capacitance == 3e-15
+    assert dac.cap.voltage == 0.4
+
+
+def test_r2r_area():
+    assert_close(
+        DigitalAnalogConverter_R2R.area_batch(R2R_ROWS),
+        [DigitalAnalogConverter_R2R(**r).get_area() for r in R2R_ROWS],
+    )
+
+
+def test_r2r_energy():
+    kwargs = dict(action_latency_cycles=2, cycle_seconds=1e-9)
+    assert_close(
+        DigitalAnalogConverter_R2R.energy_batch("convert", R2R_ROWS, **kwargs),
+        [DigitalAnalogConverter_R2R(**r).convert(**kwargs) for r in R2R_ROWS],
+    )
+
+
+# Accepted DAC energies with the conservative histogram resampler in
+# models/include/hist_resampling.py. Each entry is (histogram, resolution,
+# C-2C energy, R-2R energy over one 1 ns cycle).
+SMOOTH_HIST = [5, 5, 6, 6, 7, 7, 8, 8, 8, 7, 7, 6, 6, 5, 5]
+PEAKED_HIST = [0, 1, 3, 4, 3, 1, 0]
+ACCEPTED_DAC_ENERGIES = [
+    (SMOOTH_HIST, 2, 3.8230795312500e-14, 6.6465131250000e-14),
+    (SMOOTH_HIST, 4, 7.6280609535726e-14, 1.1483215357259e-13),
+    (SMOOTH_HIST, 8, 1.5244484436193e-13, 2.1802683619326e-13),
+    (PEAKED_HIST, 2, 3.8231433333333e-14, 6.6528933333333e-14),
+    (PEAKED_HIST, 4, 7.6276564583333e-14, 1.1442765833333e-13),
+    (PEAKED_HIST, 8, 1.5239366844923e-13, 2.1290924492270e-13),
+]
+
+
+@pytest.mark.parametrize("hist,resolution,c2c,r2r", ACCEPTED_DAC_ENERGIES)
+def test_dac_energies_match_accepted_values(hist, resolution, c2c, r2r):
+    dac = DigitalAnalogConverter_C2C(resolution, 0.7, 1e-15, 22, hist)
+    assert dac.convert() == pytest.approx(c2c, rel=1e-10, abs=0)
+    dac = DigitalAnalogConverter_R2R(resolution, 0.7, 5000, 22, hist)
+    energy = dac.convert(action_latency_cycles=1, cycle_seconds=1e-9)
+    assert energy == pytest.approx(r2r, rel=1e-10, abs=0)
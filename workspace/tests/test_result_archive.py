@@ -0,0 +1,109 @@
+"""
+Checks writing, reading, and crash recovery of result_archive.ResultArchive.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+)
+from result_archive import FILE_HEADER, ResultArchive
+from tl_output_parsing import MacroOutputStats
+
+
+def make_result(i, name="a", mapping=True):
+    variables = {
+        "INPUT_BITS": 8,
+        "WEIGHT_BITS": 8,
+        "OUTPUT_BITS": 8,
+        "ENCODED_INPUT_BITS": 1,
+        "ENCODED_WEIGHT_BITS": 1,
+        "ENCODED_OUTPUT_BITS": 1,
+        "NAME": name,
+    }
+    energy = {"adc": 1e-12 * (i + 1), "buffer": 2e-12}
+    if i % 2:
+        energy["dac"] = 3e-12 * i
+    return MacroOutputStats(
+        50.0 + i,
+        1024 * (i + 1),
+        100 * (i + 1),
+        1e-9,
+        energy,
+        {"adc": 1e-9, "buffer": 5e-10},
+        variables,
+        f"mapping {i}" if mapping else None,
+    )
+
+
+def assert_same(read, written):
+    assert len(read) == len(written)
+    for r, w in zip(read, written):
+        for k in ("percent_utilization", "computes", "cycles", "cycle_seconds"):
+            assert getattr(r, k) == getattr(w, k)
+        assert dict(r.per_component_energy) == dict(w.per_component_energy)
+        assert dict(r.per_component_area) == dict(w.per_component_area)
+        assert r.variables == w.variables
+        assert r.mapping == w.mapping
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "results.bin")
+    written = [make_result(i, name="ab"[i % 2]) for i in range(5)]
+    written.append(make_result(5, mapping=False))
+    written[0].run_seconds = 2.5
+
+    archive = ResultArchive(path)
+    archive.append(written[:3])
+    archive.append(written[3:])
+
+    table = ResultArchive(path).read()
+    assert len(ResultArchive(path)) == len(written)
+    assert_same(table, written)
+    assert len(table.variable_sets) == 2
+    assert table[0].run_seconds == 2.5
+    assert not hasattr(table[1], "run_seconds")
+
+
+@pytest.mark.parametrize("cut", [3, 20])
+def test_truncated_trailing_record(tmp_path, cut):
+    path = str(tmp_path / "results.bin")
+    written = [make_result(i) for i in range(3)]
+    ResultArchive(path).append(written)
+    size = os.path.getsize(path)
+    ResultArchive(path).append([make_result(3)])
+    with open(path, "r+b") as f:
+        f.truncate(size + cut)  # As if the last append crashed
+
+    assert_same(ResultArchive(path).read(), written)
+
+    # The next append removes the partial record
+    ResultArchive(path).append([make_result(4, name="b")])
+    assert_same(ResultArchive(path).read(), written + [make_result(4, name="b")])
+
+
+def test_append_after_file_replaced(tmp_path):
+    path, other = str(tmp_path / "results.bin"), str(tmp_path / "other.bin")
+    archive = ResultArchive(path)
+    archive.append([make_result(0)])
+    ResultArchive(other).append([make_result(1, name="b")])
+    os.replace(other, path)
+
+    # Variables of "a" are no longer in the file and must be written again
+    archive.append([make_result(2)])
+    assert_same(ResultArchive(path).read(), [make_result(1, name="b"), make_result(2)])
+
+
+def test_empty_archive(tmp_path):
+    path = str(tmp_path / "results.bin")
+    assert len(ResultArchive(path)) == 0
+    assert len(ResultArchive(path).read()) == 0
+
+    ResultArchive(path).append([])
+    assert os.path.getsize(path) == FILE_HEADER.size
+    assert len(ResultArchive(path).read()) == 0
+
+    ResultArchive(path).append([make_result(0)])
+    assert_same(ResultArchive(path).read(), [make_result(0)])
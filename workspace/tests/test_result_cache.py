@@ -0,0 +1,50 @@
+"""
+Checks the results run_mapper returns from result_cache.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+)
+import result_cache
+import utils
+from tl_output_parsing import MacroOutputStats
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_cache, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(result_cache, "process_copy", lambda spec: spec)
+    monkeypatch.setattr(result_cache, "spec_hash", lambda *args, **kwargs: "key")
+    return tmp_path
+
+
+VARIABLES = {
+    "INPUT_BITS": 8,
+    "WEIGHT_BITS": 8,
+    "OUTPUT_BITS": 8,
+    "ENCODED_INPUT_BITS": 1,
+    "ENCODED_WEIGHT_BITS": 1,
+    "ENCODED_OUTPUT_BITS": 1,
+}
+
+
+def store_result():
+    result = MacroOutputStats(
+        50.0, 1024, 100, 1e-9, {"adc": 1e-12}, {"adc": 1e-9}, VARIABLES, None
+    )
+    result.run_id = "run-00001"
+    result.artifacts = {"timeloop-mapper.map.yaml": "/gone/timeloop-mapper.map.yaml"}
+    result_cache.store("key", result)
+
+
+@pytest.mark.parametrize("mapping_file", [None, [{"target": "buffer"}]])
+def test_cache_hits_drop_run_files(mapping_file):
+    store_result()
+    result = utils.run_mapper("spec", mapping_file=mapping_file, use_cache=True)
+    assert result.run_id is None
+    assert result.artifacts == {}
+    assert result.per_component_energy["adc"] == 1e-12
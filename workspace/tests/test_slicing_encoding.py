@@ -0,0 +1,225 @@
+"""
+Checks the histogram encodings in models/include/slicing_encoding.py and the
+resampling they share with the plug-ins.
+"""
+import os
+import pickle
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "models", "include")
+)
+import slicing_encoding as se
+from hist_resampling import resample_hist, resample_hist_to_bits, zero_bin
+
+PEAKED_HIST = [0, 1, 3, 4, 3, 1, 0]
+SMOOTH_HIST = [5, 5, 6, 6, 7, 7, 8, 8, 8, 7, 7, 6, 6, 5, 5]
+
+
+@pytest.mark.parametrize("hist", [PEAKED_HIST, SMOOTH_HIST])
+@pytest.mark.parametrize("n_bins", [1, 3, 7, 15, 255])
+def test_resampling_conserves_mass_and_zero(hist, n_bins):
+    resampled = resample_hist(hist, n_bins)
+    assert len(resampled) == n_bins
+    assert resampled.sum() == pytest.approx(sum(hist), rel=1e-12)
+    assert resampled[zero_bin(n_bins)] >= hist[zero_bin(len(hist))]
+
+
+def test_resampling_to_same_bins_is_identity():
+    assert list(resample_hist(SMOOTH_HIST, len(SMOOTH_HIST))) == SMOOTH_HIST
+
+
+@pytest.mark.parametrize(
+    "encoder", [se.offset_encode_hist, se.magnitude_encode_hist, se.xnor_encode_hist]
+)
+def test_encoders_resample_to_n_bits(encoder):
+    assert encoder(PEAKED_HIST, 0) == encoder(PEAKED_HIST)
+    encoded = encoder(PEAKED_HIST, 4)
+    expected = encoder(resample_hist_to_bits(PEAKED_HIST, 4).tolist())
+    assert len(encoded) == 15
+    np.testing.assert_array_equal(encoded.bits, expected.bits)
+    np.testing.assert_allclose(encoded.probabilities, expected.probabilities)
+
+
+# ==============================================================================
+# Reference: the per-value, list-based encoders the vectorized ones replaced
+# ==============================================================================
+
+
+def ref_magnitude(weights):
+    n_bits = se.get_num_bits(weights)
+    half = len(weights) / 2
+    encoded = []
+    for i, w in enumerate(weights):
+        normed = round(abs(se.norm(i, len(weights), -half + 0.5, half + 0.5)))
+        bits = [int(b) for b in bin(normed)[2:].zfill(n_bits)]
+        encoded.append(se.ProbableBits(bits[1:], w))
+    return ref_norm(encoded)
+
+
+def ref_two_part_magnitude(weights):
+    encoded = []
+    for e in ref_magnitude(weights):
+        encoded.append(se.ProbableBits(e.bits, e.probability / 2))
+        encoded.append(se.ProbableBits([0] * len(e.bits), e.probability / 2))
+    return encoded
+
+
+def ref_offset(weights):
+    n_bits = se.get_num_bits(weights)
+    encoded = []
+    for i, w in enumerate(weights):
+        normed = round(se.norm(i, len(weights), 0, len(weights)))
+        bits = [int(b) for b in bin(normed)[2:].zfill(n_bits)]
+        encoded.append(se.ProbableBits(bits, w))
+    return ref_norm(encoded)
+
+
+def ref_xnor(weights):
+    n_bits = se.get_num_bits(weights)
+    half = len(weights) / 2
+    encoded = []
+    for i, w in enumerate(weights):
+        normed = se.norm(i, len(weights), -half + 0.5, half + 0.5)
+        bits = []
+        for j in list(range(n_bits - 1, -1, -1)) + [-1, -1]:
+            bits.append(int(normed > 0))
+            normed -= 2**j * (2 * bits[-1] - 1)
+        encoded.append(se.ProbableBits(bits, w))
+    return ref_norm(encoded)
+
+
+def ref_zero_gated_xnor(weights):
+    encoded = ref_xnor(weights)
+    zero = encoded[len(encoded) // 2]
+    encoded[len(encoded) // 2] = se.ProbableBits([0] * len(zero.bits), zero.probability)
+    return encoded
+
+
+def ref_if_signed(signed, unsigned):
+    def encode(weights):
+        return (signed if se.is_hist_signed(weights) else unsigned)(weights)
+
+    return encode
+
+
+def ref_norm(encoded):
+    total = sum(e.probability for e in encoded)
+    return [se.ProbableBits(e.bits, e.probability / total) for e in encoded]
+
+
+def ref_avg_slice(encoded, total_bits, bits_per_slice, full_range, per_slice):
+    if isinstance(bits_per_slice, int):
+        bits_per_slice = [bits_per_slice] * (total_bits // bits_per_slice)
+        if sum(bits_per_slice) != total_bits:
+            bits_per_slice.append(total_bits - sum(bits_per_slice))
+    bit2slice = []
+    max_val = max(2 ** max(bits_per_slice) - 1, 1)
+    for i, b in enumerate(bits_per_slice):
+        m = max(2**b - 1, 1) if full_range else max_val
+        bit2slice += [(i, max(2 ** (b - j - 1), 1) / m) for j in range(b)]
+    slices = [0] * len(bits_per_slice)
+    for e in encoded:
+        for i in range(total_bits):
+            bit = e.bits[i] if i < len(e.bits) else sum(e.bits) / len(e.bits)
+            slices[bit2slice[i][0]] += bit * e.probability * bit2slice[i][1]
+    return slices if per_slice else sum(slices) / len(slices)
+
+
+ENCODERS = [
+    (se.magnitude_encode_hist, ref_magnitude),
+    (se.two_part_magnitude_encode_hist, ref_two_part_magnitude),
+    (se.offset_encode_hist, ref_offset),
+    (
+        se.offset_encode_if_signed_hist,
+        ref_if_signed(ref_offset, ref_magnitude),
+    ),
+    (
+        se.two_part_magnitude_encode_if_signed_hist,
+        ref_if_signed(ref_two_part_magnitude, ref_magnitude),
+    ),
+    (se.xnor_encode_hist, ref_xnor),
+    (se.zero_gated_xnor_encode_hist, ref_zero_gated_xnor),
+]
+
+
+def random_hists():
+    rng = np.random.default_rng(0)
+    hists = []
+    for n_bits in range(1, 9):
+        n_bins = 2**n_bits - 1
+        hists.append(rng.integers(0, 100, n_bins).tolist())
+        unsigned = rng.random(n_bins)
+        unsigned[: n_bins // 2] = 0
+        hists.append(unsigned.tolist())
+    return hists
+
+
+def assert_same_encoding(encoded, expected):
+    assert len(encoded) == len(expected)
+    for e, r in zip(encoded, expected):
+        assert e.bits == r.bits
+        assert e.probability == pytest.approx(r.probability, rel=1e-12, abs=0)
+
+
+@pytest.mark.parametrize("encoder, reference", ENCODERS)
+def test_encoders_match_reference(encoder, reference):
+    for hist in random_hists():
+        assert_same_encoding(encoder(hist), reference(hist))
+
+
+@pytest.mark.parametrize("full_range", [False, True])
+@pytest.mark.parametrize("per_slice", [False, True])
+def test_avg_slice_matches_reference(full_range, per_slice):
+    for hist in random_hists():
+        for encoder, reference in ENCODERS:
+            encoded, expected = encoder(hist), reference(hist)
+            if not encoded.n_bits:
+                continue  # A 1-bit magnitude has no bits to slice
+            for total_bits in {len(encoded[0].bits), len(encoded[0].bits) + 2}:
+                for bits_per_slice in (1, 2, 3, [total_bits]):
+                    args = (total_bits, bits_per_slice, full_range, per_slice)
+                    np.testing.assert_allclose(
+                        se.encoded_hist_to_avg_slice(encoded, *args),
+                        ref_avg_slice(expected, *args),
+                        rtol=1e-12,
+                        atol=0,
+                    )
+
+
+# ==============================================================================
+# EncodedHist behaves like a list of ProbableBits
+# ==============================================================================
+
+
+def test_encoded_hist_is_a_list():
+    encoded = se.offset_encode_hist(PEAKED_HIST)
+    expected = ref_offset(PEAKED_HIST)
+    assert isinstance(encoded, list)
+    assert encoded == expected
+    assert encoded[1:3] == expected[1:3]
+    assert encoded[::-1] == expected[::-1]
+    assert list(reversed(encoded)) == expected[::-1]
+    assert encoded + [] == expected
+    assert pickle.loads(pickle.dumps(encoded)) == expected
+
+
+def test_editing_updates_arrays_and_not_the_cache():
+    encoded = se.xnor_encode_hist(PEAKED_HIST)
+    zero = len(encoded) // 2
+    encoded[zero] = se.ProbableBits([0] * encoded.n_bits, encoded[zero].probability)
+    assert encoded == ref_zero_gated_xnor(PEAKED_HIST)
+    np.testing.assert_array_equal(
+        encoded.bits, se.zero_gated_xnor_encode_hist(PEAKED_HIST).bits
+    )
+
+    encoded.append(se.ProbableBits([1] * encoded.n_bits, 0.5))
+    del encoded[0]
+    assert len(encoded.bits) == len(encoded.probabilities) == len(PEAKED_HIST)
+    assert encoded.probabilities[-1] == 0.5
+
+    # The cached result is unchanged
+    assert se.xnor_encode_hist(PEAKED_HIST) == ref_xnor(PEAKED_HIST)